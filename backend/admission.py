@@ -0,0 +1,224 @@
+"""
+Admission control: cost estimates and two lanes of conversion capacity.
+
+Without it every operation competes for the same workers, and a few
+500-page PDF to Word conversions hold them while 50 KB rotations wait.
+Before a conversion runs, its cost is estimated from the operation and the
+size of its input: the page count for PDFs (read from the xref, without
+parsing the pages) or the file size for everything else. Cheap work runs in
+the light lane (the fast lane), everything else in the heavy lane. Each lane
+has its own concurrency limit and a bounded queue, and the heavy lane also
+caps the total cost in flight, which stands in for its memory use.
+
+Requests are turned away rather than queued without end: a full queue
+answers 429, a wait longer than ADMISSION_QUEUE_TIMEOUT_SECONDS answers
+503, both with a Retry-After estimated from the lane's recent run times.
+Background work (jobs, batches) waits for capacity instead.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from executor import parse_limits
+
+# Cost per page (PDF input) or per started MB (other input); operations not listed cost 1
+ADMISSION_COSTS = parse_limits(os.getenv(
+    "ADMISSION_COSTS",
+    "pdf-to-word=20,pdf-to-excel=10,pdf-to-pptx=10,pdf-to-jpg=5,compress=3,pipeline=3,"
+    "docx=30,pptx=30,html=30,xlsx=20,image=5"
+))
+# Work up to this cost takes the fast lane
+FAST_LANE_MAX_COST = int(os.getenv("FAST_LANE_MAX_COST", "100"))
+LIGHT_CONCURRENCY = int(os.getenv("LIGHT_CONCURRENCY", "8"))
+LIGHT_QUEUE_DEPTH = int(os.getenv("LIGHT_QUEUE_DEPTH", "100"))
+HEAVY_CONCURRENCY = int(os.getenv("HEAVY_CONCURRENCY", "2"))
+HEAVY_QUEUE_DEPTH = int(os.getenv("HEAVY_QUEUE_DEPTH", "20"))
+# Total cost of the heavy work running at once; 0 disables. A single job above it still runs, alone.
+HEAVY_COST_BUDGET = int(os.getenv("HEAVY_COST_BUDGET", "10000"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+class AdmissionRejected(Exception):
+    """The lane is saturated. Carries the HTTP status and Retry-After to answer with."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def estimate_cost(operation: str, input_path: str, pages: int = None) -> int:
+    """
+    Estimated cost of running operation on input_path. pages overrides the
+    page count, for callers that only process a selection.
+    """
+    if pages is None:
+        pages = _page_count(input_path)
+    if pages is None:
+        pages = math.ceil(os.path.getsize(input_path) / (1024 * 1024))
+    return ADMISSION_COSTS.get(operation, 1) * max(1, pages)
+
+
+def _page_count(input_path: str):
+    """Page count of a PDF, or None for other (or unreadable) files."""
+    with open(input_path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            return None
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(input_path) as doc:
+            return doc.page_count
+    except Exception:
+        # Damaged: the conversion repairs it first, so assume the worst
+        return None
+
+
+class Lane:
+    """A pool of conversion slots with a bounded FIFO queue in front of it."""
+
+    def __init__(self, name: str, concurrency: int, queue_depth: int, cost_budget: int = 0):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = queue_depth
+        self.cost_budget = cost_budget
+        self.active = 0
+        self.cost_in_flight = 0
+        self.waiters = deque()  # [future, cost]
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.average_seconds = None
+
+    def _fits(self, cost: int) -> bool:
+        if self.active >= self.concurrency:
+            return False
+        return not self.cost_budget or self.active == 0 or self.cost_in_flight + cost <= self.cost_budget
+
+    def _take(self, cost: int):
+        self.active += 1
+        self.cost_in_flight += cost
+        self.admitted += 1
+
+    def _wake(self):
+        # Strict FIFO: a big job at the head is not overtaken, so it cannot starve
+        while self.waiters and self._fits(self.waiters[0][1]):
+            future, cost = self.waiters.popleft()
+            if not future.done():
+                self._take(cost)
+                future.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until a new arrival would likely get a slot."""
+        average = self.average_seconds or 5.0
+        seconds = average * (len(self.waiters) + 1) / self.concurrency
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(seconds)))
+
+    async def acquire(self, cost: int, wait: bool):
+        if not self.waiters and self._fits(cost):
+            self._take(cost)
+            return
+        if not wait and len(self.waiters) >= self.queue_depth:
+            self.rejected += 1
+            raise AdmissionRejected(429, "Too many conversions queued. Please try again later.", self.retry_after())
+
+        entry = [asyncio.get_running_loop().create_future(), cost]
+        self.waiters.append(entry)
+        try:
+            if wait:
+                await entry[0]
+            else:
+                await asyncio.wait_for(entry[0], ADMISSION_QUEUE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if entry in self.waiters:
+                self.waiters.remove(entry)
+            elif entry[0].done() and not entry[0].cancelled():
+                # Got the slot just as it gave up
+                self.release(cost)
+            # The head may have been what held the others back
+            self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise AdmissionRejected(503, "Server is busy processing other files. Please try again shortly.",
+                                        self.retry_after())
+            raise
+
+    def release(self, cost: int, seconds: float = None):
+        self.active -= 1
+        self.cost_in_flight -= cost
+        if seconds is not None:
+            self.average_seconds = seconds if self.average_seconds is None else 0.8 * self.average_seconds + 0.2 * seconds
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "queue_depth": self.queue_depth,
+            "cost_in_flight": self.cost_in_flight,
+            "cost_budget": self.cost_budget,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "average_seconds": round(self.average_seconds, 3) if self.average_seconds is not None else None,
+        }
+
+
+class Ticket:
+    """A slot held in a lane until release() is called."""
+
+    def __init__(self, lane: Lane, cost: int):
+        self.lane = lane
+        self.cost = cost
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.lane.release(self.cost, time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """Sends each conversion to the light or the heavy lane by its estimated cost."""
+
+    def __init__(self):
+        self.lanes = {
+            "light": Lane("light", LIGHT_CONCURRENCY, LIGHT_QUEUE_DEPTH),
+            "heavy": Lane("heavy", HEAVY_CONCURRENCY, HEAVY_QUEUE_DEPTH, HEAVY_COST_BUDGET),
+        }
+
+    def lane_for(self, cost: int) -> Lane:
+        return self.lanes["light" if cost <= FAST_LANE_MAX_COST else "heavy"]
+
+    async def acquire(self, cost: int, wait: bool = False) -> Ticket:
+        """
+        Wait for a slot for work of the given cost. Raises AdmissionRejected
+        when the queue is full or the wait too long, unless wait is set.
+        """
+        lane = self.lane_for(cost)
+        await lane.acquire(cost, wait)
+        return Ticket(lane, cost)
+
+    @asynccontextmanager
+    async def admit(self, cost: int, wait: bool = False):
+        ticket = await self.acquire(cost, wait)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            "fast_lane_max_cost": FAST_LANE_MAX_COST,
+            **{name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,291 @@
+"""
+Batch conversion of office documents to PDF, streamed back as a ZIP.
+
+A batch is any number of DOCX, PPTX, XLSX and HTML files, uploaded as
+separate parts or packed in ZIP archives. Every document goes through the
+operation for its type, so results are cached and shared with the
+single-file endpoints. Documents for LibreOffice go to the warm instance
+pool when it runs. Without the pool they are grouped by type into soffice
+runs of up to LIBREOFFICE_BATCH_SIZE files, so a batch pays one soffice
+start per group instead of one per file.
+
+Each PDF is added to the ZIP as soon as it is ready. A document that cannot
+be converted does not fail the batch: it is listed in errors.json, the last
+entry of the ZIP.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import posixpath
+import zipfile
+from pathlib import Path
+
+from admission import admission_controller, estimate_cost
+from cache import result_cache, cache_key
+from converter import libreoffice_mode, convert_many_with_libreoffice
+from executor import run_in_thread
+from operations import get_operation, run_operation
+from uploads import MAX_UPLOAD_BYTES, MAX_FILE_SIZE_MB, sniff_kind
+from zip_stream import ZipStream
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_UPLOAD_MB = float(os.getenv("BATCH_MAX_UPLOAD_MB", "500"))
+BATCH_MAX_UPLOAD_BYTES = int(BATCH_MAX_UPLOAD_MB * 1024 * 1024)
+# Documents per soffice run when the warm pool is not available
+LIBREOFFICE_BATCH_SIZE = int(os.getenv("LIBREOFFICE_BATCH_SIZE", "20"))
+# Conversions (or soffice runs) in flight per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+BATCH_OPERATIONS = ("docx", "pptx", "xlsx", "html")
+# Operations whose converter goes through LibreOffice first
+LIBREOFFICE_OPERATIONS = ("docx", "pptx", "html")
+# Extension -> operation name
+BATCH_EXTENSIONS = {
+    extension: name for name in BATCH_OPERATIONS for extension in get_operation(name).extensions
+}
+ERRORS_ENTRY = "errors.json"
+COPY_CHUNK = 1024 * 1024
+
+
+class BatchItem:
+    """One document of a batch."""
+
+    def __init__(self, name: str, path: str, operation: str, sha256: str):
+        self.name = name  # where it came from: the upload's file name or its path in a ZIP
+        self.path = path
+        self.operation = operation
+        self.sha256 = sha256
+        self.output_path = os.path.splitext(path)[0] + ".pdf"
+        self.error = None
+
+
+class BatchCollector:
+    """Sorts uploaded files into convertible documents and failures."""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.join(directory, "batch")
+        os.makedirs(self.directory, exist_ok=True)
+        self.items = []
+        self.failures = []
+        self.total_bytes = 0
+
+    def add(self, name: str, path: str, size: int, sha256: str):
+        """Queue a document already on disk, or record why it cannot be converted."""
+        extension = Path(name).suffix.lower()
+        operation = BATCH_EXTENSIONS.get(extension)
+        error = None
+        if operation is None:
+            error = "Unsupported file type. Use DOCX, PPTX, XLSX or HTML files."
+        elif size > MAX_UPLOAD_BYTES:
+            error = f"File too large. Maximum size is {MAX_FILE_SIZE_MB:g} MB."
+        elif len(self.items) >= BATCH_MAX_FILES:
+            error = f"Too many files. At most {BATCH_MAX_FILES} per batch."
+        elif sniff_kind(path) not in get_operation(operation).kinds:
+            error = "The file content does not match its extension."
+        if error:
+            self.failures.append((name, error))
+            os.remove(path)
+            return
+
+        # Numbered names keep the file stems unique for soffice's output names
+        target = os.path.join(self.directory, f"{len(self.items):05d}{extension}")
+        os.replace(path, target)
+        self.items.append(BatchItem(name, target, operation, sha256))
+
+    def add_archive(self, name: str, path: str):
+        """Queue every document inside a ZIP archive."""
+        try:
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    member = _member_name(info)
+                    if member is None:
+                        continue
+                    member = f"{Path(name).stem}/{member}"
+                    try:
+                        self._extract(archive, info, member)
+                    except (zipfile.BadZipFile, RuntimeError, ValueError, OSError) as e:
+                        # Corrupt or encrypted member
+                        self.failures.append((member, f"Could not extract: {e}"))
+        except zipfile.BadZipFile as e:
+            self.failures.append((name, f"Not a valid ZIP archive: {e}"))
+        finally:
+            os.remove(path)
+
+    def _extract(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, member: str):
+        # Sizes in the ZIP directory can lie, so the copy enforces the limits too
+        limit = min(MAX_UPLOAD_BYTES, BATCH_MAX_UPLOAD_BYTES - self.total_bytes)
+        too_large = (f"File too large. Maximum size is {MAX_FILE_SIZE_MB:g} MB, "
+                     f"{BATCH_MAX_UPLOAD_MB:g} MB for the whole batch.")
+        if info.file_size > limit:
+            self.failures.append((member, too_large))
+            return
+        target = os.path.join(self.directory, f"extracting{Path(member).suffix.lower()}")
+        digest = hashlib.sha256()
+        size = 0
+        with archive.open(info) as source, open(target, "wb") as f:
+            while chunk := source.read(COPY_CHUNK):
+                size += len(chunk)
+                if size > limit:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        if size > limit:
+            os.remove(target)
+            self.failures.append((member, too_large))
+            return
+        self.total_bytes += size
+        self.add(member, target, size, digest.hexdigest())
+
+
+def _member_name(info: zipfile.ZipInfo):
+    """The member's relative path inside the archive, or None for folders and system files."""
+    if info.is_dir():
+        return None
+    parts = [part for part in posixpath.normpath(info.filename.replace("\\", "/")).split("/")
+             if part not in ("", ".", "..")]
+    if not parts or parts[0] == "__MACOSX" or parts[-1].startswith("."):
+        return None
+    return "/".join(parts)
+
+
+def collect_documents(uploads: list, directory: str) -> tuple:
+    """
+    Sort ingested files into batch items, expanding ZIP archives.
+
+    Returns (items, failures), failures being (name, error) pairs.
+    """
+    collector = BatchCollector(directory)
+    for upload in uploads:
+        if upload.filename.lower().endswith(".zip") and upload.kind == "zip":
+            collector.add_archive(upload.filename, upload.path)
+        else:
+            collector.add(upload.filename, upload.path, upload.size, upload.sha256)
+    return collector.items, collector.failures
+
+
+async def _convert_one(item: BatchItem):
+    """Convert a single document the way its own endpoint would, recording any error on the item."""
+    try:
+        await run_operation(get_operation(item.operation), item.path, item.output_path, {}, input_digest=item.sha256,
+                            wait_for_capacity=True)
+        if not os.path.exists(item.output_path):
+            raise RuntimeError("Conversion produced no output")
+    except Exception as e:
+        item.error = str(e) or e.__class__.__name__
+
+
+async def _convert_group(items: list):
+    """
+    Convert documents of one type with a single soffice run, after the cache,
+    recording any error on the documents it left without a PDF.
+    """
+    try:
+        await _convert_group_once(items)
+    except Exception as e:
+        for item in items:
+            if item.error is None and not os.path.exists(item.output_path):
+                item.error = str(e) or e.__class__.__name__
+
+
+async def _convert_group_once(items: list):
+    uncached = []
+    for item in items:
+        key = cache_key(item.sha256, item.operation, {})
+        if not await run_in_thread("cache", result_cache.fetch, key, item.output_path):
+            uncached.append(item)
+
+    cost = 0
+    for item in uncached:
+        cost += await run_in_thread("admission", estimate_cost, item.operation, item.path)
+    async with admission_controller.admit(cost, wait=True):
+        failed = await run_in_thread("batch", convert_many_with_libreoffice,
+                                     [(item.path, item.output_path) for item in uncached])
+    failed_inputs = {input_path for input_path, _ in failed}
+    for item in uncached:
+        if item.path in failed_inputs:
+            # Retried alone, with the built-in renderer as the fallback
+            await _convert_one(item)
+        else:
+            await run_in_thread("cache", result_cache.store, cache_key(item.sha256, item.operation, {}),
+                                item.output_path)
+
+
+async def _plan(items: list) -> list:
+    """Split the batch into units of work: single documents, or groups for one soffice run."""
+    mode = None
+    if any(item.operation in LIBREOFFICE_OPERATIONS for item in items):
+        mode = await run_in_thread("batch", libreoffice_mode)
+
+    units = []
+    for operation in BATCH_OPERATIONS:
+        same_type = [item for item in items if item.operation == operation]
+        if mode == "one-shot" and operation in LIBREOFFICE_OPERATIONS:
+            units += [same_type[i:i + LIBREOFFICE_BATCH_SIZE] for i in range(0, len(same_type), LIBREOFFICE_BATCH_SIZE)]
+        else:
+            units += [[item] for item in same_type]
+    return units
+
+
+def _unit_coroutine(unit: list):
+    return _convert_one(unit[0]) if len(unit) == 1 else _convert_group(unit)
+
+
+def _zip_name(item: BatchItem, taken: set) -> str:
+    stem = os.path.splitext(item.name)[0]
+    name = stem + ".pdf"
+    counter = 2
+    while name in taken:
+        name = f"{stem} ({counter}).pdf"
+        counter += 1
+    taken.add(name)
+    return name
+
+
+async def stream_batch(items: list, failures: list):
+    """Async generator yielding the bytes of a ZIP with one PDF per converted document."""
+    remaining = iter(await _plan(items))
+    pending = set()
+    archive = ZipStream()
+    taken = {ERRORS_ENTRY}
+    failures = list(failures)
+
+    def submit_next():
+        unit = next(remaining, None)
+        if unit is not None:
+            task = asyncio.ensure_future(_unit_coroutine(unit))
+            task.unit = unit
+            pending.add(task)
+
+    try:
+        for _ in range(max(1, BATCH_CONCURRENCY)):
+            submit_next()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                submit_next()
+                if not task.cancelled() and task.exception() is not None:
+                    error = task.exception()
+                    for item in task.unit:
+                        item.error = item.error or str(error) or error.__class__.__name__
+                for item in task.unit:
+                    if item.error is None and not os.path.exists(item.output_path):
+                        item.error = "Conversion produced no output"
+                    if item.error is None:
+                        yield archive.add_file(_zip_name(item, taken), item.output_path)
+                        os.remove(item.output_path)
+                    else:
+                        failures.append((item.name, item.error))
+                    # Free the disk as the batch goes
+                    if os.path.exists(item.path):
+                        os.remove(item.path)
+
+        if failures:
+            report = [{"file": name, "error": error} for name, error in failures]
+            yield archive.add(ERRORS_ENTRY, json.dumps(report, indent=2).encode())
+        yield archive.close()
+    finally:
+        # Client went away: drop the work still running
+        for task in pending:
+            task.cancel()
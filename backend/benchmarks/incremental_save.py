@@ -0,0 +1,85 @@
+"""
+Compare incremental saves with full rewrites for light PDF edits.
+
+Builds a scan-like PDF (one unique photo per page) and times rotate, crop,
+watermark and page numbers both ways, with the output size of each.
+
+Run from the backend directory:
+    python benchmarks/incremental_save.py --pages 200 --image-kb 400
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from pdf_editor import (
+    open_for_edit, finish_edit, prefers_incremental_save,
+    rotate_document, crop_document, watermark_document, number_document
+)
+
+EDITS = {
+    "rotate": lambda doc: rotate_document(doc, 90),
+    "crop": lambda doc: crop_document(doc, 50),
+    "watermark": lambda doc: watermark_document(doc, "CONFIDENTIAL"),
+    "page-numbers": lambda doc: number_document(doc),
+}
+
+
+def build_input(path: str, pages: int, image_kb: int):
+    """A PDF whose pages each show a different noisy JPEG of about image_kb."""
+    side = int((image_kb * 1024 / 1.2) ** 0.5)
+    doc = fitz.open()
+    for _ in range(pages):
+        image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=40)
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    doc.save(path)
+
+
+def run(input_path: str, workdir: str, edit: str, incremental: bool) -> tuple:
+    output_path = os.path.join(workdir, f"{edit}_{'incr' if incremental else 'full'}.pdf")
+    started = time.perf_counter()
+    doc, used_incremental = open_for_edit(input_path, output_path, incremental=incremental)
+    EDITS[edit](doc)
+    finish_edit(doc, output_path, used_incremental)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(output_path)
+    os.remove(output_path)
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=400)
+    parser.add_argument("--input", help="Use an existing PDF instead of a generated one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = args.input or os.path.join(workdir, "input.pdf")
+        if not args.input:
+            build_input(input_path, args.pages, args.image_kb)
+        size = os.path.getsize(input_path)
+        with fitz.open(input_path) as doc:
+            page_count = len(doc)
+        print(f"Input: {page_count} pages, {size / 1024 / 1024:.1f} MB, "
+              f"heuristic picks {'incremental' if prefers_incremental_save(size, page_count) else 'full rewrite'}")
+        print(f"{'edit':<14}{'full s':>9}{'incr s':>9}{'full MB':>10}{'incr MB':>10}")
+        for edit in EDITS:
+            full_time, full_size = run(input_path, workdir, edit, incremental=False)
+            incr_time, incr_size = run(input_path, workdir, edit, incremental=True)
+            print(f"{edit:<14}{full_time:>9.2f}{incr_time:>9.2f}"
+                  f"{full_size / 1024 / 1024:>10.1f}{incr_size / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
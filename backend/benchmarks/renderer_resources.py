@@ -0,0 +1,79 @@
+"""
+Measure what the shared renderer resources save on every request.
+
+Times building each resource from scratch (what every conversion used to
+do) against fetching it from renderer_resources once it is loaded. Parts
+whose libraries or font file are missing are reported as skipped.
+
+Run from the backend directory:
+    python benchmarks/renderer_resources.py --repeat 50 --font /path/to/font.ttf
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import renderer_resources
+
+
+def per_call(func, repeat: int) -> float:
+    """Average milliseconds per call."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def fresh_stylesheet():
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    getSampleStyleSheet()
+
+
+def fresh_reportlab_font(path: str):
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    def load():
+        TTFont("BenchmarkFont", path)
+    return load
+
+
+def fresh_font_config():
+    from weasyprint.text.fonts import FontConfiguration
+
+    FontConfiguration()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--font", default=renderer_resources.UNICODE_FONT_PATH,
+                        help="TTF file to load (defaults to the bundled Roboto)")
+    args = parser.parse_args()
+
+    if args.font != renderer_resources.UNICODE_FONT_PATH:
+        renderer_resources.UNICODE_FONT_PATH = args.font
+    started = time.perf_counter()
+    renderer_resources.warm_up()
+    print(f"warm_up: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    cases = [
+        ("sample stylesheet", lambda: fresh_stylesheet, renderer_resources.sample_stylesheet),
+        ("TTF font (reportlab)", lambda: fresh_reportlab_font(args.font), renderer_resources.unicode_font),
+        ("WeasyPrint FontConfiguration", lambda: fresh_font_config, renderer_resources.weasyprint_font_config),
+    ]
+    print(f"{'resource':<30}{'fresh ms':>10}{'shared ms':>11}")
+    for name, make_fresh, shared in cases:
+        try:
+            fresh = per_call(make_fresh(), args.repeat)
+        except Exception as e:
+            # Library, system dependency or font file missing
+            print(f"{name:<30}{'skipped':>10}  ({e.__class__.__name__}: {e})")
+            continue
+        print(f"{name:<30}{fresh:>10.2f}{per_call(shared, args.repeat):>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Measure backend cold start: import time, time to first response and the
+latency of the first conversion requests.
+
+Starts the API with uvicorn in a scratch directory (own database, cache
+and job storage) for every run, so each run is a real cold start. The
+first requests are a page rotation (PyMuPDF) and an image to PDF
+conversion (PIL, img2pdf).
+
+Run from the backend directory:
+    python benchmarks/startup.py --runs 3
+    python benchmarks/startup.py --warmup "" --record    # no warm-up, add to history
+
+--record appends the medians to benchmarks/startup_history.csv, which is
+kept in the repository to track cold start over time.
+"""
+import argparse
+import csv
+import io
+import os
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import date
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_PATH = os.path.join(BACKEND_DIR, "benchmarks", "startup_history.csv")
+HISTORY_FIELDS = ["date", "commit", "warmup", "import_s", "first_response_s", "first_rotate_s", "first_image_s"]
+
+
+def sample_pdf() -> bytes:
+    """A one-page PDF, written by hand so the benchmark itself imports nothing heavy."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def sample_png() -> bytes:
+    """A small gray PNG, also written by hand."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    width = height = 64
+    rows = b"".join(b"\x00" + b"\x80" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def post_file(url: str, filename: str, data: bytes) -> float:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+    })
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def import_time(env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cold_start(env: dict) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR, "--port", str(port)],
+        cwd=env["INSTANTPDF_SCRATCH"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("The server exited during startup")
+            try:
+                with urllib.request.urlopen(base + "/", timeout=1):
+                    break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        first_response = time.perf_counter() - started
+        return {
+            "first_response_s": first_response,
+            "first_rotate_s": post_file(base + "/edit/rotate-pdf", "sample.pdf", sample_pdf()),
+            "first_image_s": post_file(base + "/convert/image", "sample.png", sample_png()),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_commit() -> str:
+    """Short hash of HEAD, with a -dirty suffix when measured on uncommitted changes."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty", "--abbrev=7", "--exclude=*"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warmup", default=None, help="WARMUP_BACKENDS for the server (default: its own)")
+    parser.add_argument("--record", action="store_true", help="Append the medians to startup_history.csv")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as scratch:
+            env = dict(os.environ, INSTANTPDF_SCRATCH=scratch, DATABASE_URL=f"sqlite:///{scratch}/instantpdf.db",
+                       WORKSPACE_ROOT=os.path.join(scratch, "work"), WORKSPACE_RAM_ROOT="")
+            if args.warmup is not None:
+                env["WARMUP_BACKENDS"] = args.warmup
+            run = {"import_s": import_time(env)}
+            run.update(cold_start(env))
+            runs.append(run)
+
+    medians = {field: round(statistics.median(run[field] for run in runs), 3) for field in runs[0]}
+    for field, value in medians.items():
+        print(f"{field:<18}{value:>8.3f} s")
+
+    if args.record:
+        new_file = not os.path.exists(HISTORY_PATH)
+        with open(HISTORY_PATH, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS)
+            if new_file:
+                writer.writeheader()
+            warmup = args.warmup if args.warmup is not None else os.getenv("WARMUP_BACKENDS", "default")
+            writer.writerow({"date": date.today().isoformat(), "commit": git_commit(),
+                             "warmup": warmup or "none", **medians})
+
+
+if __name__ == "__main__":
+    main()
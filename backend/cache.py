@@ -0,0 +1,183 @@
+"""
+Content-addressed cache of conversion results.
+
+Results are keyed by the SHA-256 of the uploaded bytes plus the operation name
+and its parameters, so repeated uploads of the same file with the same options
+are served from disk without running the conversion again. The cache is
+bounded by total size (least recently used entries are evicted first) and by
+age (entries expire after RESULT_CACHE_TTL_HOURS).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "./data/cache")
+CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "1024"))
+CACHE_TTL_HOURS = float(os.getenv("RESULT_CACHE_TTL_HOURS", "24"))
+
+
+def cache_key(input_digest: str, operation: str, params: dict) -> str:
+    """Derive the cache key for an input hash, operation and its parameters."""
+    material = json.dumps(
+        {"input": input_digest, "operation": operation, "params": params},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hard link src to dst when possible, otherwise copy it."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """Disk-backed LRU cache with a size budget and a TTL."""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = CACHE_TTL_HOURS * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (size, stored_at), oldest access first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        """Rebuild the index from disk, ordering entries by last access time."""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                # atime is bumped on every hit, mtime is when it was stored
+                found.append((st.st_atime, name, st.st_size, st.st_mtime))
+
+        for _, key, size, stored_at in sorted(found):
+            self._entries[key] = (size, stored_at)
+            self._total_bytes += size
+        self._evict()
+
+    def _remove(self, key: str):
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and self._total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _adopt(self, key: str):
+        """Index an entry another process stored after this one loaded the cache."""
+        try:
+            st = os.stat(self._path(key))
+        except OSError:
+            return None
+        if time.time() - st.st_mtime > self.ttl_seconds:
+            return None
+        self._entries[key] = (st.st_size, st.st_mtime)
+        self._total_bytes += st.st_size
+        return self._entries[key]
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Place a cached result at output_path. Returns False on a miss."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                entry = self._adopt(key)
+            if entry is None:
+                self.misses += 1
+                return False
+
+            path = self._path(key)
+            try:
+                link_or_copy(path, output_path)
+                os.utime(path, (time.time(), entry[1]))
+            except OSError:
+                # Removed behind our back (e.g. by another worker process)
+                self._remove(key)
+                self.misses += 1
+                return False
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def store(self, key: str, result_path: str):
+        """Add a finished result to the cache."""
+        size = os.path.getsize(result_path)
+        if size > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        link_or_copy(result_path, tmp_path)
+        os.replace(tmp_path, path)
+        now = time.time()
+        os.utime(path, (now, now))
+
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[0]
+            self._entries[key] = (size, now)
+            self._total_bytes += size
+            self.stores += 1
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+result_cache = ResultCache()
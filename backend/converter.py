@@ -1,22 +1,22 @@
 import os
 import shutil
 from pathlib import Path
-from docx import Document
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-import openpyxl
-from fpdf import FPDF, XPos, YPos
-import img2pdf
-from PIL import Image
-from pptx import Presentation
-import pdfplumber
-from pdf2image import convert_from_path
-from pypdf import PdfReader
-
-import subprocess
+
 import platform
+import tempfile
+from xml.sax.saxutils import escape
+
+from libreoffice_pool import get_libreoffice_pool, InstanceUnavailable, JOB_TIMEOUT as LIBREOFFICE_JOB_TIMEOUT
+from subprocess_runner import run_tool, ToolCancelled, ToolTimeout
+from logs import get_logger
+import metrics
+from renderer_resources import sample_stylesheet, unicode_font, weasyprint_font_config, FALLBACK_FONT_NAME
+
+log = get_logger("converter")
+
+# Document libraries (python-docx, reportlab, openpyxl, PIL, pdfplumber, ...)
+# are imported inside the functions that use them, so starting the server
+# does not load every backend. warmup.py preloads the ones in WARMUP_BACKENDS.
 
 def get_libreoffice_command():
     """Find the LibreOffice executable."""
@@ -32,23 +32,53 @@ def get_libreoffice_command():
     # Default for Linux/Docker (Railway)
     return "soffice"
 
+_libreoffice_available = None
+# A soffice that hangs on --version is treated as missing
+LIBREOFFICE_CHECK_TIMEOUT_SECONDS = float(os.getenv("LIBREOFFICE_CHECK_TIMEOUT_SECONDS", "30"))
+
+def libreoffice_available(soffice: str) -> bool:
+    """Check once per process whether soffice can be run."""
+    global _libreoffice_available
+    if _libreoffice_available is None:
+        if platform.system() != "Darwin":
+            try:
+                returncode = run_tool("soffice", [soffice, "--version"], timeout=LIBREOFFICE_CHECK_TIMEOUT_SECONDS)
+                _libreoffice_available = returncode == 0
+            except (ToolTimeout, OSError) as e:
+                log.warning("LibreOffice check failed", extra={"error": str(e)})
+                _libreoffice_available = False
+        else:
+            _libreoffice_available = os.path.exists(soffice)
+    return _libreoffice_available
+
 def convert_with_libreoffice(input_path: str, output_path: str):
     """
     Convert document to PDF using LibreOffice (High Fidelity).
+    Jobs go to the warm instance pool when it is available, otherwise a
+    one-shot soffice process is started.
     Returns True if successful, False otherwise.
     """
     soffice = get_libreoffice_command()
     
-    # Check if we can run soffice (basic check)
-    try:
-        if platform.system() != "Darwin":
-            subprocess.run([soffice, "--version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        elif not os.path.exists(soffice):
-            return False
-    except (subprocess.SubprocessError, FileNotFoundError):
-        print("LibreOffice not found, falling back to basic conversion.")
+    if not libreoffice_available(soffice):
+        log.info("LibreOffice not found, falling back to basic conversion")
         return False
 
+    pool = get_libreoffice_pool(soffice)
+    if pool is not None:
+        try:
+            pool.convert(input_path, output_path)
+            if os.path.exists(output_path):
+                metrics.used_backend("libreoffice-pool")
+                return True
+        except InstanceUnavailable as e:
+            # Pool is saturated or an instance hung; fall back to a one-shot run
+            metrics.fallback("libreoffice", "pool")
+            log.warning("LibreOffice pool unavailable", extra={"error": str(e)})
+        except Exception as e:
+            log.error("LibreOffice pool conversion error", extra={"error": str(e)})
+            return False
+
     out_dir = os.path.dirname(output_path)
     
     # libreoffice --convert-to pdf puts the file in out_dir with the same basename
@@ -64,7 +94,10 @@ def convert_with_libreoffice(input_path: str, output_path: str):
     ]
     
     try:
-        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        returncode = run_tool("soffice", cmd, timeout=LIBREOFFICE_JOB_TIMEOUT)
+        if returncode != 0:
+            log.warning("LibreOffice exited with an error", extra={"returncode": returncode})
+            return False
         
         # Verify output exists
         # LibreOffice uses the input filename + .pdf
@@ -77,26 +110,96 @@ def convert_with_libreoffice(input_path: str, output_path: str):
                 if os.path.exists(output_path):
                     os.remove(output_path)
                 os.rename(expected_output, output_path)
+            metrics.used_backend("libreoffice")
             return True
+    except ToolCancelled:
+        # Nobody waits for the result, so no fallback either
+        raise
     except Exception as e:
-        print(f"LibreOffice conversion error: {e}")
+        log.error("LibreOffice conversion error", extra={"error": str(e)})
         return False
     
     return False
 
+def libreoffice_mode():
+    """
+    How documents reach LibreOffice in this process: "pool" (warm instances),
+    "one-shot" (a soffice run per call) or None when it is not installed.
+    """
+    soffice = get_libreoffice_command()
+    if not libreoffice_available(soffice):
+        return None
+    return "pool" if get_libreoffice_pool(soffice) is not None else "one-shot"
+
+def _is_complete_pdf(path: str) -> bool:
+    """A PDF that was written to the end (a killed soffice can leave a truncated one)."""
+    try:
+        with open(path, "rb") as f:
+            if not f.read(5).startswith(b"%PDF-"):
+                return False
+            f.seek(max(0, os.path.getsize(path) - 1024))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+def convert_many_with_libreoffice(jobs: list, timeout: float = LIBREOFFICE_JOB_TIMEOUT) -> list:
+    """
+    Convert several documents to PDF with a single soffice run.
+
+    jobs are (input_path, output_path) pairs; the input file names must be
+    unique apart from their extension. This is for batches when the warm
+    pool is not available, so they pay one soffice start instead of one per
+    file. soffice skips documents it cannot convert and goes on with the
+    rest. Returns the jobs that produced no PDF.
+    """
+    soffice = get_libreoffice_command()
+    if not jobs or not libreoffice_available(soffice):
+        return list(jobs)
+
+    run_dir = tempfile.mkdtemp(prefix="instantpdf-batch-")
+    # Own profile, so parallel runs do not wait on each other's profile lock
+    profile = Path(run_dir, "profile").as_uri()
+    out_dir = os.path.join(run_dir, "out")
+    cmd = [soffice, "--headless", f"-env:UserInstallation={profile}", "--convert-to", "pdf", "--outdir", out_dir]
+    cmd += [input_path for input_path, _ in jobs]
+    try:
+        try:
+            run_tool("soffice", cmd, timeout=timeout * len(jobs))
+        except (ToolTimeout, OSError) as e:
+            # Whatever was converted before is still used
+            log.warning("LibreOffice batch failed", extra={"files": len(jobs), "error": str(e)})
+
+        failed = []
+        for input_path, output_path in jobs:
+            produced = os.path.join(out_dir, Path(input_path).stem + ".pdf")
+            if _is_complete_pdf(produced):
+                shutil.move(produced, output_path)
+            else:
+                failed.append((input_path, output_path))
+        return failed
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
 def convert_docx_to_pdf(input_path: str, output_path: str):
     # Try High Fidelity Conversion first
     if convert_with_libreoffice(input_path, output_path):
         return
+    metrics.fallback("docx", "libreoffice")
+    metrics.used_backend("python-docx")
 
     try:
+        from docx import Document
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.units import inch
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+        
         # Load the DOCX document
         doc = Document(input_path)
         
         # Create PDF
         pdf = SimpleDocTemplate(output_path, pagesize=letter)
         story = []
-        styles = getSampleStyleSheet()
+        styles = sample_stylesheet()
         
         # Add a custom style for better formatting
         normal_style = styles['Normal']
@@ -124,59 +227,19 @@ def convert_docx_to_pdf(input_path: str, output_path: str):
         raise RuntimeError(f"DOCX conversion failed: {e}")
 
 def convert_xlsx_to_pdf(input_path: str, output_path: str):
+    """Render every sheet as a paginated table, streaming rows (see spreadsheet_pdf.py)"""
+    from spreadsheet_pdf import render_workbook
+    
     try:
-        wb = openpyxl.load_workbook(input_path)
-        sheet = wb.active
-        
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        
-        # Add Unicode font support (bundled Roboto)
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        font_path = os.path.join(current_dir, "fonts", "Roboto-Regular.ttf")
-        font_name = "Roboto"
-        use_unicode_font = False
-        
-        if os.path.exists(font_path):
-            try:
-                pdf.add_font(font_name, fname=font_path)
-                use_unicode_font = True
-            except Exception as e:
-                print(f"Failed to load font {font_path}: {e}")
-
-        pdf.add_page()
-        
-        if use_unicode_font:
-            pdf.set_font(font_name, size=10)
-        else:
-            pdf.set_font("Helvetica", size=10)
-
-        # Iterate rows
-        for row in sheet.iter_rows(values_only=True):
-            for item in row:
-                # Basic cell handling
-                text = str(item) if item is not None else ""
-                
-                # Sanitize text based on font availability
-                if not use_unicode_font:
-                     replacements = {'−': '-', '–': '-', '—': '-'}
-                     for old, new in replacements.items():
-                         text = text.replace(old, new)
-                     
-                     # Final safety net: strictly encode to latin-1
-                     text = text.encode('latin-1', 'replace').decode('latin-1')
-                
-                # Simple truncation to avoid breaking layout
-                text = (text[:20] + '..') if len(text) > 20 else text
-                pdf.cell(40, 10, text, border=1, new_x=XPos.RIGHT, new_y=YPos.TOP)
-            pdf.ln()
-            
-        pdf.output(output_path)
+        render_workbook(input_path, output_path)
     except Exception as e:
         raise RuntimeError(f"XLSX conversion failed: {e}")
 
 def convert_image_to_pdf(input_path: str, output_path: str):
     try:
+        import img2pdf
+        from PIL import Image
+        
         with Image.open(input_path) as img:
             img.verify()
         
@@ -189,70 +252,54 @@ def convert_pptx_to_pdf(input_path: str, output_path: str):
     # Try High Fidelity Conversion first
     if convert_with_libreoffice(input_path, output_path):
         return
+    metrics.fallback("pptx", "libreoffice")
+    metrics.used_backend("python-pptx")
 
     try:
+        from pptx import Presentation
+        from reportlab.lib.pagesizes import letter, landscape
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+        
         # Load PowerPoint presentation
         prs = Presentation(input_path)
         
-        # Create PDF
-        pdf = FPDF(orientation='L')  # Landscape for slides
-        pdf.set_auto_page_break(auto=False)
-        
-        # Add Unicode font support (bundled Roboto)
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        font_path = os.path.join(current_dir, "fonts", "Roboto-Regular.ttf")
-        font_name = "Roboto"
-        use_unicode_font = False
-        
-        if os.path.exists(font_path):
-            try:
-                pdf.add_font(font_name, fname=font_path)
-                use_unicode_font = True
-            except Exception as e:
-                print(f"Failed to load font {font_path}: {e}")
-        else:
-             print(f"Font not found at {font_path}")
+        # One landscape page per slide with its text in reading order
+        pdf = SimpleDocTemplate(output_path, pagesize=landscape(letter))
+        font = unicode_font()
+        text_style = ParagraphStyle("SlideText", parent=sample_stylesheet()["Normal"], fontName=font,
+                                    fontSize=12, leading=15, spaceAfter=8)
+        story = []
         
-        # Extract text from slides
         for slide in prs.slides:
-            pdf.add_page()
-            
-            if use_unicode_font:
-                pdf.set_font(font_name, size=12)
-            else:
-                pdf.set_font("Helvetica", size=12)
-            
-            y_position = 20
-            
+            if story:
+                story.append(PageBreak())
             for shape in slide.shapes:
                 if hasattr(shape, "text"):
                     text = shape.text.strip()
                     if text:
                         # Sanitize text based on font availability
-                        if not use_unicode_font:
+                        if font == FALLBACK_FONT_NAME:
                             # Replace common problematic characters
                             replacements = {
                                 '−': '-',  # minus sign
                                 '–': '-',  # en dash
                                 '—': '-',  # em dash
-                                '"': '"',
-                                '"': '"',
-                                ''': "'",
-                                ''': "'",
-                                '…': '...'
                             }
                             for old, new in replacements.items():
                                 text = text.replace(old, new)
                             
-                            # Final safety net: strictly encode to latin-1, replacing errors with '?'
-                            # This prevents the application from crashing
-                            text = text.encode('latin-1', 'replace').decode('latin-1')
-
-                        pdf.set_xy(20, y_position)
-                        pdf.multi_cell(0, 10, text)
-                        y_position += 15
+                            # Final safety net: stay within WinAnsi, replacing errors with '?'
+                            text = text.encode('cp1252', 'replace').decode('cp1252')
+                        
+                        story.append(Paragraph(escape(text).replace("\n", "<br/>"), text_style))
+            if not story or isinstance(story[-1], PageBreak):
+                # Keep a page for slides without text
+                story.append(Spacer(1, 1))
         
-        pdf.output(output_path)
+        if not story:
+            story.append(Spacer(1, 1))
+        pdf.build(story)
     except Exception as e:
         raise RuntimeError(f"PowerPoint conversion failed: {e}")
 
@@ -260,9 +307,11 @@ def convert_html_to_pdf(input_path: str, output_path: str):
     # Try High Fidelity Conversion first (LibreOffice)
     if convert_with_libreoffice(input_path, output_path):
         return
+    metrics.fallback("html", "libreoffice")
 
     try:
         # Fallback: Use WeasyPrint (modern, reliable HTML/CSS support)
+        metrics.used_backend("weasyprint")
         from weasyprint import HTML, CSS
         
         # WeasyPrint needs a base_url so it can find images/css if relative
@@ -270,23 +319,27 @@ def convert_html_to_pdf(input_path: str, output_path: str):
         base = os.path.dirname(input_path)
         
         doc = HTML(filename=input_path, base_url=base)
-        doc.write_pdf(output_path)
+        with open(input_path, "rb") as f:
+            own_fonts = b"@font-face" in f.read()
+        # @font-face rules are added to the configuration they are rendered
+        # with, so only documents without any reuse the thread's shared one
+        doc.write_pdf(output_path, font_config=None if own_fonts else weasyprint_font_config())
         
     except ImportError:
-         print("WeasyPrint not found, falling back to basic conversion.")
+         log.warning("WeasyPrint not found, falling back to basic conversion")
+         metrics.fallback("html", "weasyprint")
+         metrics.used_backend("text")
          # Double Fallback: Simple text extraction if WeasyPrint is missing
          try:
             from reportlab.platypus import SimpleDocTemplate, Paragraph
-            from reportlab.lib.styles import getSampleStyleSheet
             from reportlab.lib.pagesizes import letter
-            from xml.sax.saxutils import escape
             import re
             
             with open(input_path, 'r', encoding='utf-8') as f:
                 html_content = f.read()
 
             pdf = SimpleDocTemplate(output_path, pagesize=letter)
-            styles = getSampleStyleSheet()
+            styles = sample_stylesheet()
             story = []
             
             # Use regex to strip tags, but then ESCAPE content for Paragraph
@@ -307,69 +360,308 @@ def convert_html_to_pdf(input_path: str, output_path: str):
         raise RuntimeError(f"HTML conversion failed: {e}")
 
 # PDF to Other Formats
+def get_pdf_page_count(input_path: str) -> int:
+    import fitz  # PyMuPDF
+    
+    with fitz.open(input_path) as doc:
+        return doc.page_count
+
+def render_pdf_pages(input_path: str, page_numbers: list, dpi: int = 150, image_format: str = "jpeg",
+                     quality: int = 85, max_pixels: int = 40_000_000):
+    """
+    Render the given 0-based pages with PyMuPDF's in-process renderer.
+    
+    Runs in a worker process, so it opens the document itself and returns
+    a list of (page_number, image_bytes) for the caller to stream on.
+    """
+    import fitz  # PyMuPDF
+    from PIL import Image
+    
+    rendered = []
+    with fitz.open(input_path) as doc:
+        for page_number in page_numbers:
+            page = doc[page_number]
+            
+            # Keep huge pages at high DPI from exhausting memory
+            zoom = dpi / 72
+            width, height = page.rect.width * zoom, page.rect.height * zoom
+            if width * height > max_pixels:
+                zoom *= (max_pixels / (width * height)) ** 0.5
+            
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            if image_format == "png":
+                data = pix.tobytes("png")
+            elif image_format == "webp":
+                import io
+                
+                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                buffer = io.BytesIO()
+                img.save(buffer, format="WEBP", quality=quality)
+                data = buffer.getvalue()
+            else:
+                data = pix.tobytes("jpeg", jpg_quality=quality)
+            rendered.append((page_number, data))
+    return rendered
+
 def convert_pdf_to_jpg(input_path: str, output_path: str):
     try:
-        # Convert PDF to images (first page)
-        images = convert_from_path(input_path, first_page=1, last_page=1)
+        # Convert PDF to image (first page)
+        rendered = render_pdf_pages(input_path, [0], dpi=200, image_format="jpeg", quality=95)
         
-        if images:
-            images[0].save(output_path, 'JPEG')
+        with open(output_path, "wb") as f:
+            f.write(rendered[0][1])
     except Exception as e:
         raise RuntimeError(f"PDF to JPG conversion failed: {e}")
 
-def convert_pdf_to_docx(input_path: str, output_path: str):
+# Large PDFs are converted to Word in page shards on the process pool. Each
+# shard is parsed by its own worker into pdf2docx's layout format; the
+# layouts are then put together into one document in a single pass, so
+# sections and page breaks come out as in a one-process conversion.
+PDF_TO_WORD_MAX_WORKERS = int(os.getenv("PDF_TO_WORD_MAX_WORKERS", "4"))
+PDF_TO_WORD_MIN_PAGES_PER_WORKER = int(os.getenv("PDF_TO_WORD_MIN_PAGES_PER_WORKER", "20"))
+
+def pdf_to_word_shards(page_count: int) -> list:
+    """Split pages into contiguous (start, end) ranges, one per worker."""
+    from executor import PROCESS_POOL_SIZE
+    
+    workers = min(PDF_TO_WORD_MAX_WORKERS, PROCESS_POOL_SIZE,
+                  page_count // max(PDF_TO_WORD_MIN_PAGES_PER_WORKER, 1))
+    workers = max(workers, 1)
+    size, extra = divmod(page_count, workers)
+    shards = []
+    start = 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        shards.append((start, end))
+        start = end
+    return shards
+
+def convert_docx_whole(job: tuple) -> str:
+    """Worker: convert a whole PDF with pdf2docx in one go."""
+    from pdf2docx import Converter
+    
+    input_path, output_path = job
+    cv = Converter(input_path)
     try:
-        from pdf2docx import Converter
-        
-        # Use pdf2docx for structure-preserving conversion
-        cv = Converter(input_path)
         cv.convert(output_path, start=0, end=None)
+    finally:
         cv.close()
-        
+    return output_path
+
+def parse_docx_shard(job: tuple) -> str:
+    """Worker: parse pages [start, end) with pdf2docx and save the layout as JSON."""
+    from pdf2docx import Converter
+    
+    input_path, start, end, layout_path = job
+    cv = Converter(input_path)
+    try:
+        cv.parse(start=start, end=end, **cv.default_settings)
+        cv.serialize(layout_path)
+    finally:
+        cv.close()
+    return layout_path
+
+def make_docx_from_shards(job: tuple) -> str:
+    """Worker: build the DOCX from the layouts of all shards."""
+    from pdf2docx import Converter
+    
+    input_path, output_path, layout_paths = job
+    cv = Converter(input_path)
+    try:
+        cv.load_pages()
+        for layout_path in layout_paths:
+            cv.deserialize(layout_path)
+        cv.make_docx(output_path, **cv.default_settings)
+    finally:
+        cv.close()
+    return output_path
+
+def write_docx_text(input_path: str, output_path: str):
+    """
+    Write the text of every page as plain paragraphs, one page per page.
+    
+    The document XML is streamed into the package page by page, so only
+    one page of text is in memory at a time.
+    """
+    import zipfile
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from pypdf import PdfReader
+    
+    namespace = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    package_rels = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+    pdf = PdfReader(input_path)
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        package.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{package_rels}" Target="word/document.xml"/>'
+            '</Relationships>'
+        ))
+        with package.open("word/document.xml", "w") as body:
+            body.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                       f'<w:document xmlns:w="{namespace}"><w:body>'.encode())
+            for page in pdf.pages:
+                text = page.extract_text()
+                if not text:
+                    continue
+                # Control characters (form feeds, NULs) extracted from PDFs are not allowed in XML
+                text = ILLEGAL_CHARACTERS_RE.sub("", text.replace("\x0c", "\n"))
+                paragraphs = "".join(
+                    f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>'
+                    for line in text.splitlines()
+                )
+                body.write(f'{paragraphs}<w:p><w:r><w:br w:type="page"/></w:r></w:p>'.encode())
+            body.write(b"</w:body></w:document>")
+
+def convert_pdf_to_docx(input_path: str, output_path: str):
+    """
+    Convert a PDF to Word with pdf2docx, in parallel page shards for long files.
+    
+    At most PDF_TO_WORD_MAX_WORKERS shards of one file run at the same time.
+    Without pdf2docx, falls back to plain text.
+    """
+    try:
+        import pdf2docx  # noqa: F401
     except ImportError:
         # Fallback to text extraction if pdf2docx is missing
+        metrics.fallback("pdf-to-word", "pdf2docx")
+        metrics.used_backend("text")
         try:
-             pdf = PdfReader(input_path)
-             doc = Document()
-             for page in pdf.pages:
-                 text = page.extract_text()
-                 if text:
-                     doc.add_paragraph(text)
-                     doc.add_page_break()
-             doc.save(output_path)
+            write_docx_text(input_path, output_path)
+            return
         except Exception as e_inner:
-             raise RuntimeError(f"Basic PDF to Word conversion failed: {e_inner}")
+            raise RuntimeError(f"Basic PDF to Word conversion failed: {e_inner}")
 
+    metrics.used_backend("pdf2docx")
+    try:
+        import fitz  # PyMuPDF
+        from executor import parallel_map
+        
+        with fitz.open(input_path) as doc:
+            page_count = len(doc)
+        shards = pdf_to_word_shards(page_count)
+        if len(shards) == 1:
+            next(parallel_map(convert_docx_whole, [(input_path, output_path)]))
+            return
+        
+        root, _ = os.path.splitext(output_path)
+        jobs = [(input_path, start, end, f"{root}.pages-{start}.json") for start, end in shards]
+        try:
+            # Parse the shards side by side, then merge in one more worker
+            layout_paths = list(parallel_map(parse_docx_shard, jobs, window=len(jobs)))
+            next(parallel_map(make_docx_from_shards, [(input_path, output_path, layout_paths)]))
+        finally:
+            for job in jobs:
+                if os.path.exists(job[3]):
+                    os.remove(job[3])
+        
     except Exception as e:
         raise RuntimeError(f"PDF to Word conversion failed: {e}")
 
-def convert_pdf_to_xlsx(input_path: str, output_path: str):
+# PDF to Excel runs pdfplumber's table detection, which is pure Python and
+# slow, on batches of pages in the process pool. A PyMuPDF pre-check skips it
+# on pages without ruling lines, where the default "lines" strategy cannot
+# find a table anyway.
+PDF_TO_EXCEL_PAGES_PER_TASK = int(os.getenv("PDF_TO_EXCEL_PAGES_PER_TASK", "8"))
+
+def has_ruling_lines(page) -> bool:
+    """Whether a fitz page draws any horizontal or vertical line or rectangle."""
+    for path in page.get_drawings():
+        for item in path["items"]:
+            if item[0] in ("re", "qu"):
+                return True
+            if item[0] == "l":
+                start, end = item[1], item[2]
+                if abs(start.x - end.x) < 1 or abs(start.y - end.y) < 1:
+                    return True
+    return False
+
+def extract_page_tables(job: tuple) -> list:
+    """
+    Worker: tables and text of a batch of pages.
+    
+    Returns (page number, tables, text) per page, where tables is a list of
+    row lists (empty when the page has none) and text is the page's text.
+    """
+    import fitz  # PyMuPDF
+    import pdfplumber
+    
+    input_path, page_numbers = job
+    results = []
+    with fitz.open(input_path) as doc, pdfplumber.open(input_path) as pdf:
+        for page_number in page_numbers:
+            page = doc[page_number]
+            text = page.get_text().strip()
+            tables = []
+            # Pages without text (scans) or rulings cannot yield a table
+            if text and has_ruling_lines(page):
+                plumber_page = pdf.pages[page_number]
+                tables = plumber_page.extract_tables()
+                # Release the parsed characters before the next page
+                plumber_page.close()
+            results.append((page_number, tables, text))
+    return results
+
+def _xlsx_value(value):
+    """Strip control characters openpyxl refuses to write."""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    
+    return ILLEGAL_CHARACTERS_RE.sub("", value) if isinstance(value, str) else value
+
+def convert_pdf_to_xlsx(input_path: str, output_path: str, sheet_per_page: bool = False):
+    """
+    Write the tables of a PDF to a workbook, or a page's text where it has none.
+    
+    With sheet_per_page every page with content gets its own sheet
+    ("Page 3"), otherwise all rows go on one sheet in page order.
+    """
     try:
-        # Extract text from PDF
-        with pdfplumber.open(input_path) as pdf:
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            
-            for page in pdf.pages:
-                # Try to extract tables
-                tables = page.extract_tables()
+        import fitz  # PyMuPDF
+        import openpyxl
+        from executor import parallel_map, PROCESS_POOL_SIZE
+        
+        with fitz.open(input_path) as doc:
+            page_count = len(doc)
+        # Every batch opens the file again, which only pays off with a real pool
+        batch = max(PDF_TO_EXCEL_PAGES_PER_TASK, 1) if PROCESS_POOL_SIZE > 1 else max(page_count, 1)
+        jobs = [(input_path, list(range(start, min(start + batch, page_count))))
+                for start in range(0, page_count, batch)]
+        
+        # Rows are streamed into the file as the batches come back in order
+        wb = openpyxl.Workbook(write_only=True)
+        ws = None if sheet_per_page else wb.create_sheet("Sheet")
+        for results in parallel_map(extract_page_tables, jobs):
+            for page_number, tables, text in results:
+                if not tables and not text:
+                    continue
+                if sheet_per_page:
+                    ws = wb.create_sheet(f"Page {page_number + 1}")
                 if tables:
                     for table in tables:
                         for row in table:
-                            ws.append(row)
+                            ws.append([_xlsx_value(value) for value in row])
                 else:
-                    # If no tables, extract text
-                    text = page.extract_text()
-                    if text:
-                        ws.append([text])
-            
-            wb.save(output_path)
+                    ws.append([_xlsx_value(text)])
+        if not wb.worksheets:
+            wb.create_sheet("Sheet")
+        wb.save(output_path)
     except Exception as e:
         raise RuntimeError(f"PDF to Excel conversion failed: {e}")
 
 def convert_pdf_to_pptx(input_path: str, output_path: str):
     try:
+        from pptx import Presentation
         from pptx.util import Inches
+        from pypdf import PdfReader
         
         # Extract text from PDF
         pdf = PdfReader(input_path)
@@ -392,101 +684,311 @@ def convert_pdf_to_pptx(input_path: str, output_path: str):
         raise RuntimeError(f"PDF to PowerPoint conversion failed: {e}")
 
 
+# Settings per compression level: garbage collection, JPEG quality and the
+# effective resolution images are downsampled to for their size on the page
+COMPRESSION_LEVELS = {
+    "low": {"garbage": 1, "quality": 95, "dpi": 300},
+    "medium": {"garbage": 3, "quality": 80, "dpi": 150},
+    "high": {"garbage": 4, "quality": 60, "dpi": 96},
+}
+
+
+def compressed_save_options(compression_level: str = "medium") -> dict:
+    """Options for fitz's Document.save that compress_pdf (and a pipeline's compress step) writes with."""
+    settings = COMPRESSION_LEVELS.get(compression_level, COMPRESSION_LEVELS["medium"])
+    return {"garbage": settings["garbage"], "deflate": True, "deflate_images": True, "deflate_fonts": True,
+            "clean": True}
+
+
+# Skip an image when re-encoding would save less than this fraction of it
+COMPRESS_MIN_GAIN = float(os.getenv("COMPRESS_MIN_GAIN", "0.1"))
+# Rough JPEG output size, in bits per pixel, at each quality setting
+JPEG_BITS_PER_PIXEL = {95: 3.0, 80: 1.5, 60: 1.0}
+# Channels closer than this are treated as gray
+GRAYSCALE_TOLERANCE = 8
+# An image is a flat graphic when this many colors (or gray levels) cover
+# FLAT_COVERAGE of its pixels
+FLAT_MAX_COLORS = {"RGB": 256, "L": 16}
+FLAT_COVERAGE = 0.98
+
+
+def _is_grayscale(pil_image) -> bool:
+    """True when an RGB image has (almost) no color in it."""
+    from PIL import ImageChops
+    
+    sample = pil_image.copy()
+    sample.thumbnail((256, 256))
+    red, green, blue = sample.split()
+    spread = max(
+        ImageChops.difference(red, green).getextrema()[1],
+        ImageChops.difference(green, blue).getextrema()[1],
+    )
+    return spread <= GRAYSCALE_TOLERANCE
+
+
+def _flat_color_count(pil_image):
+    """Number of palette entries for a flat graphic, or None for a photo."""
+    colors = pil_image.getcolors(maxcolors=4096)
+    if colors is None:
+        return None
+    limit = FLAT_MAX_COLORS[pil_image.mode]
+    counts = sorted((count for count, _ in colors), reverse=True)
+    if sum(counts[:limit]) < FLAT_COVERAGE * pil_image.width * pil_image.height:
+        return None
+    return min(len(counts), 256)
+
+
+def recompress_image(job):
+    """
+    Downsample and re-encode one extracted PDF image. Runs in a worker process.
+    
+    job is (xref, image_bytes, original_size, target_size, quality). The
+    codec is picked from the content: Flate with a palette of at most 256
+    colors for flat graphics, JPEG for photos, grayscale when there is no color, PNG when
+    the image has an alpha channel. Returns (xref, replacement) where
+    replacement is None when the gain would be below COMPRESS_MIN_GAIN.
+    """
+    import io
+    import zlib
+    from PIL import Image
+    
+    xref, image_bytes, original_size, target_size, quality = job
+    try:
+        pil_image = Image.open(io.BytesIO(image_bytes))
+        pil_image.load()
+        
+        # Downsample to the target resolution for the displayed size
+        if target_size:
+            scale = max(target_size[0] / pil_image.width, target_size[1] / pil_image.height)
+            if scale < 0.9:
+                new_size = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+                if pil_image.mode not in ('L', 'RGB', 'RGBA'):
+                    pil_image = pil_image.convert('RGBA' if 'A' in pil_image.getbands() else 'RGB')
+                pil_image = pil_image.resize(new_size, Image.LANCZOS)
+        
+        width, height = pil_image.size
+        if pil_image.mode in ('RGBA', 'LA') or (pil_image.mode == 'P' and 'transparency' in pil_image.info):
+            # Keep transparency: PNG becomes an image plus soft mask in the PDF
+            pil_image = pil_image.convert('RGBA')
+            img_buffer = io.BytesIO()
+            pil_image.save(img_buffer, format='PNG', optimize=True)
+            replacement = {"kind": "image", "data": img_buffer.getvalue()}
+        else:
+            if pil_image.mode != 'L':
+                pil_image = pil_image.convert('RGB')
+                if _is_grayscale(pil_image):
+                    pil_image = pil_image.convert('L')
+            
+            color_count = _flat_color_count(pil_image)
+            if color_count is not None:
+                # Flat graphic: Flate, as gray levels or up to 256 palette colors
+                if pil_image.mode == 'L':
+                    colorspace = "/DeviceGray"
+                    raw = pil_image.tobytes()
+                else:
+                    palette_image = pil_image.quantize(colors=color_count, method=Image.FASTOCTREE)
+                    palette = palette_image.getpalette()[:3 * color_count]
+                    colorspace = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{bytes(palette).hex()}>]"
+                    raw = palette_image.tobytes()
+                replacement = {
+                    "kind": "flate",
+                    "data": zlib.compress(raw, 9),
+                    "width": width,
+                    "height": height,
+                    "colorspace": colorspace,
+                }
+            else:
+                # Photo: JPEG, in grayscale when there is no color
+                img_buffer = io.BytesIO()
+                pil_image.save(img_buffer, format='JPEG', quality=quality, optimize=True)
+                replacement = {"kind": "image", "data": img_buffer.getvalue()}
+    except Exception as img_error:
+        # Skip problematic images and continue
+        log.warning("Could not compress image", extra={"xref": xref, "error": str(img_error)})
+        return xref, None
+    
+    # Only replace if the result is worth it
+    if len(replacement["data"]) > original_size * (1 - COMPRESS_MIN_GAIN):
+        return xref, None
+    return xref, replacement
+
+def compress_document(doc, compression_level: str = "medium") -> dict:
+    """
+    Recompress the images of an open PDF in place.
+    
+    Every distinct image is handled exactly once, however many pages show
+    it: downsampled to the level's DPI for the largest size it is displayed
+    at, then re-encoded with a codec suited to its content. The PIL work is
+    spread over the process pool; writing the results back into the
+    document stays on the calling thread.
+    
+    Returns:
+        Stats for the run: image counts, bytes saved and seconds per stage.
+    """
+    import fitz  # PyMuPDF
+    import math
+    import time
+    from executor import parallel_map
+    
+    stats = {"image_refs": 0, "unique_images": 0, "recompressed_images": 0,
+             "downsampled_images": 0, "skipped_images": 0, "image_bytes_saved": 0}
+    timings = {}
+    started = time.perf_counter()
+    
+    settings = COMPRESSION_LEVELS.get(compression_level, COMPRESSION_LEVELS["medium"])
+    image_quality = settings["quality"]
+    
+    # Stage 1: collect the unique image xrefs, a page that shows each and
+    # the largest size (in inches) each one is displayed at
+    image_pages = {}
+    display_sizes = {}
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        page_xrefs = []
+        for img in page.get_images(full=True):
+            stats["image_refs"] += 1
+            if img[0] not in page_xrefs:
+                page_xrefs.append(img[0])
+        for xref in page_xrefs:
+            image_pages.setdefault(xref, page_num)
+            width, height = display_sizes.get(xref, (0, 0))
+            try:
+                placements = page.get_image_rects(xref, transform=True)
+            except Exception:
+                placements = []
+            for _, matrix in placements:
+                # The matrix maps the unit square onto the page, in points
+                width = max(width, math.hypot(matrix.a, matrix.b) / 72)
+                height = max(height, math.hypot(matrix.c, matrix.d) / 72)
+            display_sizes[xref] = (width, height)
+    stats["unique_images"] = len(image_pages)
+    timings["scan"] = time.perf_counter() - started
+    
+    # Stage 2: extract each image once and recompress in parallel
+    stage_started = time.perf_counter()
+    
+    def extracted_images():
+        for xref in image_pages:
+            try:
+                if doc.xref_get_key(xref, "ImageMask")[1] == "true" or doc.xref_get_key(xref, "Mask")[0] != "null":
+                    # Stencil and color-key masks do not survive re-encoding
+                    continue
+                base_image = doc.extract_image(xref)
+                # Only compress JPEG and PNG (Flate) images
+                if not base_image or base_image["ext"].lower() not in ['jpeg', 'jpg', 'png']:
+                    continue
+                original_size = len(doc.xref_stream_raw(xref) or b"")
+                image_bytes = base_image["image"]
+                if base_image.get("smask"):
+                    # Merge the soft mask so the alpha channel is kept
+                    original_size += len(doc.xref_stream_raw(base_image["smask"]) or b"")
+                    pix = fitz.Pixmap(doc, xref)
+                    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+                        pix = fitz.Pixmap(fitz.csRGB, pix)
+                    pix = fitz.Pixmap(pix, fitz.Pixmap(doc, base_image["smask"]))
+                    image_bytes = pix.tobytes("png")
+            except Exception as img_error:
+                log.warning("Could not extract image", extra={"xref": xref, "error": str(img_error)})
+                continue
+            
+            pixel_width, pixel_height = base_image["width"], base_image["height"]
+            width, height = display_sizes[xref]
+            target_size = None
+            if width and height:
+                target_size = (width * settings["dpi"], height * settings["dpi"])
+            downsample = target_size is not None and max(
+                target_size[0] / pixel_width, target_size[1] / pixel_height
+            ) < 0.9
+            if downsample:
+                stats["downsampled_images"] += 1
+            elif base_image["ext"].lower() in ['jpeg', 'jpg'] and not base_image.get("smask"):
+                # Estimate what re-encoding an already-JPEG image would give
+                estimate = pixel_width * pixel_height * JPEG_BITS_PER_PIXEL.get(image_quality, 1.5) / 8
+                if base_image.get("colorspace") == 1:
+                    estimate /= 2
+                if estimate > original_size * (1 - COMPRESS_MIN_GAIN):
+                    stats["skipped_images"] += 1
+                    continue
+            yield xref, image_bytes, original_size, target_size, image_quality
+    
+    replacements = {}
+    for xref, replacement in parallel_map(recompress_image, extracted_images()):
+        if replacement is not None:
+            replacements[xref] = replacement
+    timings["recompress"] = time.perf_counter() - stage_started
+    
+    # Stage 3: write the smaller images back, single-threaded
+    stage_started = time.perf_counter()
+    for xref, replacement in replacements.items():
+        try:
+            original_size = len(doc.xref_stream_raw(xref) or b"")
+            smask = doc.xref_get_key(xref, "SMask")
+            if smask[0] == "xref":
+                original_size += len(doc.xref_stream_raw(int(smask[1].split()[0])) or b"")
+            if replacement["kind"] == "flate":
+                doc.update_object(xref, (
+                    f"<</Type/XObject/Subtype/Image/Width {replacement['width']}"
+                    f"/Height {replacement['height']}/ColorSpace {replacement['colorspace']}"
+                    f"/BitsPerComponent 8/Filter/FlateDecode>>"
+                ))
+                doc.update_stream(xref, replacement["data"], compress=False)
+            else:
+                doc[image_pages[xref]].replace_image(xref, filename=None, stream=replacement["data"])
+            stats["recompressed_images"] += 1
+            stats["image_bytes_saved"] += max(0, original_size - len(replacement["data"]))
+        except Exception as img_error:
+            log.warning("Could not replace image", extra={"xref": xref, "error": str(img_error)})
+    timings["write"] = time.perf_counter() - stage_started
+    
+    stats["seconds"] = timings
+    return stats
+
 def compress_pdf(input_path: str, output_path: str, compression_level: str = "medium"):
     """
     Compress a PDF file to reduce its size.
     
+    Images are recompressed by compress_document, then the file is saved
+    with the level's garbage collection and stream compression.
+    
     Args:
         input_path: Path to the input PDF file
         output_path: Path to save the compressed PDF
         compression_level: 'low', 'medium', or 'high' compression
+    
+    Returns:
+        Stats for the run: image counts, bytes saved and seconds per stage.
     """
     try:
         import fitz  # PyMuPDF
+        import time
+        
+        started = time.perf_counter()
+        metrics.used_backend("pymupdf")
         
         # Open the PDF
         doc = fitz.open(input_path)
         
-        # Set compression parameters based on level
-        if compression_level == "low":
-            # Light compression - preserve quality
-            garbage = 1
-            deflate = True
-            image_quality = 95
-        elif compression_level == "high":
-            # Maximum compression - may reduce quality
-            garbage = 4
-            deflate = True
-            image_quality = 60
-        else:  # medium (default)
-            garbage = 3
-            deflate = True
-            image_quality = 80
-        
-        # Process each page to compress images
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Get all images on the page
-            image_list = page.get_images(full=True)
-            
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                
-                try:
-                    # Extract the image
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-                    
-                    # Only compress JPEG and PNG images
-                    if image_ext.lower() in ['jpeg', 'jpg', 'png']:
-                        from PIL import Image
-                        import io
-                        
-                        # Open and compress the image
-                        pil_image = Image.open(io.BytesIO(image_bytes))
-                        
-                        # Convert to RGB if necessary (for JPEG)
-                        if pil_image.mode in ('RGBA', 'P'):
-                            pil_image = pil_image.convert('RGB')
-                        
-                        # Reduce resolution for high compression
-                        if compression_level == "high":
-                            max_size = 1024
-                            if pil_image.width > max_size or pil_image.height > max_size:
-                                ratio = min(max_size / pil_image.width, max_size / pil_image.height)
-                                new_size = (int(pil_image.width * ratio), int(pil_image.height * ratio))
-                                pil_image = pil_image.resize(new_size, Image.LANCZOS)
-                        
-                        # Compress to JPEG
-                        img_buffer = io.BytesIO()
-                        pil_image.save(img_buffer, format='JPEG', quality=image_quality, optimize=True)
-                        compressed_bytes = img_buffer.getvalue()
-                        
-                        # Only replace if the compressed image is smaller
-                        if len(compressed_bytes) < len(image_bytes):
-                            # Update the image in the PDF
-                            page.replace_image(xref, filename=None, stream=compressed_bytes)
-                except Exception as img_error:
-                    # Skip problematic images and continue
-                    print(f"Warning: Could not compress image {img_index} on page {page_num}: {img_error}")
-                    continue
+        stats = compress_document(doc, compression_level)
+        timings = stats["seconds"]
         
         # Save with compression options
-        doc.save(
-            output_path,
-            garbage=garbage,
-            deflate=deflate,
-            deflate_images=True,
-            deflate_fonts=True,
-            clean=True
-        )
+        stage_started = time.perf_counter()
+        doc.save(output_path, **compressed_save_options(compression_level))
         
         doc.close()
+        timings["save"] = time.perf_counter() - stage_started
+        timings["total"] = time.perf_counter() - started
+        
+        stats["input_bytes"] = os.path.getsize(input_path)
+        stats["output_bytes"] = os.path.getsize(output_path)
+        stats["seconds"] = {stage: round(seconds, 4) for stage, seconds in timings.items()}
+        log.info("compress_pdf", extra={"compression_level": compression_level, "stats": stats})
+        return stats
         
     except ImportError:
         # Fallback using pypdf if fitz is not available
+        metrics.fallback("compress", "pymupdf")
+        metrics.used_backend("pypdf")
         try:
             from pypdf import PdfReader, PdfWriter
             
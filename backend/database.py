@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -20,8 +20,38 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String, primary_key=True, index=True)
+    operation = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default="{}")
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, done, failed
+    input_path = Column(String, nullable=False)
+    input_sha256 = Column(String, nullable=True)
+    output_path = Column(String, nullable=False)
+    output_filename = Column(String, nullable=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class RepairStat(Base):
+    __tablename__ = "repair_stats"
+    
+    # Outcomes of one repair strategy on one kind of broken PDF
+    producer = Column(String, primary_key=True)
+    pdf_version = Column(String, primary_key=True)
+    xref_type = Column(String, primary_key=True)  # table, stream, none
+    strategy = Column(String, primary_key=True)
+    successes = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    total_seconds = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+def init_db():
+    """Create missing tables. Runs once at server startup, not on import."""
+    Base.metadata.create_all(bind=engine)
 
 def get_db():
     db = SessionLocal()
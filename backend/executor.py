@@ -0,0 +1,185 @@
+"""
+Execution layer that keeps blocking work off the asyncio event loop.
+
+Conversions are synchronous and often CPU-heavy. Request handlers hand them
+to one of two pools instead of calling them directly:
+
+- a bounded thread pool for I/O and subprocess work (LibreOffice, Ghostscript)
+- a process pool for CPU-bound pure-Python conversions
+
+Each operation also has its own concurrency limit so one slow endpoint cannot
+occupy every worker.
+"""
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "8"))
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(os.cpu_count() or 1)))
+DEFAULT_OPERATION_CONCURRENCY = int(os.getenv("OPERATION_CONCURRENCY", "4"))
+
+
+def parse_limits(value: str) -> dict:
+    """Parse "pdf-to-word=1,compress=2" into {"pdf-to-word": 1, "compress": 2}."""
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.partition("=")
+        if name.strip() and limit.strip():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+OPERATION_CONCURRENCY_LIMITS = parse_limits(os.getenv("OPERATION_CONCURRENCY_LIMITS", ""))
+
+_thread_pool = None
+_process_pool = None
+_pool_lock = threading.Lock()
+_semaphores = {}
+# Set for a thread pool job when the coroutine awaiting it is cancelled
+_cancellation = contextvars.ContextVar("cancellation", default=None)
+
+
+def cancellation_event():
+    """
+    The threading.Event of the thread pool job running this code, or None
+    outside one. It is set once nobody waits for the job's result any more,
+    so long-running work (external tools) can stop early.
+    """
+    return _cancellation.get()
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    with _pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="convert")
+        return _thread_pool
+
+
+def _init_worker():
+    """Set up logging and load the configured backends once per worker, before it takes any job."""
+    from logs import configure_logging
+    from warmup import warm_up
+
+    configure_logging()
+    warm_up(in_worker=True)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared process pool, creating it on first use.
+
+    Workers are started from a forkserver (spawn where forkserver is not
+    available) so they never inherit the server's threads or locks.
+    """
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE, mp_context=ctx,
+                                                initializer=_init_worker)
+        return _process_pool
+
+
+def start_process_pool() -> int:
+    """Start every worker now instead of on the first CPU-bound request."""
+    pool = get_process_pool()
+    # Workers are spawned as tasks arrive while none is idle
+    futures = [pool.submit(os.getpid) for _ in range(PROCESS_POOL_SIZE)]
+    return len({future.result() for future in futures})
+
+
+def _reset_process_pool(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died so the next call starts a fresh one."""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is broken:
+            _process_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def parallel_map(func, items, window: int = None):
+    """
+    Apply func to every item in the process pool and yield results in order.
+
+    This is for conversions that fan out internal work from a thread. At most
+    window items are in flight, so large inputs are not all pickled at once.
+    Inside a pool worker (no nested pools) the items are processed inline.
+    """
+    if multiprocessing.parent_process() is not None or PROCESS_POOL_SIZE <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    window = window or PROCESS_POOL_SIZE * 2
+    pool = get_process_pool()
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _reset_process_pool(pool)
+        raise RuntimeError("Worker process crashed")
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _semaphore(operation: str) -> asyncio.Semaphore:
+    if operation not in _semaphores:
+        limit = OPERATION_CONCURRENCY_LIMITS.get(operation, DEFAULT_OPERATION_CONCURRENCY)
+        _semaphores[operation] = asyncio.Semaphore(limit)
+    return _semaphores[operation]
+
+
+async def run_in_thread(operation: str, func, *args, **kwargs):
+    """Run a blocking function in the thread pool, within the operation's limit."""
+    loop = asyncio.get_running_loop()
+    # Carry context variables into the worker thread, like asyncio.to_thread
+    ctx = contextvars.copy_context()
+    cancelled = threading.Event()
+    ctx.run(_cancellation.set, cancelled)
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    async with _semaphore(operation):
+        try:
+            return await loop.run_in_executor(get_thread_pool(), call)
+        except asyncio.CancelledError:
+            # The thread cannot be interrupted, but it can be told
+            cancelled.set()
+            raise
+
+
+async def run_in_process(operation: str, func, *args, **kwargs):
+    """Run a CPU-bound function in the process pool, within the operation's limit."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    async with _semaphore(operation):
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, call)
+        except BrokenProcessPool:
+            _reset_process_pool(pool)
+            raise RuntimeError(f"Worker process crashed while running {operation}")
+
+
+def shutdown():
+    """Stop both pools. Called when the server shuts down."""
+    global _thread_pool, _process_pool
+    with _pool_lock:
+        thread_pool, process_pool = _thread_pool, _process_pool
+        _thread_pool = _process_pool = None
+    if thread_pool is not None:
+        thread_pool.shutdown(wait=True)
+    if process_pool is not None:
+        process_pool.shutdown(wait=True)
@@ -0,0 +1,253 @@
+"""
+Asynchronous conversion jobs: submit, poll, download.
+
+Jobs are stored in the database next to users, with their input and output
+files kept under JOB_STORAGE_DIR. An in-process scheduler runs queued jobs
+through the normal execution layer, and a retention sweep removes jobs and
+their files once they are older than FILE_RETENTION_HOURS. Database queries
+and file removal go to the thread pool, off the event loop.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+from database import SessionLocal, Job
+from executor import run_in_thread
+from operations import get_operation, run_operation
+from logs import get_logger
+
+JOB_STORAGE_DIR = os.getenv("JOB_STORAGE_DIR", "./data/jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+FILE_RETENTION_HOURS = float(os.getenv("FILE_RETENTION_HOURS", "24"))
+RETENTION_SWEEP_MINUTES = float(os.getenv("RETENTION_SWEEP_MINUTES", "10"))
+# How long running jobs may take to finish when the server stops
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", "30"))
+
+log = get_logger("jobs")
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(JOB_STORAGE_DIR, job_id)
+
+
+def create_job(job_id: str, operation: str, params: dict, input_path: str, output_path: str, output_filename: str,
+               input_sha256: str = None) -> Job:
+    db = SessionLocal()
+    try:
+        job = Job(
+            id=job_id,
+            operation=operation,
+            params=json.dumps(params),
+            status="queued",
+            input_path=input_path,
+            output_path=output_path,
+            output_filename=output_filename,
+            input_sha256=input_sha256,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    finally:
+        db.close()
+
+
+def get_job(job_id: str):
+    db = SessionLocal()
+    try:
+        return db.query(Job).filter(Job.id == job_id).first()
+    finally:
+        db.close()
+
+
+def _claim_job(job_id: str) -> bool:
+    """Atomically move a job from queued to running so it only runs once."""
+    db = SessionLocal()
+    try:
+        claimed = db.query(Job).filter(Job.id == job_id, Job.status == "queued").update(
+            {"status": "running", "started_at": datetime.utcnow()}
+        )
+        db.commit()
+        return claimed == 1
+    finally:
+        db.close()
+
+
+def _finish_job(job_id: str, error: str = None):
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id == job_id).update({
+            "status": "failed" if error else "done",
+            "error": error,
+            "finished_at": datetime.utcnow(),
+        })
+        db.commit()
+    finally:
+        db.close()
+
+
+def _remove_input(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def requeue_jobs(job_ids: list = None) -> int:
+    """Put running jobs (all of them, or only job_ids) back in the queue."""
+    db = SessionLocal()
+    try:
+        query = db.query(Job).filter(Job.status == "running")
+        if job_ids is not None:
+            query = query.filter(Job.id.in_(job_ids))
+        requeued = query.update({"status": "queued", "started_at": None}, synchronize_session=False)
+        db.commit()
+        return requeued
+    finally:
+        db.close()
+
+
+def queued_job_ids(min_age_seconds: float = 0) -> list:
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age_seconds)
+    db = SessionLocal()
+    try:
+        jobs = db.query(Job).filter(Job.status == "queued", Job.created_at <= cutoff).order_by(Job.created_at)
+        return [job.id for job in jobs]
+    finally:
+        db.close()
+
+
+def delete_expired_jobs() -> int:
+    """Remove jobs (and their files) older than FILE_RETENTION_HOURS."""
+    cutoff = datetime.utcnow() - timedelta(hours=FILE_RETENTION_HOURS)
+    db = SessionLocal()
+    try:
+        expired = db.query(Job).filter(Job.created_at < cutoff, Job.status != "running").all()
+        for job in expired:
+            shutil.rmtree(job_dir(job.id), ignore_errors=True)
+            db.delete(job)
+        db.commit()
+        return len(expired)
+    finally:
+        db.close()
+
+
+class JobScheduler:
+    """Runs queued jobs on a fixed number of asyncio worker tasks."""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._queue = None
+        self._queued = set()  # job ids waiting in _queue
+        self._tasks = []
+        self._active = set()
+        self._stopping = False
+
+    async def start(self, recover: bool = True):
+        """
+        Start the workers and queue every pending job.
+
+        With recover, jobs marked running are requeued first: they were left
+        behind by a previous run of the server. Prefork workers share the
+        database and must not do this, since other workers' jobs are running;
+        serve.py recovers once before it starts them.
+        """
+        self._queue = asyncio.Queue()
+        self._queued = set()
+        self._stopping = False
+        os.makedirs(JOB_STORAGE_DIR, exist_ok=True)
+
+        if recover:
+            await run_in_thread("jobs", requeue_jobs)
+        for job_id in await run_in_thread("jobs", queued_job_ids):
+            self.submit(job_id)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._retention_loop()))
+
+    async def stop(self, grace_seconds: float = 0):
+        """
+        Stop taking jobs. Running jobs get up to grace_seconds to finish, the
+        rest are requeued for the next server (or worker) to run.
+        """
+        self._stopping = True
+        deadline = time.monotonic() + grace_seconds
+        while self._active and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+
+        interrupted = list(self._active)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if interrupted:
+            log.info("Requeued interrupted jobs", extra={"jobs": await run_in_thread("jobs", requeue_jobs, interrupted)})
+
+    def submit(self, job_id: str):
+        """Queue a job here, unless it is waiting in this queue already."""
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            if self._stopping:
+                # Left queued in the database for the next server (or worker)
+                self._queue.task_done()
+                continue
+            self._active.add(job_id)
+            try:
+                await self._run(job_id)
+            except Exception:
+                log.exception("Job crashed", extra={"job_id": job_id})
+            finally:
+                self._active.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        if not await run_in_thread("jobs", _claim_job, job_id):
+            return
+
+        job = await run_in_thread("jobs", get_job, job_id)
+        operation = get_operation(job.operation)
+        if operation is None:
+            await run_in_thread("jobs", _finish_job, job_id, f"Unknown operation: {job.operation}")
+            return
+
+        error = None
+        try:
+            params = operation.parse_params(json.loads(job.params))
+            # Jobs are queued already: wait for capacity rather than fail
+            await run_operation(operation, job.input_path, job.output_path, params, input_digest=job.input_sha256,
+                                wait_for_capacity=True)
+            if not os.path.exists(job.output_path):
+                raise RuntimeError("Conversion produced no output")
+        except asyncio.CancelledError:
+            # Interrupted by a shutdown: keep the input, stop() requeues the job
+            raise
+        except Exception as e:
+            error = str(e)
+
+        # The input is not needed once the job has run
+        await run_in_thread("jobs", _remove_input, job.input_path)
+        await run_in_thread("jobs", _finish_job, job_id, error)
+
+    async def _retention_loop(self):
+        while True:
+            try:
+                removed = await run_in_thread("jobs", delete_expired_jobs)
+                if removed:
+                    log.info("Removed expired jobs", extra={"jobs": removed})
+                # Jobs queued on a worker that has since stopped; claiming is
+                # atomic, so a job queued in two workers still runs once
+                for job_id in await run_in_thread("jobs", queued_job_ids, RETENTION_SWEEP_MINUTES * 60):
+                    self.submit(job_id)
+            except Exception as e:
+                log.error("Job retention sweep failed", extra={"error": str(e)})
+            await asyncio.sleep(RETENTION_SWEEP_MINUTES * 60)
+
+
+job_scheduler = JobScheduler()
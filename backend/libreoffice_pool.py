@@ -0,0 +1,278 @@
+"""
+Pool of warm, long-lived headless LibreOffice instances.
+
+Starting soffice costs seconds and hundreds of MB per conversion, so instead
+we keep a few instances running, each with its own user profile and UNO pipe,
+and hand conversion jobs to them through lo_bridge.py. Instances are recycled
+after a configurable number of jobs, pinged while idle, and restarted when
+they die or stop answering.
+"""
+import atexit
+import json
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from logs import get_logger
+
+POOL_SIZE = int(os.getenv("LIBREOFFICE_POOL_SIZE", "2"))
+MAX_JOBS_PER_INSTANCE = int(os.getenv("LIBREOFFICE_MAX_JOBS_PER_INSTANCE", "200"))
+JOB_TIMEOUT = float(os.getenv("LIBREOFFICE_JOB_TIMEOUT", "120"))
+STARTUP_TIMEOUT = float(os.getenv("LIBREOFFICE_STARTUP_TIMEOUT", "60"))
+HEALTHCHECK_INTERVAL = float(os.getenv("LIBREOFFICE_HEALTHCHECK_INTERVAL", "30"))
+UNO_PYTHON = os.getenv("LIBREOFFICE_UNO_PYTHON", "/usr/bin/python3")
+
+BRIDGE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lo_bridge.py")
+
+log = get_logger("libreoffice_pool")
+
+
+class InstanceUnavailable(Exception):
+    """Raised when an instance is dead or did not answer in time."""
+
+
+class LibreOfficeInstance:
+    """One soffice process plus the UNO bridge process that drives it."""
+
+    def __init__(self, soffice: str, index: int):
+        self.soffice = soffice
+        self.index = index
+        self.pipe_name = f"instantpdf_lo_{os.getpid()}_{index}"
+        self.profile_dir = os.path.join(tempfile.gettempdir(), f"instantpdf-lo-{os.getpid()}-{index}")
+        self.office = None
+        self.bridge = None
+        self.jobs_done = 0
+        self.last_used = 0.0
+        self._replies = None
+
+    def start(self):
+        """Launch soffice and the bridge, and wait until the bridge is connected."""
+        self.office = subprocess.Popen(
+            [
+                self.soffice,
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--nodefault",
+                "--norestore",
+                "--nolockcheck",
+                f"-env:UserInstallation=file://{self.profile_dir}",
+                f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.bridge = subprocess.Popen(
+            [UNO_PYTHON, BRIDGE_SCRIPT, self.pipe_name, str(STARTUP_TIMEOUT)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+
+        # A reader thread turns the bridge's stdout into a queue so that every
+        # request can wait with a timeout instead of blocking forever.
+        self._replies = queue.Queue()
+        threading.Thread(
+            target=self._read_replies, args=(self.bridge, self._replies), daemon=True
+        ).start()
+
+        reply = self._wait_for_reply(STARTUP_TIMEOUT + 5)
+        if not reply.get("ready"):
+            self.stop()
+            raise InstanceUnavailable(reply.get("error", "LibreOffice bridge failed to start"))
+
+        self.jobs_done = 0
+        self.last_used = time.monotonic()
+
+    @staticmethod
+    def _read_replies(bridge, replies):
+        for line in bridge.stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                continue
+        # EOF: the bridge exited, wake up whoever is waiting
+        replies.put(None)
+
+    def _wait_for_reply(self, timeout: float) -> dict:
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise InstanceUnavailable(f"LibreOffice instance {self.index} did not answer within {timeout}s")
+        if reply is None:
+            raise InstanceUnavailable(f"LibreOffice instance {self.index} exited")
+        return reply
+
+    def _request(self, payload: dict, timeout: float) -> dict:
+        if not self.is_alive():
+            raise InstanceUnavailable(f"LibreOffice instance {self.index} is not running")
+        try:
+            self.bridge.stdin.write(json.dumps(payload) + "\n")
+            self.bridge.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise InstanceUnavailable(f"LibreOffice instance {self.index} bridge is gone: {e}")
+        return self._wait_for_reply(timeout)
+
+    def is_alive(self) -> bool:
+        return (
+            self.office is not None and self.office.poll() is None
+            and self.bridge is not None and self.bridge.poll() is None
+        )
+
+    def ping(self) -> bool:
+        """Health check: ask soffice for a trivial round trip."""
+        try:
+            return bool(self._request({"cmd": "ping"}, timeout=10).get("ok"))
+        except InstanceUnavailable:
+            return False
+
+    def convert(self, input_path: str, output_path: str, timeout: float = JOB_TIMEOUT):
+        """Convert one document to PDF. Raises RuntimeError for document errors."""
+        reply = self._request(
+            {"cmd": "convert", "input": os.path.abspath(input_path), "output": os.path.abspath(output_path)},
+            timeout,
+        )
+        self.jobs_done += 1
+        self.last_used = time.monotonic()
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "LibreOffice conversion failed"))
+
+    def stop(self):
+        """Kill both processes and drop the instance profile."""
+        for proc in (self.bridge, self.office):
+            if proc is None or proc.poll() is not None:
+                continue
+            try:
+                if proc is self.office:
+                    os.killpg(proc.pid, 9)
+                else:
+                    proc.kill()
+                proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.bridge = None
+        self.office = None
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+class LibreOfficePool:
+    """Fixed-size pool of warm LibreOffice instances."""
+
+    def __init__(self, soffice: str, size: int = POOL_SIZE, max_jobs: int = MAX_JOBS_PER_INSTANCE):
+        self.soffice = soffice
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = queue.Queue()
+        self._instances = []
+        self._closed = threading.Event()
+
+    def start(self):
+        for index in range(self.size):
+            instance = LibreOfficeInstance(self.soffice, index)
+            self._instances.append(instance)
+            instance.start()
+            self._idle.put(instance)
+
+        threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def convert(self, input_path: str, output_path: str, timeout: float = JOB_TIMEOUT):
+        """
+        Run a conversion on the next free instance.
+
+        Raises RuntimeError if the document could not be converted, and
+        InstanceUnavailable if no healthy instance could be found in time.
+        """
+        try:
+            instance = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise InstanceUnavailable("No LibreOffice instance became free in time")
+
+        try:
+            if not instance.is_alive():
+                instance.restart()
+            instance.convert(input_path, output_path, timeout)
+        except InstanceUnavailable:
+            # Hung or crashed mid-job: replace it so the next job gets a fresh one
+            self._restart_quietly(instance)
+            raise
+        finally:
+            if instance.jobs_done >= self.max_jobs:
+                self._restart_quietly(instance)
+            self._idle.put(instance)
+
+    def _restart_quietly(self, instance: LibreOfficeInstance):
+        try:
+            instance.restart()
+        except Exception as e:
+            log.error("LibreOffice instance failed to restart", extra={"instance": instance.index, "error": str(e)})
+
+    def _health_loop(self):
+        while not self._closed.wait(HEALTHCHECK_INTERVAL):
+            # Only check instances that are idle right now; busy ones are
+            # supervised by the job timeout instead.
+            for _ in range(self._idle.qsize()):
+                try:
+                    instance = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if not instance.ping():
+                    log.warning("LibreOffice instance failed health check, restarting", extra={"instance": instance.index})
+                    self._restart_quietly(instance)
+                self._idle.put(instance)
+
+    def shutdown(self):
+        self._closed.set()
+        for instance in self._instances:
+            instance.stop()
+
+
+_pool: Optional[LibreOfficePool] = None
+_pool_lock = threading.Lock()
+_pool_failed = False
+
+
+def get_libreoffice_pool(soffice: str) -> Optional[LibreOfficePool]:
+    """
+    Return the process-wide pool, starting it on first use.
+
+    Returns None when the pool is disabled (LIBREOFFICE_POOL_SIZE=0) or could
+    not be started, e.g. because soffice or the UNO bindings are missing.
+    """
+    global _pool, _pool_failed
+    if _pool is not None or _pool_failed or POOL_SIZE <= 0:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None and not _pool_failed:
+            pool = LibreOfficePool(soffice)
+            try:
+                pool.start()
+                _pool = pool
+            except Exception as e:
+                log.warning("LibreOffice pool unavailable, using one-shot conversions", extra={"error": str(e)})
+                pool.shutdown()
+                _pool_failed = True
+    return _pool
+
+
+def shutdown_libreoffice_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+atexit.register(shutdown_libreoffice_pool)
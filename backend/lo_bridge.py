@@ -0,0 +1,112 @@
+"""
+UNO bridge for a warm LibreOffice instance.
+
+This script is started by libreoffice_pool.py with a Python interpreter that
+can import ``uno`` (on Debian/Ubuntu that is the system python3 with the
+python3-uno package). It connects to a running headless soffice process and
+then serves conversion requests, one JSON object per line on stdin, answering
+with one JSON object per line on stdout.
+"""
+import json
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+
+def _prop(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def _connect(pipe_name: str, timeout: float):
+    """Connect to the soffice process listening on the given pipe."""
+    local_ctx = uno.getComponentContext()
+    resolver = local_ctx.ServiceManager.createInstanceWithContext(
+        "com.sun.star.bridge.UnoUrlResolver", local_ctx
+    )
+    url = f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext"
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ctx = resolver.resolve(url)
+            return ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+
+def _pdf_filter_for(doc):
+    """Pick the PDF export filter matching the loaded document type."""
+    if doc.supportsService("com.sun.star.presentation.PresentationDocument"):
+        return "impress_pdf_Export"
+    if doc.supportsService("com.sun.star.drawing.DrawingDocument"):
+        return "draw_pdf_Export"
+    if doc.supportsService("com.sun.star.sheet.SpreadsheetDocument"):
+        return "calc_pdf_Export"
+    if doc.supportsService("com.sun.star.text.WebDocument"):
+        return "writer_web_pdf_Export"
+    return "writer_pdf_Export"
+
+
+def _convert(desktop, input_path: str, output_path: str):
+    doc = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(input_path), "_blank", 0, (_prop("Hidden", True),)
+    )
+    if doc is None:
+        raise RuntimeError(f"LibreOffice could not load {input_path}")
+    try:
+        doc.storeToURL(
+            uno.systemPathToFileUrl(output_path),
+            (_prop("FilterName", _pdf_filter_for(doc)),)
+        )
+    finally:
+        doc.close(True)
+
+
+def _reply(payload: dict):
+    sys.stdout.write(json.dumps(payload) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    pipe_name = sys.argv[1]
+    connect_timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    try:
+        desktop = _connect(pipe_name, connect_timeout)
+    except Exception as e:
+        _reply({"ready": False, "error": str(e)})
+        return 1
+    _reply({"ready": True})
+
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            _reply({"ok": False, "error": "malformed request"})
+            continue
+
+        try:
+            if request.get("cmd") == "ping":
+                # Touching the component list forces a round trip to soffice
+                desktop.getComponents()
+            elif request.get("cmd") == "convert":
+                _convert(desktop, request["input"], request["output"])
+            else:
+                raise ValueError(f"unknown command {request.get('cmd')!r}")
+            _reply({"ok": True})
+        except Exception as e:
+            _reply({"ok": False, "error": str(e)})
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Structured logging with a request id.
+
+Log records are written as one JSON object per line (LOG_FORMAT=text for
+plain lines when reading logs by hand). Every record made while a request
+is handled carries its id, in thread pool jobs too, so the warnings of a
+conversion can be found from its access log line. The id is taken from
+the X-Request-ID header when the client (or a proxy) sends one, and echoed
+back in the response.
+
+Fields of a record are passed in extra:
+    log.warning("LibreOffice pool unavailable", extra={"error": str(e)})
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+from metrics import REQUESTS, REQUEST_SECONDS
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+# Attributes every LogRecord has; anything else came in through extra
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = _request_id.get()
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = _request_id.get()
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+        if request_id:
+            fields = {"request_id": request_id, **fields}
+        return line + "".join(f" {key}={value}" for key, value in fields.items())
+
+
+def configure_logging():
+    """Send the app's log records to stderr in the configured format. Safe to call more than once."""
+    logger = logging.getLogger("instantpdf")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "text":
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module, under the app's "instantpdf" logger."""
+    return logging.getLogger(f"instantpdf.{name}")
+
+
+log = get_logger("access")
+
+
+class RequestObserver:
+    """
+    ASGI middleware giving every request an id, counting it in the request
+    metrics and writing its access log line.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        token = _request_id.set(request_id)
+        started = time.perf_counter()
+        response = {"status": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-request-id", request_id.encode("latin-1"))]}
+                # FastAPI puts the matched route in the scope
+                REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"],
+                                        route=_route(scope))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = _route(scope)
+            REQUESTS.inc(method=scope["method"], route=route, status=response["status"])
+            log.info("request", extra={
+                "method": scope["method"], "path": scope["path"], "route": route,
+                "status": response["status"], "seconds": round(time.perf_counter() - started, 4),
+            })
+            _request_id.reset(token)
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths are not used as labels: they are unbounded
+    return getattr(route, "path", "unmatched")
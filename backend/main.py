@@ -1,24 +1,44 @@
 import os
+import json
+import asyncio
+import uuid
 import shutil
-import tempfile
+import time
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends
-from fastapi.responses import FileResponse
+from urllib.parse import quote
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Depends
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
-from converter import (
-    convert_docx_to_pdf, convert_xlsx_to_pdf, convert_image_to_pdf,
-    convert_pptx_to_pdf, convert_html_to_pdf,
-    convert_pdf_to_jpg, convert_pdf_to_docx, convert_pdf_to_xlsx, convert_pdf_to_pptx,
-    compress_pdf
-)
-from database import get_db, User
+from database import get_db, init_db, User
+from executor import run_in_thread, run_in_process, shutdown as shutdown_executor
+from converter import get_pdf_page_count, render_pdf_pages
+from rasterizer import stream_pages_as_zip, parse_page_range, IMAGE_FORMATS, MIN_DPI, MAX_DPI
+from libreoffice_pool import shutdown_libreoffice_pool
+from operations import get_operation, run_operation
+from cache import result_cache
+from singleflight import conversion_flights
+from admission import admission_controller, estimate_cost, AdmissionRejected
+from uploads import ingest_request, ingest_upload, UPLOAD_REQUEST_BODY, MULTIPART_OVERHEAD
+from batch import collect_documents, stream_batch, BATCH_MAX_FILES, BATCH_MAX_UPLOAD_BYTES, BATCH_MAX_UPLOAD_MB
+from workspace import workspace_manager, WorkspaceBudgetExceeded
+import warmup
+import subprocess_runner
+import metrics
+from logs import configure_logging, get_logger, RequestObserver
+from jobs import job_scheduler, job_dir, create_job, get_job, JOB_SHUTDOWN_GRACE_SECONDS
 from auth import get_password_hash, verify_password, create_access_token
 from datetime import timedelta
 
+configure_logging()
+log = get_logger("main")
+
 app = FastAPI(title="InstantPDF API")
 
+# How often a running conversion checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+
 # Allow CORS for frontend
 origins = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
@@ -28,7 +48,10 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Outermost, so its request timing includes the other middleware
+app.add_middleware(RequestObserver)
 
 # Pydantic models for request/response
 class UserSignup(BaseModel):
@@ -52,14 +75,79 @@ class ResetPasswordRequest(BaseModel):
     token: str
     new_password: str
 
-def cleanup_files(paths: list[str]):
-    """Background task to remove temporary files after response is sent."""
-    for path in paths:
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-        except Exception as e:
-            print(f"Error deleting file {path}: {e}")
+@app.on_event("startup")
+async def start_background_services():
+    if not getattr(app.state, "prefork", False):
+        # Under serve.py the master clears them, before any worker has metrics to keep
+        metrics.clear_snapshots()
+    init_db()
+    workspace_manager.start_janitor()
+    # Under serve.py the master recovers interrupted jobs once, before forking
+    await job_scheduler.start(recover=not getattr(app.state, "prefork", False))
+    # Load the hot backends while the first requests are already being served
+    app.state.warmup = asyncio.get_running_loop().create_task(run_in_thread("warm-up", warmup.warm_up))
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop the job scheduler, conversion pools and warm LibreOffice instances."""
+    await job_scheduler.stop(JOB_SHUTDOWN_GRACE_SECONDS)
+    workspace_manager.stop_janitor()
+    shutdown_executor()
+    shutdown_libreoffice_pool()
+
+def attachment_header(filename: str) -> str:
+    """Content-Disposition value for a download, the same way FileResponse builds it."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def acquire_workspace(request: Request):
+    """Reserve a scratch directory sized from the request, or fail with 503 when disk is short."""
+    content_length = request.headers.get("content-length", "")
+    size_hint = int(content_length) if content_length.isdigit() else 0
+    try:
+        return workspace_manager.acquire(size_hint)
+    except WorkspaceBudgetExceeded:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other files. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+
+def too_busy(rejected: AdmissionRejected) -> HTTPException:
+    """The 429/503 answer for a conversion its admission lane turned away."""
+    return HTTPException(
+        status_code=rejected.status_code,
+        detail=rejected.detail,
+        headers={"Retry-After": str(rejected.retry_after)}
+    )
+
+async def release_after(chunks, ticket):
+    """Pass a streamed response through, holding its admission ticket until it ends."""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        ticket.release()
+
+async def run_unless_disconnected(request: Request, awaitable):
+    """
+    Await a conversion, cancelling it (and killing its external tools) when
+    the client disconnects first. Nobody reads the 499 response; it ends the request.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
 
 @app.get("/")
 def read_root():
@@ -182,7 +270,7 @@ async def forgot_password(request: ForgotPasswordRequest, db: Session = Depends(
             server.quit()
             
         except Exception as e:
-            print(f"Email sending failed: {e}")
+            log.error("Email sending failed", extra={"error": str(e)})
     
     return {"message": "If an account with that email exists, a reset link has been sent."}
 
@@ -208,445 +296,497 @@ async def reset_password(request: ResetPasswordRequest, db: Session = Depends(ge
     
     return {"message": "Password reset successfully. You can now login with your new password."}
 
-@app.post("/convert/docx")
-async def convert_docx(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.endswith(".docx"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .docx file.")
+async def process_upload(operation: str, request: Request, background_tasks: BackgroundTasks, check=None, **params):
+    """
+    Stream an upload to disk, run the operation on it (or serve it from cache) and return the result.
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_docx_to_pdf(input_path, output_path)
-        
-        # Schedule cleanup
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/convert/xlsx")
-async def convert_xlsx(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .xlsx file.")
+    check, if given, is awaited with the input path before the operation runs;
+    it raises HTTPException for parameters that do not fit the uploaded file.
+    """
+    op = get_operation(operation)
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
+    workspace = acquire_workspace(request)
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_xlsx_to_pdf(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
+        with metrics.timed("ingest", op.name):
+            upload = await ingest_upload(
+                request, workspace.path, extensions=op.extensions, kinds=op.kinds,
+                invalid_type_detail=op.invalid_type_detail
+            )
+        metrics.UPLOAD_BYTES.observe(upload.file.size, operation=op.name)
+        input_path = upload.file.path
+        if check is not None:
+            await check(input_path)
+        output_filename = op.output_filename(upload.file.filename)
+        output_path = workspace.file(output_filename)
+        
+        await run_unless_disconnected(request, run_operation(op, input_path, output_path, params, input_digest=upload.file.sha256))
+        
+        # Remove the whole workspace once the response has been sent
+        background_tasks.add_task(workspace.cleanup)
         
         return FileResponse(
             output_path, 
-            media_type="application/pdf", 
+            media_type=op.media_type, 
             filename=output_filename
         )
+    except (HTTPException, asyncio.CancelledError):
+        workspace.cleanup()
+        raise
+    except AdmissionRejected as e:
+        workspace.cleanup()
+        raise too_busy(e)
     except Exception as e:
-        cleanup_files([input_path])
+        workspace.cleanup()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/convert/image")
-async def convert_image(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a JPG or PNG file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pdf"
-    output_path = os.path.join(temp_dir, output_filename)
+@app.post("/convert/docx", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_docx(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("docx", request, background_tasks)
 
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_image_to_pdf(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/convert/xlsx", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_xlsx(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("xlsx", request, background_tasks)
 
-# PowerPoint to PDF
-@app.post("/convert/pptx")
-async def convert_pptx(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(('.pptx', '.ppt')):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pptx file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pdf"
-    output_path = os.path.join(temp_dir, output_filename)
+@app.post("/convert/image", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_image(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("image", request, background_tasks)
 
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_pptx_to_pdf(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+# PowerPoint to PDF
+@app.post("/convert/pptx", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_pptx(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("pptx", request, background_tasks)
 
 # HTML to PDF
-@app.post("/convert/html")
-async def convert_html(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.html'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an .html file.")
+@app.post("/convert/html", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_html(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("html", request, background_tasks)
+
+# Many office documents in one request
+@app.post("/convert/batch", openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["file"],
+        "properties": {"file": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+    }}}
+}})
+async def convert_batch(request: Request, background_tasks: BackgroundTasks):
+    """
+    Convert many DOCX, PPTX, XLSX and HTML files to PDF.
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
+    Send the documents as several "file" parts, or ZIP archives of them. The
+    PDFs are streamed back in a ZIP as each one is ready; documents that could
+    not be converted are listed in its errors.json entry.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > BATCH_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Batch too large. Maximum size is {BATCH_MAX_UPLOAD_MB:g} MB.")
+    
+    workspace = acquire_workspace(request)
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_html_to_pdf(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
+        with metrics.timed("ingest", "batch"):
+            upload = await ingest_request(request, workspace.path, max_files=BATCH_MAX_FILES,
+                                          max_bytes=BATCH_MAX_UPLOAD_BYTES)
+        for uploaded in upload.files:
+            metrics.UPLOAD_BYTES.observe(uploaded.size, operation="batch")
+        items, failures = await run_in_thread("batch", collect_documents, upload.files, workspace.path)
+        if not items:
+            detail = "No documents to convert."
+            if failures:
+                detail += f" {failures[0][0]}: {failures[0][1]}"
+            raise HTTPException(status_code=400, detail=detail)
+        
+        # Remove the whole workspace once the response has been sent
+        background_tasks.add_task(workspace.cleanup)
+        return StreamingResponse(
+            stream_batch(items, failures),
+            media_type="application/zip",
+            headers={"Content-Disposition": attachment_header("converted_pdfs.zip")}
         )
+    except (HTTPException, asyncio.CancelledError):
+        workspace.cleanup()
+        raise
     except Exception as e:
-        cleanup_files([input_path])
+        workspace.cleanup()
         raise HTTPException(status_code=500, detail=str(e))
 
-# PDF to JPG
-@app.post("/convert/pdf-to-jpg")
-async def convert_pdf_jpg(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
+# PDF to JPG (or PNG/WebP), every page or a page range
+@app.post("/convert/pdf-to-jpg", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_pdf_jpg(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    pages: str = "all",
+    dpi: int = 150,
+    image_format: str = "jpeg",
+    quality: int = 85
+):
+    """
+    Render PDF pages to images.
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".jpg"
-    output_path = os.path.join(temp_dir, output_filename)
-
+    Args:
+        pages: 'all' or a 1-based selection such as '1-3,7'
+        dpi: Render resolution
+        image_format: 'jpeg', 'png' or 'webp'
+        quality: JPEG/WebP quality (1-100)
+    
+    A single selected page is returned as an image, several pages as a ZIP
+    that is streamed while the pages are being rendered.
+    """
+    image_format = image_format.lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid image format. Use jpeg, png or webp.")
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"DPI must be between {MIN_DPI} and {MAX_DPI}.")
+    quality = min(max(quality, 1), 100)
+    extension, media_type = IMAGE_FORMATS[image_format]
+    
+    op = get_operation("pdf-to-jpg")
+    workspace = acquire_workspace(request)
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with metrics.timed("ingest", op.name):
+            upload = await ingest_upload(
+                request, workspace.path, extensions=op.extensions, kinds=op.kinds,
+                invalid_type_detail=op.invalid_type_detail
+            )
+        metrics.UPLOAD_BYTES.observe(upload.file.size, operation=op.name)
+        stem = Path(upload.file.filename).stem
         
-        convert_pdf_to_jpg(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="image/jpeg", 
-            filename=output_filename
+        try:
+            page_count = await run_in_thread("pdf-to-jpg", get_pdf_page_count, upload.file.path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not read PDF: {e}")
+        try:
+            page_numbers = parse_page_range(pages, page_count)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # Rendering cost grows with the pixel count
+        cost = estimate_cost("pdf-to-jpg", upload.file.path, pages=len(page_numbers)) * max(1, round((dpi / 150) ** 2))
+        ticket = await admission_controller.acquire(cost)
+        
+        # Remove the whole workspace once the response has been sent
+        background_tasks.add_task(workspace.cleanup)
+        # Also covers a stream that never started
+        background_tasks.add_task(ticket.release)
+        
+        if len(page_numbers) == 1:
+            try:
+                rendered = await run_in_process(
+                    "pdf-to-jpg", render_pdf_pages, upload.file.path, page_numbers, dpi, image_format, quality
+                )
+            finally:
+                ticket.release()
+            output_filename = stem + extension
+            output_path = workspace.file(output_filename)
+            with open(output_path, "wb") as f:
+                f.write(rendered[0][1])
+            return FileResponse(output_path, media_type=media_type, filename=output_filename)
+        
+        return StreamingResponse(
+            release_after(stream_pages_as_zip(upload.file.path, page_numbers, stem, dpi, image_format, quality), ticket),
+            media_type="application/zip",
+            headers={"Content-Disposition": attachment_header(f"{stem}_pages.zip")}
         )
+    except (HTTPException, asyncio.CancelledError):
+        workspace.cleanup()
+        raise
+    except AdmissionRejected as e:
+        workspace.cleanup()
+        raise too_busy(e)
     except Exception as e:
-        cleanup_files([input_path])
+        workspace.cleanup()
         raise HTTPException(status_code=500, detail=str(e))
 
 # PDF to Word
-@app.post("/convert/pdf-to-word")
-async def convert_pdf_word(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".docx"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_pdf_to_docx(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/convert/pdf-to-word", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_pdf_word(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("pdf-to-word", request, background_tasks)
 
 # PDF to Excel
-@app.post("/convert/pdf-to-excel")
-async def convert_pdf_excel(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".xlsx"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_pdf_to_xlsx(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/convert/pdf-to-excel", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_pdf_excel(request: Request, background_tasks: BackgroundTasks, sheet_per_page: bool = False):
+    """Extract tables into a workbook; sheet_per_page puts each page on its own sheet."""
+    return await process_upload("pdf-to-excel", request, background_tasks, sheet_per_page=sheet_per_page)
 
 # PDF to PowerPoint
-@app.post("/convert/pdf-to-pptx")
-async def convert_pdf_ppt(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + ".pptx"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        convert_pdf_to_pptx(input_path, output_path)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
-
-# Import PDF editor functions at the top of main.py
-# from pdf_editor import rotate_pdf, add_watermark_to_pdf, add_page_numbers_to_pdf, crop_pdf, edit_pdf_add_text
+@app.post("/convert/pdf-to-pptx", openapi_extra=UPLOAD_REQUEST_BODY)
+async def convert_pdf_ppt(request: Request, background_tasks: BackgroundTasks):
+    return await process_upload("pdf-to-pptx", request, background_tasks)
 
 # PDF Editing Tools
-@app.post("/edit/rotate-pdf")
-async def rotate_pdf_endpoint(background_tasks: BackgroundTasks, file: UploadFile = File(...), rotation: int = 90):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
+@app.post("/edit/rotate-pdf", openapi_extra=UPLOAD_REQUEST_BODY)
+async def rotate_pdf_endpoint(request: Request, background_tasks: BackgroundTasks, rotation: int = 90):
+    return await process_upload("rotate", request, background_tasks, rotation=rotation)
+
+@app.post("/edit/watermark-pdf", openapi_extra=UPLOAD_REQUEST_BODY)
+async def watermark_pdf_endpoint(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    text: str = "WATERMARK",
+    opacity: float = 1.0,
+    pages: str = "all",
+    rotate: int = 45,
+    position: str = "center"
+):
+    """
+    Stamp a text watermark on the selected pages.
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_rotated.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        from pdf_editor import rotate_pdf
-        rotate_pdf(input_path, output_path, rotation)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/edit/watermark-pdf")
-async def watermark_pdf_endpoint(background_tasks: BackgroundTasks, file: UploadFile = File(...), text: str = "WATERMARK"):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
+    Args:
+        text: Watermark text
+        opacity: 0 (invisible) to 1 (opaque)
+        pages: 1-based page selection like "1-3,7" or "all"
+        rotate: Angle in degrees, counter-clockwise
+        position: 'center', 'top-left', 'top-center', ..., 'bottom-right'
+    """
+    if not 0 <= opacity <= 1:
+        raise HTTPException(status_code=400, detail="Opacity must be between 0 and 1")
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_watermarked.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        from pdf_editor import add_watermark_to_pdf
-        add_watermark_to_pdf(input_path, output_path, text)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+    async def check_pages(input_path: str):
+        try:
+            page_count = await run_in_thread("watermark", get_pdf_page_count, input_path)
+        except Exception:
+            # Damaged: the watermark step repairs it first and checks the pages then
+            return
+        try:
+            parse_page_range(pages, page_count)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return await process_upload(
+        "watermark", request, background_tasks, check=check_pages,
+        text=text, opacity=opacity, pages=pages, rotate=rotate, position=position
+    )
 
-@app.post("/edit/page-numbers-pdf")
+@app.post("/edit/page-numbers-pdf", openapi_extra=UPLOAD_REQUEST_BODY)
 async def page_numbers_pdf_endpoint(
-    background_tasks: BackgroundTasks, 
-    file: UploadFile = File(...),
+    request: Request,
+    background_tasks: BackgroundTasks,
     position: str = "bottom-center",
     start_from: int = 1,
     end_at: int = None
 ):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
-    
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_numbered.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        from pdf_editor import add_page_numbers_to_pdf
-        add_page_numbers_to_pdf(input_path, output_path, position, start_from, end_at)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
+    return await process_upload(
+        "page-numbers", request, background_tasks,
+        position=position, start_from=start_from, end_at=end_at
+    )
 
-@app.post("/edit/crop-pdf")
-async def crop_pdf_endpoint(background_tasks: BackgroundTasks, file: UploadFile = File(...), margin: int = 50):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
+@app.post("/edit/crop-pdf", openapi_extra=UPLOAD_REQUEST_BODY)
+async def crop_pdf_endpoint(request: Request, background_tasks: BackgroundTasks, margin: int = 50):
+    return await process_upload("crop", request, background_tasks, margin=margin)
+
+@app.post("/edit/add-text-pdf", openapi_extra=UPLOAD_REQUEST_BODY)
+async def add_text_pdf_endpoint(request: Request, background_tasks: BackgroundTasks, text: str = "Added Text", x: int = 100, y: int = 100):
+    return await process_upload("add-text", request, background_tasks, text=text, x=x, y=y)
+
+# Several edits in one request
+@app.post("/pipeline", openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["file", "operations"],
+        "properties": {
+            "file": {"type": "string", "format": "binary"},
+            "operations": {"type": "string"}
+        }
+    }}}
+}})
+async def pipeline_endpoint(request: Request, background_tasks: BackgroundTasks):
+    """
+    Run several PDF edits in order, with one upload, one parse and one save.
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_cropped.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
-    try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        from pdf_editor import crop_pdf
-        crop_pdf(input_path, output_path, margin)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
-    except Exception as e:
-        cleanup_files([input_path])
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/edit/add-text-pdf")
-async def add_text_pdf_endpoint(background_tasks: BackgroundTasks, file: UploadFile = File(...), text: str = "Added Text", x: int = 100, y: int = 100):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
+    Multipart fields:
+        file: The PDF file to edit
+        operations: JSON list of steps, e.g.
+            [{"operation": "rotate", "params": {"rotation": 90}}, "crop",
+             {"operation": "watermark", "params": {"text": "DRAFT"}}, "page-numbers", "compress"]
+    """
+    op = get_operation("pipeline")
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_edited.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
+    workspace = acquire_workspace(request)
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        from pdf_editor import edit_pdf_add_text
-        edit_pdf_add_text(input_path, output_path, text, x, y)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
-        
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
+        with metrics.timed("ingest", op.name):
+            upload = await ingest_request(
+                request, workspace.path, extensions=op.extensions, invalid_type_detail=op.invalid_type_detail
+            )
+        metrics.UPLOAD_BYTES.observe(upload.file.size, operation=op.name)
+        if upload.file.kind not in op.kinds:
+            raise HTTPException(status_code=400, detail=f"{op.invalid_type_detail} The file content does not match its extension.")
+        try:
+            params = op.parse_params({"operations": upload.fields.get("operations", "")})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        output_filename = op.output_filename(upload.file.filename)
+        output_path = workspace.file(output_filename)
+        await run_unless_disconnected(request, run_operation(op, upload.file.path, output_path, params, input_digest=upload.file.sha256))
+        
+        # Remove the whole workspace once the response has been sent
+        background_tasks.add_task(workspace.cleanup)
+        return FileResponse(output_path, media_type=op.media_type, filename=output_filename)
+    except (HTTPException, asyncio.CancelledError):
+        workspace.cleanup()
+        raise
+    except AdmissionRejected as e:
+        workspace.cleanup()
+        raise too_busy(e)
     except Exception as e:
-        cleanup_files([input_path])
+        workspace.cleanup()
         raise HTTPException(status_code=500, detail=str(e))
 
 # Compress PDF
-@app.post("/compress/pdf")
+@app.post("/compress/pdf", openapi_extra=UPLOAD_REQUEST_BODY)
 async def compress_pdf_endpoint(
-    background_tasks: BackgroundTasks, 
-    file: UploadFile = File(...),
+    request: Request,
+    background_tasks: BackgroundTasks,
     compression_level: str = "medium"
 ):
     """
     Compress a PDF file to reduce its size.
     
     Args:
-        file: The PDF file to compress
+        file: The PDF file to compress (multipart field "file")
         compression_level: 'low', 'medium', or 'high' compression
     """
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .pdf file.")
-    
     # Validate compression level
     if compression_level not in ['low', 'medium', 'high']:
         compression_level = 'medium'
     
-    temp_dir = tempfile.mkdtemp()
-    input_path = os.path.join(temp_dir, file.filename)
-    output_filename = Path(file.filename).stem + "_compressed.pdf"
-    output_path = os.path.join(temp_dir, output_filename)
-
+    return await process_upload("compress", request, background_tasks, compression_level=compression_level)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus metrics of every worker and conversion process."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/cache")
+def cache_stats():
+    """Hit/miss counters and size of the conversion result cache."""
+    return result_cache.stats()
+
+@app.get("/stats/admission")
+def admission_stats():
+    """Slots, queues and rejections of the light (fast) and heavy conversion lanes."""
+    return admission_controller.stats()
+
+@app.get("/stats/coalescing")
+def coalescing_stats():
+    """How many requests joined an identical conversion already in flight."""
+    return conversion_flights.stats()
+
+@app.get("/stats/subprocesses")
+def subprocess_stats():
+    """Runs, timeouts, cancellations and resource limit kills per external tool."""
+    return subprocess_runner.stats()
+
+@app.get("/stats/workspace")
+def workspace_stats():
+    """Scratch space reservations, disk usage and janitor activity."""
+    return workspace_manager.stats()
+
+@app.get("/stats/repair-strategies")
+def repair_strategy_stats():
+    """Learned outcomes and order of the PDF repair strategies per kind of input."""
+    from pdf_opener import repair_strategies
+    
+    return repair_strategies.stats()
+
+@app.get("/stats/warm-up")
+def warmup_stats():
+    """Which backends were preloaded after startup and how long each took."""
+    return warmup.stats()
+
+# Asynchronous jobs
+@app.post("/jobs", status_code=202, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["file", "operation"],
+        "properties": {
+            "file": {"type": "string", "format": "binary"},
+            "operation": {"type": "string"},
+            "params": {"type": "string", "default": "{}"}
+        }
+    }}}
+}})
+async def submit_job(request: Request):
+    """
+    Queue any conversion or editing operation and return a job id right away.
+    
+    Multipart fields:
+        file: The file to process
+        operation: Operation name, e.g. 'pdf-to-word', 'compress' or 'rotate'
+        params: JSON object with the operation's options, e.g. {"rotation": 180}
+    """
+    job_id = uuid.uuid4().hex
+    directory = job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        compress_pdf(input_path, output_path, compression_level)
-        
-        background_tasks.add_task(cleanup_files, [input_path, output_path])
+        started = time.perf_counter()
+        upload = await ingest_request(request, directory)
+        
+        operation = upload.fields.get("operation", "")
+        op = get_operation(operation)
+        if op is None:
+            raise HTTPException(status_code=400, detail=f"Unknown operation: {operation}")
+        # The operation is only known once the upload is in
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, operation=op.name, stage="ingest")
+        metrics.UPLOAD_BYTES.observe(upload.file.size, operation=op.name)
+        if not op.accepts(upload.file.filename) or upload.file.kind not in op.kinds:
+            raise HTTPException(status_code=400, detail=op.invalid_type_detail)
         
-        return FileResponse(
-            output_path, 
-            media_type="application/pdf", 
-            filename=output_filename
-        )
+        try:
+            parsed_params = op.parse_params(json.loads(upload.fields.get("params") or "{}"))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid params: {e}")
+        
+        output_filename = op.output_filename(upload.file.filename)
+        output_path = os.path.join(directory, "output" + Path(output_filename).suffix)
+        await run_in_thread("jobs", create_job, job_id, operation, parsed_params, upload.file.path, output_path,
+                            output_filename, upload.file.sha256)
+    except HTTPException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
     except Exception as e:
-        cleanup_files([input_path])
+        shutil.rmtree(directory, ignore_errors=True)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    job_scheduler.submit(job_id)
+    return {"id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "id": job.id,
+        "operation": job.operation,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "result_url": f"/jobs/{job.id}/result" if job.status == "done" else None
+    }
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Job is not finished yet")
+    if not os.path.exists(job.output_path):
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    
+    op = get_operation(job.operation)
+    return FileResponse(
+        job.output_path,
+        media_type=op.media_type if op else "application/octet-stream",
+        filename=job.output_filename
+    )
@@ -0,0 +1,349 @@
+"""
+Prometheus metrics and the timing API for every operation.
+
+Each operation is timed by stage (ingest, cache, queue, convert) and by
+the backend that actually produced its result. When a backend fails and
+the next one in its chain is tried (LibreOffice, then python-docx; WeasyPrint,
+then plain text; pikepdf, then pypdf, fitz and Ghostscript for repairs),
+that is counted as a fallback. Sizes of uploads and outputs, and the run
+time of every external tool, are recorded too.
+
+Conversions run in several processes: the prefork workers and their process
+pools. Every process keeps its own values and writes them to a snapshot file
+in METRICS_DIR every METRICS_FLUSH_SECONDS. /metrics, served by whichever
+worker takes the scrape, adds up all the snapshots. The snapshots of processes
+that exited are folded into one file of their own, so counters never go back
+and the directory does not grow with every recycled worker, until the server
+restarts.
+
+No client library is needed; the text exposition format is simple enough.
+"""
+import atexit
+import contextvars
+import json
+import multiprocessing.util
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots of exited processes are kept as they are
+    fcntl = None
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "instantpdf-metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# 1 KB to 1 GB in steps of 4
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+# Values of the processes that exited, and the lock guarding the fold into it
+EXITED_SNAPSHOT = "exited.json"
+LOCK_FILE = "metrics.lock"
+
+_lock = threading.Lock()
+_registry = {}
+_state = {"token": None, "flusher": None, "dirty": False}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}  # label values -> value
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _changed()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            # Counts per bucket (not cumulative), then the sum and the count
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 3))
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        _changed()
+
+
+REQUESTS = Counter("instantpdf_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("instantpdf_request_seconds", "Time until the response headers were sent.",
+                            ("method", "route"))
+UPLOAD_BYTES = Histogram("instantpdf_upload_bytes", "Size of uploaded files.", ("operation",), BYTES_BUCKETS)
+OUTPUT_BYTES = Histogram("instantpdf_output_bytes", "Size of conversion results.", ("operation",), BYTES_BUCKETS)
+STAGE_SECONDS = Histogram("instantpdf_stage_seconds",
+                          "Time spent per stage of an operation: ingest, cache, queue (admission wait), convert.",
+                          ("operation", "stage"))
+CONVERSION_SECONDS = Histogram("instantpdf_conversion_seconds",
+                               "Conversion time by the backend that produced the result.",
+                               ("operation", "backend", "outcome"))
+CACHE_LOOKUPS = Counter("instantpdf_cache_lookups_total", "Result cache lookups.", ("operation", "result"))
+FALLBACKS = Counter("instantpdf_fallbacks_total",
+                    "Backends that failed or were unavailable, so the next one in the chain was tried.",
+                    ("component", "backend"))
+SUBPROCESS_SECONDS = Histogram("instantpdf_subprocess_seconds", "Run time of external tools by outcome.",
+                               ("tool", "outcome"))
+
+# Set by conversion() for the code it runs, in threads too
+_conversion = contextvars.ContextVar("conversion", default=None)
+
+
+@contextmanager
+def timed(stage: str, operation: str):
+    """Record the time spent in the block as a stage of operation."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, operation=operation, stage=stage)
+
+
+@contextmanager
+def conversion(operation: str):
+    """
+    Time a conversion as its "convert" stage and by backend. Code running in
+    the block (thread pool jobs included) names the backend with used_backend().
+    """
+    record = {"backend": "default"}
+    token = _conversion.set(record)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield record
+        outcome = "ok"
+    finally:
+        _conversion.reset(token)
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, operation=operation, stage="convert")
+        CONVERSION_SECONDS.observe(seconds, operation=operation, backend=record["backend"], outcome=outcome)
+
+
+def used_backend(name: str):
+    """Name the backend that produced the result of the running conversion."""
+    record = _conversion.get()
+    if record is not None:
+        record["backend"] = name
+
+
+def fallback(component: str, backend: str):
+    """Count that backend failed (or is missing) and component goes on with the next one."""
+    FALLBACKS.inc(component=component, backend=backend)
+
+
+def _snapshot() -> dict:
+    with _lock:
+        return {name: [[list(key), value] for key, value in metric.values.items()]
+                for name, metric in _registry.items()}
+
+
+def _snapshot_path(token: str) -> str:
+    return os.path.join(METRICS_DIR, f"{os.getpid()}-{token}.json")
+
+
+def flush():
+    """Write this process's values to its snapshot file."""
+    token = _state["token"]
+    if token is None or not _state["dirty"]:
+        return
+    _state["dirty"] = False
+    path = _snapshot_path(token)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        _state["dirty"] = True
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def _changed():
+    _state["dirty"] = True
+    if _state["flusher"] is None:
+        with _lock:
+            if _state["flusher"] is None:
+                _state["token"] = uuid.uuid4().hex[:8]
+                _state["flusher"] = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+                _state["flusher"].start()
+
+
+def _reset_in_child():
+    """A forked process starts from zero, with a snapshot file of its own."""
+    global _lock
+    _lock = threading.Lock()
+    for metric in _registry.values():
+        metric.values = {}
+    _state.update(token=None, flusher=None, dirty=False)
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+atexit.register(flush)
+# Process pool workers exit without running atexit handlers
+multiprocessing.util.Finalize(None, flush, exitpriority=10)
+
+
+def clear_snapshots():
+    """Forget the previous run. Called once per server start, before any worker exists."""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError:
+            pass
+
+
+def _add(totals: dict, snapshot: dict):
+    for name, entries in snapshot.items():
+        if name not in totals:
+            continue
+        for key, value in entries:
+            key = tuple(key)
+            current = totals[name].get(key)
+            if current is None:
+                totals[name][key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                totals[name][key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[name][key] = current + value
+
+
+def _read(path: str):
+    """A snapshot file, or None when it is gone or left half written by a killed process."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _fold_exited(names: list):
+    """
+    Add the snapshots of processes that are gone to the exited snapshot and
+    delete them. Called with the lock held exclusively.
+    """
+    dead = [name for name in names
+            if name.split("-", 1)[0].isdigit() and not _alive(int(name.split("-", 1)[0]))]
+    if not dead:
+        return
+    totals = {name: {} for name in _registry}
+    for name in [EXITED_SNAPSHOT] + [name for name in dead if name.endswith(".json")]:
+        _add(totals, _read(os.path.join(METRICS_DIR, name)) or {})
+    path = os.path.join(METRICS_DIR, EXITED_SNAPSHOT)
+    with open(path + ".tmp", "w") as f:
+        json.dump({name: [[list(key), value] for key, value in values.items()]
+                   for name, values in totals.items()}, f)
+    os.replace(path + ".tmp", path)
+    # Half-written .tmp files of killed processes go too
+    for name in dead:
+        os.remove(os.path.join(METRICS_DIR, name))
+
+
+def _merged() -> dict:
+    totals = {name: {} for name in _registry}
+    own = f"{os.getpid()}-{_state['token']}.json" if _state["token"] else None
+    lock = None
+    try:
+        if fcntl is not None:
+            try:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                lock = open(os.path.join(METRICS_DIR, LOCK_FILE), "a")
+                # Exclusive, so no scrape sees a snapshot both in its own file
+                # and in the exited one, or in neither
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                _fold_exited(os.listdir(METRICS_DIR))
+            except OSError:
+                pass
+        try:
+            names = os.listdir(METRICS_DIR)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name.endswith(".json") and name != own:
+                _add(totals, _read(os.path.join(METRICS_DIR, name)) or {})
+    finally:
+        if lock is not None:
+            lock.close()
+    _add(totals, _snapshot())
+    return totals
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render() -> str:
+    """All metrics of all processes, in the Prometheus text exposition format."""
+    lines = []
+    for name, values in _merged().items():
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(values.items()):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ("+Inf",), value):
+                cumulative += count
+                le = 'le="{}"'.format(bound if bound == "+Inf" else _number(bound))
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, key)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
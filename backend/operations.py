@@ -0,0 +1,210 @@
+"""
+Registry of every conversion and editing operation the API offers.
+
+Each entry knows which function implements it, whether it runs in the thread
+or process pool, what it accepts and produces, and which extra parameters it
+takes. The job API uses this to run any operation by name.
+"""
+import importlib
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+from pipeline import pipeline_steps
+from executor import run_in_thread, run_in_process
+from cache import result_cache, cache_key
+from singleflight import conversion_flights
+from admission import admission_controller, estimate_cost, AdmissionRejected
+import metrics
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PPTX = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+PDF_KINDS = ("pdf",)
+
+
+class LazyFunction:
+    """
+    A function that is imported from its module on first call.
+
+    Keeps the registry from loading every converter backend at startup.
+    Instances pickle as the module and function name, so they can be sent
+    to the process pool just like the function itself.
+    """
+
+    def __init__(self, path: str):
+        # "module.function"
+        self.module, _, self.name = path.rpartition(".")
+
+    def resolve(self) -> Callable:
+        return getattr(importlib.import_module(self.module), self.name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"LazyFunction({self.module}.{self.name})"
+
+
+def lazy(path: str) -> LazyFunction:
+    return LazyFunction(path)
+
+
+@dataclass(frozen=True)
+class Operation:
+    name: str
+    func: Callable
+    runner: str  # "thread" or "process"
+    extensions: tuple
+    kinds: tuple  # content types accepted after sniffing, see uploads.sniff_kind
+    label: str  # human readable input type for error messages
+    output_suffix: str
+    media_type: str
+    # (name, type, default) for every argument after input_path/output_path
+    params: tuple = field(default_factory=tuple)
+    # Same edit on an open fitz.Document, taking the same params, for pipelines
+    step: Optional[Callable] = None
+
+    def output_filename(self, input_filename: str) -> str:
+        return Path(input_filename).stem + self.output_suffix
+
+    def accepts(self, filename: str) -> bool:
+        return filename.lower().endswith(self.extensions)
+
+    @property
+    def invalid_type_detail(self) -> str:
+        return f"Invalid file type. Please upload {self.label}."
+
+    def parse_params(self, raw: dict) -> dict:
+        """Validate and coerce user supplied parameters, filling in defaults."""
+        unknown = set(raw) - {name for name, _, _ in self.params}
+        if unknown:
+            raise ValueError(f"Unknown parameters for {self.name}: {', '.join(sorted(unknown))}")
+
+        parsed = {}
+        for name, kind, default in self.params:
+            value = raw.get(name, default)
+            if value is not None:
+                try:
+                    value = kind(value)
+                except (TypeError, ValueError) as e:
+                    if isinstance(kind, type):
+                        raise ValueError(f"Parameter {name} must be of type {kind.__name__}")
+                    # Validators like pipeline_steps explain what is wrong
+                    raise ValueError(f"Parameter {name}: {e}")
+            parsed[name] = value
+        return parsed
+
+
+def parse_bool(value) -> bool:
+    """Accept real booleans and the usual spellings in form and query values."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "on"):
+        return True
+    if text in ("false", "0", "no", "off", ""):
+        return False
+    raise ValueError(f"{value!r} is not a boolean")
+
+
+OPERATIONS = {op.name: op for op in [
+    Operation("docx", lazy("converter.convert_docx_to_pdf"), "thread", (".docx",), ("docx",), "a .docx file",
+              ".pdf", PDF),
+    Operation("xlsx", lazy("converter.convert_xlsx_to_pdf"), "process", (".xlsx",), ("xlsx",), "a .xlsx file",
+              ".pdf", PDF),
+    Operation("image", lazy("converter.convert_image_to_pdf"), "process", (".jpg", ".jpeg", ".png"), ("jpeg", "png"),
+              "a JPG or PNG file", ".pdf", PDF),
+    Operation("pptx", lazy("converter.convert_pptx_to_pdf"), "thread", (".pptx", ".ppt"), ("pptx", "ole"),
+              "a .pptx file", ".pdf", PDF),
+    Operation("html", lazy("converter.convert_html_to_pdf"), "thread", (".html",), ("html",), "an .html file",
+              ".pdf", PDF),
+    Operation("pdf-to-jpg", lazy("converter.convert_pdf_to_jpg"), "thread", (".pdf",), PDF_KINDS, "a .pdf file",
+              ".jpg", "image/jpeg"),
+    Operation("pdf-to-word", lazy("converter.convert_pdf_to_docx"), "thread", (".pdf",), PDF_KINDS, "a .pdf file",
+              ".docx", DOCX),
+    # Table extraction fans out to the process pool itself
+    Operation("pdf-to-excel", lazy("converter.convert_pdf_to_xlsx"), "thread", (".pdf",), PDF_KINDS, "a .pdf file",
+              ".xlsx", XLSX, (("sheet_per_page", parse_bool, False),)),
+    Operation("pdf-to-pptx", lazy("converter.convert_pdf_to_pptx"), "process", (".pdf",), PDF_KINDS, "a .pdf file",
+              ".pptx", PPTX),
+    Operation("rotate", lazy("pdf_editor.rotate_pdf"), "process", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_rotated.pdf", PDF, (("rotation", int, 90),), step=lazy("pdf_editor.rotate_document")),
+    Operation("watermark", lazy("pdf_editor.add_watermark_to_pdf"), "process", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_watermarked.pdf", PDF,
+              (("text", str, "WATERMARK"), ("opacity", float, 1.0), ("pages", str, "all"),
+               ("rotate", int, 45), ("position", str, "center")), step=lazy("pdf_editor.watermark_document")),
+    Operation("page-numbers", lazy("pdf_editor.add_page_numbers_to_pdf"), "process", (".pdf",), PDF_KINDS,
+              "a .pdf file", "_numbered.pdf", PDF,
+              (("position", str, "bottom-center"), ("start_from", int, 1), ("end_at", int, None)),
+              step=lazy("pdf_editor.number_document")),
+    Operation("crop", lazy("pdf_editor.crop_pdf"), "process", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_cropped.pdf", PDF, (("margin", int, 50),), step=lazy("pdf_editor.crop_document")),
+    Operation("add-text", lazy("pdf_editor.edit_pdf_add_text"), "process", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_edited.pdf", PDF, (("text", str, "Added Text"), ("x", int, 100), ("y", int, 100)),
+              step=lazy("pdf_editor.add_text_to_document")),
+    Operation("compress", lazy("converter.compress_pdf"), "thread", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_compressed.pdf", PDF, (("compression_level", str, "medium"),),
+              step=lazy("converter.compress_document")),
+    # Image recompression inside a pipeline fans out to the process pool itself
+    Operation("pipeline", lazy("pipeline.run_pipeline"), "thread", (".pdf",), PDF_KINDS, "a .pdf file",
+              "_processed.pdf", PDF, (("operations", pipeline_steps, "[]"),)),
+]}
+
+
+def get_operation(name: str) -> Optional[Operation]:
+    return OPERATIONS.get(name)
+
+
+async def run_operation(operation: Operation, input_path: str, output_path: str, params: dict,
+                        input_digest: Optional[str] = None, wait_for_capacity: bool = False):
+    """
+    Run an operation through the execution layer with already parsed params.
+
+    When the SHA-256 of the input is known, the result cache is checked first
+    and a hit is served without running the conversion at all. On a miss,
+    identical requests already running are joined instead (see singleflight.py).
+    The conversion itself waits for a slot in its admission lane, and raises
+    AdmissionRejected when the lane is saturated unless wait_for_capacity is set.
+    """
+    key = cache_key(input_digest, operation.name, params) if input_digest else None
+    if key:
+        with metrics.timed("cache", operation.name):
+            hit = await run_in_thread("cache", result_cache.fetch, key, output_path)
+        metrics.CACHE_LOOKUPS.inc(operation=operation.name, result="hit" if hit else "miss")
+        if hit:
+            return
+
+    args = [params[name] for name, _, _ in operation.params]
+    runner = run_in_process if operation.runner == "process" else run_in_thread
+
+    async def compute(input_path: str, output_path: str):
+        with metrics.timed("queue", operation.name):
+            cost = await run_in_thread("admission", estimate_cost, operation.name, input_path)
+            ticket = await admission_controller.acquire(cost, wait=wait_for_capacity)
+        try:
+            with metrics.conversion(operation.name):
+                await runner(operation.name, operation.func, input_path, output_path, *args)
+        finally:
+            ticket.release()
+        if not os.path.exists(output_path):
+            return
+        metrics.OUTPUT_BYTES.observe(os.path.getsize(output_path), operation=operation.name)
+        if key:
+            await run_in_thread("cache", result_cache.store, key, output_path)
+
+    if not key:
+        await compute(input_path, output_path)
+        return
+    while True:
+        try:
+            await conversion_flights.run(key, compute, input_path, output_path)
+            return
+        except AdmissionRejected:
+            # The flight's leader does not wait for capacity, but this caller
+            # does: the rejected flight is gone, so join or lead the next one
+            if not wait_for_capacity:
+                raise
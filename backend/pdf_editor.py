@@ -1,309 +1,164 @@
 import fitz  # PyMuPDF
-from pypdf import PdfReader, PdfWriter
 import os
+import shutil
+
+from pdf_opener import open_pdf
+from rasterizer import parse_page_range
+from stamping import Stamp, stamp_pages, number_pages
+
+# Editing steps below work on an open fitz.Document so several of them can be
+# chained with a single parse and a single save (see pipeline.py). The *_pdf
+# functions wrap one step each for the single-operation endpoints.
+
+def save_pdf(doc, output_path: str, garbage: int = 1, **options):
+    """
+    Write an edited document: drop unused objects, compress streams and small
+    objects. options are further Document.save arguments, or overrides.
+    """
+    doc.save(output_path, **{"garbage": garbage, "deflate": True, "use_objstms": 1, **options})
+    doc.close()
+
+# Incremental saves append only the changed objects to a copy of the input.
+# That beats a full rewrite for big files with heavy pages (scans, photos),
+# where an edit like /Rotate or a CropBox touches a tiny part of the file.
+INCREMENTAL_SAVE_MIN_MB = float(os.getenv("INCREMENTAL_SAVE_MIN_MB", "10"))
+INCREMENTAL_SAVE_MIN_KB_PER_PAGE = float(os.getenv("INCREMENTAL_SAVE_MIN_KB_PER_PAGE", "32"))
+
+def prefers_incremental_save(size: int, page_count: int) -> bool:
+    """Whether a file of size bytes is big and heavy enough per page to skip the full rewrite."""
+    if size < INCREMENTAL_SAVE_MIN_MB * 1024 * 1024:
+        return False
+    return size / max(page_count, 1) >= INCREMENTAL_SAVE_MIN_KB_PER_PAGE * 1024
+
+def open_for_edit(input_path: str, output_path: str, action: str = "Editing", incremental: bool = None):
+    """
+    Open a PDF for an edit that finish_edit will write to output_path.
+    
+    With incremental=None the size heuristic decides. For an incremental
+    edit the input is copied to output_path and the copy is opened, so only
+    the changed objects have to be appended. Returns (doc, incremental).
+    """
+    doc = open_pdf(input_path, action)
+    if incremental is None:
+        incremental = prefers_incremental_save(os.path.getsize(input_path), len(doc))
+    # Repaired or otherwise rebuilt documents can only be written in full
+    if not incremental or not doc.can_save_incrementally() or doc.name != input_path:
+        return doc, False
+    
+    doc.close()
+    shutil.copyfile(input_path, output_path)
+    return fitz.open(output_path), True
+
+def finish_edit(doc, output_path: str, incremental: bool, garbage: int = 1, **options):
+    """Save a document opened by open_for_edit; options go to save_pdf for a full rewrite."""
+    if incremental:
+        doc.saveIncr()
+        doc.close()
+    else:
+        save_pdf(doc, output_path, garbage=garbage, **options)
+
+def rotate_document(doc, rotation: int = 90):
+    """Rotate every page by specified degrees (90, 180, 270), on top of its current rotation"""
+    if rotation % 90:
+        raise ValueError("Rotation must be a multiple of 90 degrees")
+    for page in doc:
+        page.set_rotation((page.rotation + rotation) % 360)
+
+def watermark_document(doc, watermark_text: str = "WATERMARK", opacity: float = 1.0, pages: str = "all",
+                       rotate: int = 45, position: str = "center", stamp_path: str = None):
+    """
+    Add a watermark to the selected pages.
+    
+    The watermark is text, or the image or first PDF page at stamp_path. It
+    is built once and shared by every page (see stamping.py). pages is a
+    1-based selection like "1-3,7" or "all".
+    """
+    if stamp_path:
+        stamp = Stamp.from_file(stamp_path, opacity=opacity)
+    else:
+        stamp = Stamp.text(watermark_text, fontsize=60, color=(0.8, 0.8, 0.8), opacity=opacity)
+    
+    # Centered, diagonal by default, on top of the page content
+    stamp_pages(doc, stamp, parse_page_range(pages, len(doc)), position=position, rotate=rotate)
+
+def number_document(doc, position: str = "bottom-center", start_from: int = 1, end_at: int = None):
+    """Add page numbers to a page range (1-based, inclusive)"""
+    total_pages = len(doc)
+    start_index = 0
+    end_index = total_pages
+    
+    # Parse range (1-based to 0-based)
+    if start_from is not None and start_from > 1:
+        start_index = max(0, start_from - 1)
+    if end_at is not None:
+         end_index = min(total_pages, end_at)
+
+    # Digits are laid out once; positions are worked out once per page size
+    number_pages(doc, range(start_index, end_index), position=position, fontsize=12, color=(0, 0, 0))
+
+def crop_document(doc, margin: int = 50):
+    """Crop page margins by specified points"""
+    for page in doc:
+        # Unrotated coordinates, which set_cropbox expects on rotated pages too
+        rect = page.cropbox
+        
+        # Create cropped rectangle (remove margins)
+        crop_rect = fitz.Rect(
+            rect.x0 + margin,
+            rect.y0 + margin,
+            rect.x1 - margin,
+            rect.y1 - margin
+        )
+        
+        page.set_cropbox(crop_rect)
+
+def add_text_to_document(doc, text: str = "Added Text", x: int = 100, y: int = 100):
+    """Add text to the first page with its baseline at (x, y) from the top-left corner"""
+    doc[0].insert_text((x, y), text, fontname="helv", fontsize=12, color=(0, 0, 0))
 
 def rotate_pdf(input_path: str, output_path: str, rotation: int = 90):
     """Rotate PDF pages by specified degrees (90, 180, 270)"""
+    doc, incremental = open_for_edit(input_path, output_path, "Rotation")
     try:
-        pdf_reader = PdfReader(input_path)
-        pdf_writer = PdfWriter()
-        
-        for page in pdf_reader.pages:
-            page.rotate(rotation)
-            pdf_writer.add_page(page)
-        
-        with open(output_path, 'wb') as output_file:
-            pdf_writer.write(output_file)
+        rotate_document(doc, rotation)
+        finish_edit(doc, output_path, incremental)
     except Exception as e:
         raise RuntimeError(f"PDF rotation failed: {e}")
 
-def add_watermark_to_pdf(input_path: str, output_path: str, watermark_text: str = "WATERMARK"):
-    """Add watermark text to PDF pages"""
-    """Add watermark text to PDF pages"""
+def add_watermark_to_pdf(input_path: str, output_path: str, watermark_text: str = "WATERMARK",
+                         opacity: float = 1.0, pages: str = "all", rotate: int = 45,
+                         position: str = "center", stamp_path: str = None):
+    """Add a watermark to PDF pages (see watermark_document)"""
+    doc, incremental = open_for_edit(input_path, output_path, "Watermark")
     try:
-        doc = fitz.open(input_path)
-    except Exception:
-        # Fallback: Repair with Ghostscript
-        import subprocess
-        print("Standard open failed. Attempting Ghostscript repair...")
-        repaired_path = input_path.replace(".pdf", "_repaired.pdf")
-        try:
-            subprocess.run([
-                "gs", "-o", repaired_path, "-sDEVICE=pdfwrite", "-dPDFSETTINGS=/default", "-dNOPAUSE", "-dBATCH", input_path
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            doc = fitz.open(repaired_path)
-        except Exception as e_gs:
-             raise RuntimeError(f"Watermark failed (even after repair): {e_gs}")
-
-    try:
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Get page dimensions
-            rect = page.rect
-            
-            # Add watermark text (centered, diagonal, semi-transparent)
-            text_rect = fitz.Rect(0, 0, rect.width, rect.height)
-            
-            # Insert diagonal watermark
-            page.insert_textbox(
-                text_rect,
-                watermark_text,
-                fontsize=60,
-                align=fitz.TEXT_ALIGN_CENTER,
-                color=(0.8, 0.8, 0.8),  # Light gray
-                rotate=45,
-                overlay=True
-            )
-        
-        doc.save(output_path)
-        doc.close()
+        watermark_document(doc, watermark_text, opacity, pages, rotate, position, stamp_path)
+        finish_edit(doc, output_path, incremental)
     except Exception as e:
         raise RuntimeError(f"Watermark addition failed: {e}")
 
 def add_page_numbers_to_pdf(input_path: str, output_path: str, position: str = "bottom-center", start_from: int = 1, end_at: int = None):
     """Add page numbers to PDF with customization"""
+    doc, incremental = open_for_edit(input_path, output_path, "Page numbering")
     try:
-        doc = fitz.open(input_path)
-    except Exception:
-         # Fallback: Repair with Ghostscript
-        import subprocess
-        print("Standard open failed. Attempting Ghostscript repair...")
-        repaired_path = input_path.replace(".pdf", "_repaired.pdf")
-        try:
-            subprocess.run([
-                "gs", "-o", repaired_path, "-sDEVICE=pdfwrite", "-dPDFSETTINGS=/default", "-dNOPAUSE", "-dBATCH", input_path
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            doc = fitz.open(repaired_path)
-        except Exception as e_gs:
-             raise RuntimeError(f"Page numbering failed (even after repair): {e_gs}")
-
-    try:
-        total_pages = len(doc)
-        start_index = 0
-        end_index = total_pages
-        
-        # Parse range (1-based to 0-based)
-        if start_from is not None and start_from > 1:
-            start_index = max(0, start_from - 1)
-        if end_at is not None:
-             end_index = min(total_pages, end_at)
-
-        for i in range(start_index, end_index):
-            page = doc[i]
-            rect = page.rect
-            width = rect.width
-            height = rect.height
-            
-            # Margin from edge
-            margin = 30
-            box_width = 100
-            box_height = 20
-            
-            # Calculate coordinates based on position
-            if position == "bottom-center":
-                x0 = (width - box_width) / 2
-                y0 = height - margin
-            elif position == "bottom-right":
-                x0 = width - margin - box_width
-                y0 = height - margin
-            elif position == "bottom-left":
-                x0 = margin
-                y0 = height - margin
-            elif position == "top-center":
-                x0 = (width - box_width) / 2
-                y0 = margin
-            elif position == "top-right":
-                x0 = width - margin - box_width
-                y0 = margin
-            elif position == "top-left":
-                x0 = margin
-                y0 = margin
-            else:
-                # Default to bottom-center
-                x0 = (width - box_width) / 2
-                y0 = height - margin
-
-            text_rect = fitz.Rect(x0, y0, x0 + box_width, y0 + box_height)
-            
-            # Text content
-            page_text = f"{i + 1}"
-            
-            page.insert_textbox(
-                text_rect,
-                page_text,
-                fontsize=12,
-                align=fitz.TEXT_ALIGN_CENTER,
-                color=(0, 0, 0)
-            )
-        
-        doc.save(output_path)
-        doc.close()
+        number_document(doc, position, start_from, end_at)
+        finish_edit(doc, output_path, incremental)
     except Exception as e:
         raise RuntimeError(f"Page numbering failed: {e}")
 
 def crop_pdf(input_path: str, output_path: str, margin: int = 50):
     """Crop PDF margins by specified pixels"""
+    doc, incremental = open_for_edit(input_path, output_path, "Cropping")
     try:
-        doc = fitz.open(input_path)
-    except Exception:
-         # Fallback: Repair with Ghostscript
-        import subprocess
-        print("Standard open failed. Attempting Ghostscript repair...")
-        repaired_path = input_path.replace(".pdf", "_repaired.pdf")
-        try:
-            subprocess.run([
-                "gs", "-o", repaired_path, "-sDEVICE=pdfwrite", "-dPDFSETTINGS=/default", "-dNOPAUSE", "-dBATCH", input_path
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            doc = fitz.open(repaired_path)
-        except Exception as e_gs:
-             raise RuntimeError(f"Cropping failed (even after repair): {e_gs}")
-
-    try:
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            rect = page.rect
-            
-            # Create cropped rectangle (remove margins)
-            crop_rect = fitz.Rect(
-                rect.x0 + margin,
-                rect.y0 + margin,
-                rect.x1 - margin,
-                rect.y1 - margin
-            )
-            
-            page.set_cropbox(crop_rect)
-        
-        doc.save(output_path)
-        doc.close()
+        crop_document(doc, margin)
+        finish_edit(doc, output_path, incremental)
     except Exception as e:
         raise RuntimeError(f"PDF cropping failed: {e}")
 
 def edit_pdf_add_text(input_path: str, output_path: str, text: str = "Added Text", x: int = 100, y: int = 100):
-    """Add text to PDF at specified position using multiple strategies for robustness"""
-    
-    # Strategy 1: pikepdf (Best for repair and quality)
+    """Add text to PDF at specified position"""
+    doc, incremental = open_for_edit(input_path, output_path, "Adding text")
     try:
-        import pikepdf
-        from io import BytesIO
-        from reportlab.pdfgen import canvas
-        
-        pdf = pikepdf.Pdf.open(input_path, allow_overwriting_input=True)
-        page = pdf.pages[0]
-        rect = page.mediabox
-        page_width = float(rect[2]) - float(rect[0])
-        page_height = float(rect[3]) - float(rect[1])
-        
-        packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-        can.setFont("Helvetica", 12)
-        rl_y = page_height - y
-        can.drawString(x, rl_y, text)
-        can.save()
-        packet.seek(0)
-        
-        text_pdf = pikepdf.Pdf.open(packet)
-        text_page = text_pdf.pages[0]
-        page.overlay(text_page, pikepdf.Rectangle(0, 0, page_width, page_height))
-        pdf.save(output_path)
-        return
-    except Exception as e_pikepdf:
-        print(f"Strategy 1 (pikepdf) failed: {e_pikepdf}")
-
-    # Strategy 2: pypdf (Lenient parser)
-    try:
-        from io import BytesIO
-        from reportlab.pdfgen import canvas
-        from pypdf import PdfReader, PdfWriter
-
-        reader = PdfReader(input_path)
-        writer = PdfWriter()
-        page = reader.pages[0]
-        
-        # pypdf coordinates might vary, try to get width/height safely
-        try:
-            page_width = float(page.mediabox.width)
-            page_height = float(page.mediabox.height)
-        except:
-            page_width = 612 # Fallback to Letter width
-            page_height = 792 # Fallback to Letter height
-
-        packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-        can.setFont("Helvetica", 12)
-        rl_y = page_height - y
-        can.drawString(x, rl_y, text)
-        can.save()
-        packet.seek(0)
-        
-        overlay_reader = PdfReader(packet)
-        overlay_page = overlay_reader.pages[0]
-        
-        # Merge
-        page.merge_page(overlay_page)
-        writer.add_page(page)
-        
-        for i in range(1, len(reader.pages)):
-            writer.add_page(reader.pages[i])
-            
-        with open(output_path, "wb") as f:
-            writer.write(f)
-        return
-    except Exception as e_pypdf:
-        print(f"Strategy 2 (pypdf) failed: {e_pypdf}")
-
-    # Strategy 3: PyMuPDF / fitz (Direct modification, very fast)
-    try:
-        doc = fitz.open(input_path)
-        page = doc[0]
-        text_rect = fitz.Rect(x, y, x + 300, y + 50)
-        page.insert_textbox(
-            text_rect,
-            text,
-            fontsize=12,
-            color=(0, 0, 0),
-            align=fitz.TEXT_ALIGN_LEFT
-        )
-        doc.save(output_path)
-        doc.close()
-        return
-    except Exception as e_fitz:
-        print(f"Strategy 3 (fitz) failed: {e_fitz}")
-        
-    # If all fail
-    # Strategy 4: The Nuclear Option (Ghostscript Repair + Fitz)
-    try:
-        import subprocess
-        print("Strategies 1-3 failed. Attempting Ghostscript repair...")
-        
-        repaired_path = input_path.replace(".pdf", "_repaired.pdf")
-        
-        # GS command to repair/rewrite PDF
-        # -o output -sDEVICE=pdfwrite -dPDFSETTINGS=/default input
-        subprocess.run([
-            "gs", "-o", repaired_path, "-sDEVICE=pdfwrite", "-dPDFSETTINGS=/default", "-dNOPAUSE", "-dBATCH", input_path
-        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # Now try Fitz again on the repaired file
-        doc = fitz.open(repaired_path)
-        page = doc[0]
-        text_rect = fitz.Rect(x, y, x + 300, y + 50)
-        page.insert_textbox(
-            text_rect,
-            text,
-            fontsize=12,
-            color=(0, 0, 0),
-            align=fitz.TEXT_ALIGN_LEFT
-        )
-        doc.save(output_path)
-        doc.close()
-        
-        # Cleanup
-        if os.path.exists(repaired_path):
-            os.remove(repaired_path)
-        return
-
-    except Exception as e_gs:
-        print(f"Strategy 4 (Ghostscript) failed: {e_gs}")
-
-    raise RuntimeError("PDF is too severely corrupted. Even repair attempts failed.")
+        add_text_to_document(doc, text, x, y)
+        finish_edit(doc, output_path, incremental)
+    except Exception as e:
+        raise RuntimeError(f"Adding text failed: {e}")
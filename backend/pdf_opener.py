@@ -0,0 +1,328 @@
+"""
+One way to open PDFs for editing, with repair of broken files.
+
+A cheap structural preflight reads only the header and the tail of the file
+(header, startxref, the xref it points at, trailer) to choose a route before
+any parser runs:
+
+- healthy files are opened with PyMuPDF directly
+- damaged files are rebuilt first, by qpdf (fast, structure only), MuPDF's
+  own xref rebuild or Ghostscript pdfwrite (slow, re-renders everything)
+
+Which repair is tried first is learned: every attempt is recorded per kind
+of input (producer, PDF version, xref type), and the strategy most likely
+to succeed fastest for that kind goes first. Repaired files are cached by the
+SHA-256 of the broken input, so editing the same broken file again does not
+pay for the repair again.
+"""
+import hashlib
+import os
+import re
+import time
+from datetime import datetime
+
+import fitz  # PyMuPDF
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from cache import ResultCache
+from database import SessionLocal, RepairStat
+from subprocess_runner import run_tool, ToolCancelled, ToolTimeout
+from logs import get_logger
+import metrics
+
+log = get_logger("pdf_opener")
+
+REPAIR_CACHE_DIR = os.getenv("REPAIR_CACHE_DIR", "./data/repaired")
+REPAIR_CACHE_MAX_MB = float(os.getenv("REPAIR_CACHE_MAX_MB", "512"))
+REPAIR_CACHE_TTL_HOURS = float(os.getenv("REPAIR_CACHE_TTL_HOURS", "24"))
+REPAIR_TIMEOUT_SECONDS = float(os.getenv("REPAIR_TIMEOUT_SECONDS", "120"))
+
+# How much of the start and end of a file the preflight reads
+HEAD_BYTES = 1024
+TAIL_BYTES = 4096
+# How far from either end to look for the /Producer entry
+PRODUCER_SCAN_BYTES = 64 * 1024
+
+repair_cache = ResultCache(
+    REPAIR_CACHE_DIR,
+    max_bytes=int(REPAIR_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=REPAIR_CACHE_TTL_HOURS * 3600,
+)
+
+
+def _producer(data: bytes) -> str:
+    """The producer family in an Info dictionary, without version numbers."""
+    match = re.search(rb"/Producer\s*\(((?:\\.|[^\\)])*)\)", data)
+    if not match:
+        return "unknown"
+    raw = match.group(1)
+    if raw.startswith(b"\xfe\xff"):
+        text = raw[2:].decode("utf-16-be", errors="ignore")
+    else:
+        text = raw.decode("latin-1")
+    # "pdfTeX-1.40.21" and "pdfTeX-1.40.25" are the same kind of input
+    words = [word for word in re.split(r"[\s\-_]+", text) if word and not any(c.isdigit() for c in word)]
+    return " ".join(words)[:64] or "unknown"
+
+
+def inspect_pdf(path: str) -> dict:
+    """
+    Check a PDF's skeleton without parsing it.
+
+    Returns {"verdict", "producer", "pdf_version", "xref_type"}. verdict is
+    "ok", "damaged" (header present, but the xref or trailer is missing or
+    points nowhere) or "not-pdf".
+    """
+    info = {"verdict": "damaged", "producer": "unknown", "pdf_version": "unknown", "xref_type": "none"}
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(max(HEAD_BYTES, PRODUCER_SCAN_BYTES))
+        version = re.search(rb"%PDF-(\d\.\d)", head[:HEAD_BYTES])
+        if not version:
+            info["verdict"] = "not-pdf"
+            return info
+        info["pdf_version"] = version.group(1).decode()
+        f.seek(max(0, size - PRODUCER_SCAN_BYTES))
+        end = f.read()
+        info["producer"] = _producer(end) if b"/Producer" in end else _producer(head)
+
+        tail = end[-TAIL_BYTES:]
+        offsets = re.findall(rb"startxref\s+(\d+)", tail)
+        offset = int(offsets[-1]) if offsets else size
+        if offset >= size:
+            return info
+        f.seek(offset)
+        xref = f.read(64).lstrip()
+
+    if xref.startswith(b"xref"):
+        info["xref_type"] = "table"
+        # Its trailer sits between the table and startxref
+        trailer = b"trailer" in tail
+    elif re.match(rb"\d+\s+\d+\s+obj", xref):
+        # Cross-reference stream (PDF 1.5+), which carries its own trailer
+        info["xref_type"] = "stream"
+        trailer = True
+    else:
+        trailer = False
+    # Without %%EOF the file is a truncated download or upload
+    if trailer and b"%%EOF" in tail:
+        info["verdict"] = "ok"
+    return info
+
+
+def preflight(path: str) -> str:
+    """Just the verdict of inspect_pdf: "ok", "damaged" or "not-pdf"."""
+    return inspect_pdf(path)["verdict"]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _run_repair(command: list, output_path: str):
+    try:
+        returncode = run_tool(command[0], command, timeout=REPAIR_TIMEOUT_SECONDS)
+    except ToolTimeout as e:
+        raise RuntimeError(str(e))
+    except OSError as e:
+        raise RuntimeError(f"{command[0]} failed: {e}")
+    # qpdf exits with 3 when it succeeded with warnings, which repairs always produce
+    ok = returncode in (0, 3) if command[0] == "qpdf" else returncode == 0
+    if not ok or not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        raise RuntimeError(f"{command[0]} exited with {returncode}")
+
+
+REPAIR_COMMANDS = {
+    "qpdf": lambda src, dst: ["qpdf", src, dst],
+    "ghostscript": lambda src, dst: [
+        "gs", "-o", dst, "-sDEVICE=pdfwrite", "-dPDFSETTINGS=/default", "-dNOPAUSE", "-dBATCH", src
+    ],
+}
+
+# Expected seconds per attempt before anything has been measured; this also
+# sets the order for inputs nobody has seen yet
+REPAIR_PRIOR_SECONDS = {"qpdf": 1.0, "mupdf": 2.0, "ghostscript": 10.0}
+
+
+def _repaired_path(input_path: str) -> str:
+    root, _ = os.path.splitext(input_path)
+    return f"{root}_repaired.pdf"
+
+
+def _repair_with(tool: str):
+    def repair(input_path: str, key: str):
+        repaired_path = _repaired_path(input_path)
+        _run_repair(REPAIR_COMMANDS[tool](input_path, repaired_path), repaired_path)
+        doc = fitz.open(repaired_path)
+        repair_cache.store(key, repaired_path)
+        return doc
+    return repair
+
+
+def _repair_with_mupdf(input_path: str, key: str):
+    # MuPDF rebuilds a broken xref on open; only a document with pages counts
+    doc = fitz.open(input_path)
+    if doc.page_count == 0:
+        doc.close()
+        raise RuntimeError("MuPDF found no pages")
+    return doc
+
+
+REPAIR_STRATEGIES = {
+    "qpdf": _repair_with("qpdf"),
+    "mupdf": _repair_with_mupdf,
+    "ghostscript": _repair_with("ghostscript"),
+}
+
+
+class RepairStrategyTable:
+    """
+    Success, failure and latency of each repair strategy per kind of input.
+
+    Kept in the database so all worker processes learn from each other.
+    Strategies are ordered by expected seconds per attempt divided by the
+    chance of success, which minimizes the expected time until one works.
+    Both are smoothed towards REPAIR_PRIOR_SECONDS and a 50% success rate,
+    so a strategy with a few unlucky attempts is not ruled out for good.
+    """
+
+    def _rows(self, fingerprint: dict = None) -> list:
+        db = SessionLocal()
+        try:
+            query = db.query(RepairStat)
+            if fingerprint:
+                query = query.filter_by(**fingerprint)
+            return query.all()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _expected_cost(strategy: str, row) -> float:
+        successes = row.successes if row else 0
+        failures = row.failures if row else 0
+        total_seconds = row.total_seconds if row else 0.0
+        attempts = successes + failures
+        mean_seconds = (total_seconds + REPAIR_PRIOR_SECONDS[strategy]) / (attempts + 1)
+        success_rate = (successes + 1) / (attempts + 2)
+        return mean_seconds / success_rate
+
+    def order(self, fingerprint: dict) -> list:
+        """Repair strategies for this kind of input, most promising first."""
+        try:
+            rows = {row.strategy: row for row in self._rows(fingerprint)}
+        except Exception as e:
+            log.warning("Repair statistics unavailable", extra={"error": str(e)})
+            rows = {}
+        # sorted() is stable, so ties keep the order of REPAIR_STRATEGIES
+        return sorted(REPAIR_STRATEGIES, key=lambda strategy: self._expected_cost(strategy, rows.get(strategy)))
+
+    def record(self, fingerprint: dict, strategy: str, succeeded: bool, seconds: float):
+        db = SessionLocal()
+        try:
+            counter = RepairStat.successes if succeeded else RepairStat.failures
+            values = {
+                counter.key: counter + 1,
+                "total_seconds": RepairStat.total_seconds + seconds,
+                "updated_at": datetime.utcnow(),
+            }
+            statement = update(RepairStat).filter_by(strategy=strategy, **fingerprint).values(**values)
+            if db.execute(statement).rowcount == 0:
+                db.add(RepairStat(
+                    strategy=strategy, successes=int(succeeded), failures=int(not succeeded),
+                    total_seconds=seconds, updated_at=datetime.utcnow(), **fingerprint
+                ))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another worker created the row first
+                    db.rollback()
+                    db.execute(statement)
+            db.commit()
+        except Exception as e:
+            log.warning("Could not record repair outcome", extra={"error": str(e)})
+        finally:
+            db.close()
+
+    def stats(self) -> list:
+        kinds = {}
+        for row in self._rows():
+            fingerprint = (row.producer, row.pdf_version, row.xref_type)
+            kinds.setdefault(fingerprint, {})[row.strategy] = row
+        table = []
+        for (producer, pdf_version, xref_type), rows in sorted(kinds.items()):
+            strategies = {}
+            for strategy, row in rows.items():
+                attempts = row.successes + row.failures
+                strategies[strategy] = {
+                    "successes": row.successes,
+                    "failures": row.failures,
+                    "mean_seconds": round(row.total_seconds / attempts, 3) if attempts else None,
+                    "expected_cost": round(self._expected_cost(strategy, row), 3),
+                }
+            table.append({
+                "producer": producer,
+                "pdf_version": pdf_version,
+                "xref_type": xref_type,
+                "strategies": strategies,
+                "order": sorted(
+                    REPAIR_STRATEGIES, key=lambda strategy: self._expected_cost(strategy, rows.get(strategy))
+                ),
+            })
+        return table
+
+
+repair_strategies = RepairStrategyTable()
+
+
+def _open_damaged(input_path: str, info: dict, action: str):
+    key = file_sha256(input_path)
+    repaired_path = _repaired_path(input_path)
+    if repair_cache.fetch(key, repaired_path):
+        return fitz.open(repaired_path)
+
+    fingerprint = {name: info[name] for name in ("producer", "pdf_version", "xref_type")}
+    errors = []
+    for strategy in repair_strategies.order(fingerprint):
+        started = time.perf_counter()
+        try:
+            doc = REPAIR_STRATEGIES[strategy](input_path, key)
+        except ToolCancelled:
+            # Says nothing about the strategy
+            raise
+        except Exception as e:
+            seconds = time.perf_counter() - started
+            repair_strategies.record(fingerprint, strategy, False, seconds)
+            metrics.fallback("pdf-repair", strategy)
+            log.warning("Repair failed", extra={"strategy": strategy, "seconds": round(seconds, 3), "error": str(e)})
+            errors.append(f"{strategy}: {e}")
+            continue
+        seconds = time.perf_counter() - started
+        repair_strategies.record(fingerprint, strategy, True, seconds)
+        log.info("Repaired PDF", extra={"file": os.path.basename(input_path), "strategy": strategy,
+                                         "seconds": round(seconds, 3)})
+        return doc
+    raise RuntimeError(f"{action} failed (even after repair): {'; '.join(errors)}")
+
+
+def open_pdf(input_path: str, action: str = "Editing"):
+    """
+    Open a PDF with PyMuPDF, repairing it first when it is broken.
+
+    Damaged files, and files that fail to open despite a clean preflight,
+    go through the repair strategies in the order repair_strategies learned.
+    """
+    info = inspect_pdf(input_path)
+    if info["verdict"] == "not-pdf":
+        raise RuntimeError(f"{action} failed: the file is not a PDF")
+
+    if info["verdict"] == "ok":
+        try:
+            return fitz.open(input_path)
+        except Exception as e:
+            log.warning("Open failed despite a clean preflight, attempting repair", extra={"error": str(e)})
+    return _open_damaged(input_path, info, action)
@@ -0,0 +1,87 @@
+"""
+Several PDF edits on one upload, with a single parse and a single save.
+
+A pipeline is an ordered list of editing operations, e.g. rotate, crop,
+watermark, page numbers and compress. Every operation that has a
+document-level step (Operation.step) can take part. The input is opened
+once, each step changes the same in-memory fitz.Document and the result is
+written once at the end, instead of one upload, parse and write per edit.
+"""
+import json
+
+MAX_PIPELINE_STEPS = 20
+
+
+def parse_steps(value) -> list:
+    """
+    Validate a pipeline description and return it as [(operation name, params)].
+
+    value is a list (or its JSON text) of {"operation": name, "params": {...}}
+    objects; a bare operation name means default params. Raises ValueError
+    with a message fit for the client.
+    """
+    # operations imports this module to register the pipeline operation
+    from operations import get_operation
+
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"operations is not valid JSON: {e}")
+    if not isinstance(value, list) or not value:
+        raise ValueError("operations must be a non-empty list")
+    if len(value) > MAX_PIPELINE_STEPS:
+        raise ValueError(f"A pipeline can have at most {MAX_PIPELINE_STEPS} operations")
+
+    steps = []
+    for position, item in enumerate(value, start=1):
+        if isinstance(item, str):
+            item = {"operation": item}
+        if not isinstance(item, dict):
+            raise ValueError(f"Operation {position} must be an object or a name")
+        name = item.get("operation")
+        op = get_operation(name) if isinstance(name, str) else None
+        if op is None or op.step is None:
+            raise ValueError(f"Operation {position}: {name!r} cannot be used in a pipeline")
+        params = item.get("params") or {}
+        if not isinstance(params, dict):
+            raise ValueError(f"Operation {position}: params must be an object")
+        try:
+            steps.append((name, op.parse_params(params)))
+        except ValueError as e:
+            raise ValueError(f"Operation {position}: {e}")
+    return steps
+
+
+def pipeline_steps(value) -> str:
+    """Canonical JSON for a pipeline, so equal pipelines share cache entries."""
+    return json.dumps(
+        [{"operation": name, "params": params} for name, params in parse_steps(value)],
+        sort_keys=True
+    )
+
+
+def run_pipeline(input_path: str, output_path: str, operations: str = "[]"):
+    """Apply every step of a pipeline to one open document and save it once."""
+    from converter import compressed_save_options
+    from operations import get_operation
+    from pdf_editor import open_for_edit, finish_edit
+
+    steps = parse_steps(operations)
+    # Compression has to rewrite the file; other edits may be appended
+    compresses = any(name == "compress" for name, _ in steps)
+    doc, incremental = open_for_edit(input_path, output_path, "Pipeline", incremental=False if compresses else None)
+    save_options = {"garbage": 1}
+    name = None
+    try:
+        for name, params in steps:
+            op = get_operation(name)
+            op.step(doc, *[params[param] for param, _, _ in op.params])
+            if name == "compress":
+                # Written the way compress_pdf writes, at the strongest level asked for
+                options = compressed_save_options(params["compression_level"])
+                save_options.update(options, garbage=max(save_options["garbage"], options["garbage"]))
+        name = "save"
+        finish_edit(doc, output_path, incremental, **save_options)
+    except Exception as e:
+        raise RuntimeError(f"Pipeline failed at {name}: {e}")
@@ -0,0 +1,93 @@
+"""
+Parallel PDF rasterization streamed back as a ZIP.
+
+Pages are split into small chunks and rendered by PyMuPDF in the process
+pool. Only a bounded window of chunks is in flight at once, and every
+finished chunk is written into the ZIP stream (in page order) before it is
+dropped, so memory stays flat even for catalogues with hundreds of pages.
+"""
+import asyncio
+import os
+from collections import deque
+from itertools import islice
+
+from converter import render_pdf_pages
+from executor import run_in_process, PROCESS_POOL_SIZE
+from zip_stream import ZipStream
+
+RENDER_CHUNK_PAGES = int(os.getenv("RENDER_CHUNK_PAGES", "4"))
+MIN_DPI = 36
+MAX_DPI = 600
+
+# format -> (file extension, media type)
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+}
+
+
+def parse_page_range(spec: str, page_count: int) -> list:
+    """
+    Turn a 1-based page selection like "1-3,7,10-" or "all" into 0-based page numbers.
+
+    Raises ValueError for malformed or out of range selections.
+    """
+    spec = (spec or "all").strip().lower()
+    if spec == "all":
+        return list(range(page_count))
+
+    pages = []
+    seen = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, dash, end = part.partition("-")
+        try:
+            first = int(start) if start else 1
+            last = (int(end) if end else page_count) if dash else first
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+        if first < 1 or last > page_count or first > last:
+            raise ValueError(f"Page range {part} is outside 1-{page_count}")
+        for page in range(first - 1, last):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+
+    if not pages:
+        raise ValueError("No pages selected")
+    return pages
+
+
+async def stream_pages_as_zip(input_path: str, page_numbers: list, name_prefix: str,
+                              dpi: int = 150, image_format: str = "jpeg", quality: int = 85):
+    """Async generator yielding the bytes of a ZIP with one image per page."""
+    extension = IMAGE_FORMATS[image_format][0]
+    chunks = [page_numbers[i:i + RENDER_CHUNK_PAGES] for i in range(0, len(page_numbers), RENDER_CHUNK_PAGES)]
+    remaining = iter(chunks)
+    # Enough chunks in flight to keep every worker busy, but no more
+    window = max(2, PROCESS_POOL_SIZE * 2)
+
+    def submit(chunk):
+        return asyncio.ensure_future(
+            run_in_process("pdf-to-jpg", render_pdf_pages, input_path, chunk, dpi, image_format, quality)
+        )
+
+    pending = deque(submit(chunk) for chunk in islice(remaining, window))
+    archive = ZipStream()
+    try:
+        while pending:
+            rendered = await pending.popleft()
+            next_chunk = next(remaining, None)
+            if next_chunk is not None:
+                pending.append(submit(next_chunk))
+
+            for page_number, data in rendered:
+                yield archive.add(f"{name_prefix}_page-{page_number + 1:03d}{extension}", data)
+        yield archive.close()
+    finally:
+        # Client went away or rendering failed: drop the work still queued
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,99 @@
+"""
+Fonts, stylesheets and renderer setup shared by every conversion in a process.
+
+Parsing a TTF file, building reportlab's sample stylesheet and setting up
+WeasyPrint's fontconfig are the same work for every request, so each is done
+once per process (or once per thread, where the object is not thread-safe)
+and reused. warm_up() loads everything ahead of the first request; warmup.py
+runs it after server startup and in every process pool worker as it starts.
+
+Shared objects must be treated as read-only by their users.
+"""
+import functools
+import os
+import threading
+
+from logs import get_logger
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+UNICODE_FONT_PATH = os.path.join(FONTS_DIR, "Roboto-Regular.ttf")
+UNICODE_FONT_NAME = "Roboto"
+FALLBACK_FONT_NAME = "Helvetica"
+
+log = get_logger("renderer_resources")
+
+
+def load_once(loader):
+    """Call loader on first use only, even when several threads ask at the same time."""
+    lock = threading.Lock()
+    loaded = []
+
+    @functools.wraps(loader)
+    def get():
+        if not loaded:
+            with lock:
+                if not loaded:
+                    loaded.append(loader())
+        return loaded[0]
+
+    return get
+
+
+@load_once
+def unicode_font() -> str:
+    """
+    Register the bundled Unicode font with reportlab and return its name.
+
+    reportlab keeps glyph subsets per document, so one registered TTFont can
+    serve every canvas in the process. Returns "Helvetica" (WinAnsi only)
+    when the font is missing or unreadable.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if not os.path.exists(UNICODE_FONT_PATH):
+        log.warning("Font not found", extra={"font": UNICODE_FONT_PATH})
+        return FALLBACK_FONT_NAME
+    try:
+        pdfmetrics.registerFont(TTFont(UNICODE_FONT_NAME, UNICODE_FONT_PATH))
+        return UNICODE_FONT_NAME
+    except Exception as e:
+        log.warning("Failed to load font", extra={"font": UNICODE_FONT_PATH, "error": str(e)})
+        return FALLBACK_FONT_NAME
+
+
+@load_once
+def sample_stylesheet():
+    """reportlab's sample stylesheet (Normal, Heading1, ...), built once."""
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    return getSampleStyleSheet()
+
+
+_thread_state = threading.local()
+
+
+def weasyprint_font_config():
+    """
+    A WeasyPrint FontConfiguration for the calling thread.
+
+    Creating one initializes fontconfig, which is slow; it is not safe to
+    share between threads, so each conversion thread keeps its own.
+    """
+    if getattr(_thread_state, "font_config", None) is None:
+        from weasyprint.text.fonts import FontConfiguration
+
+        _thread_state.font_config = FontConfiguration()
+    return _thread_state.font_config
+
+
+def warm_up():
+    """Load every shared resource now instead of during the first request."""
+    unicode_font()
+    sample_stylesheet()
+    try:
+        weasyprint_font_config()
+    except Exception as e:
+        # WeasyPrint or its system libraries (Pango) are not installed. Importing
+        # it again after a failed import can raise other errors than ImportError.
+        log.warning("WeasyPrint not available", extra={"error": str(e)})
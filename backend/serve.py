@@ -0,0 +1,302 @@
+"""
+Production launcher: a prefork master in front of several uvicorn workers.
+
+A single uvicorn process runs every conversion under one GIL. serve.py
+imports the app and the heavy document libraries once, in a master process,
+and then forks the workers from it, so the preloaded modules are shared
+copy-on-write instead of being loaded (and held in memory) once per worker.
+uvicorn's own --workers cannot do this: it spawns fresh interpreters.
+
+The master only supervises. It replaces workers that exit, which they do
+after WORKER_MAX_REQUESTS requests (plus jitter) to contain slow leaks in
+native PDF libraries, and retires workers whose private memory passes
+WORKER_MAX_RSS_MB. Retiring and shutdown are graceful: a worker stops
+accepting connections, finishes its in-flight requests and lets its running
+jobs finish or requeues them (see jobs.JobScheduler.stop).
+
+Run from the backend directory:
+    python serve.py --port 8000
+"""
+import argparse
+import gc
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from logs import configure_logging, get_logger
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("PORT", "8000"))
+# 0 sizes the pool from the CPU count and the memory limit
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+# Memory budgeted per worker when sizing the pool
+WORKER_MEMORY_MB = float(os.getenv("WORKER_MEMORY_MB", "512"))
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "1000"))
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "100"))
+# Retire a worker once its private (not shared with the master) memory passes this; 0 disables
+WORKER_MAX_RSS_MB = float(os.getenv("WORKER_MAX_RSS_MB", "1024"))
+WORKER_MEMORY_CHECK_SECONDS = float(os.getenv("WORKER_MEMORY_CHECK_SECONDS", "10"))
+# How long a stopping worker may take to finish its in-flight requests
+GRACEFUL_TIMEOUT_SECONDS = float(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "60"))
+# Loaded in the master before forking (names from warmup.BACKENDS, plus "renderers")
+PRELOAD_BACKENDS = os.getenv("PRELOAD_BACKENDS", "pymupdf,office,reportlab,images,pdfplumber,renderers")
+
+log = get_logger("serve")
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity mask, capped by a cgroup CPU quota."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def memory_limit_mb() -> float:
+    """The container's memory limit (cgroup v2 or v1), or the machine's memory."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number
+        if value != "max" and int(value) < 1 << 60:
+            return int(value) / (1024 * 1024)
+        break
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+
+
+def default_worker_count() -> int:
+    return max(1, min(available_cpus(), int(memory_limit_mb() // WORKER_MEMORY_MB)))
+
+
+def private_memory_mb(pid: int) -> float:
+    """
+    Memory held by pid alone (Linux): its RSS without the pages it still
+    shares with the master. Falls back to the full RSS on older kernels.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean:", "Private_Dirty:")))
+        return kb / 1024
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def preload():
+    """Import the app and the heavy libraries in the master, before any worker exists."""
+    import main
+    import metrics
+    from database import engine, init_db
+    from jobs import requeue_jobs
+    from warmup import warm_up
+
+    # Startup work that must happen once for all workers
+    metrics.clear_snapshots()
+    init_db()
+    requeued = requeue_jobs()
+    if requeued:
+        log.info("Requeued jobs interrupted by the previous run", extra={"jobs": requeued})
+    main.app.state.prefork = True
+
+    # The process pool is started by each worker (it must not be inherited)
+    warm_up([name.strip() for name in PRELOAD_BACKENDS.split(",") if name.strip() not in ("", "process-pool")])
+    # Database connections must not be shared across fork
+    engine.dispose()
+    # Keep the garbage collector from writing to (and so copying) the preloaded objects
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket):
+    """Serve requests in a forked worker until it is told to stop or hits its request limit."""
+    import uvicorn
+
+    # Drop the master's handlers; uvicorn installs its own graceful ones
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()
+    config = uvicorn.Config(
+        app,
+        limit_max_requests=WORKER_MAX_REQUESTS or None,
+        limit_max_requests_jitter=WORKER_MAX_REQUESTS_JITTER,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+        proxy_headers=True,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+    # The worker leaves through os._exit, which skips atexit handlers
+    import metrics
+
+    metrics.flush()
+
+
+class Master:
+    """Forks, watches and replaces the workers."""
+
+    def __init__(self, app, sock: socket.socket, size: int):
+        from jobs import JOB_SHUTDOWN_GRACE_SECONDS
+
+        self.app = app
+        self.sock = sock
+        self.size = size
+        self.workers = {}    # pid -> start time
+        self.retiring = {}   # pid -> deadline for its graceful exit
+        self.stopping = False
+        self.exit_timeout = GRACEFUL_TIMEOUT_SECONDS + JOB_SHUTDOWN_GRACE_SECONDS + 10
+
+    def spawn(self):
+        # Unflushed output would otherwise be printed by the child too
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        log.info("Started worker", extra={"pid": pid})
+
+    def retire(self, pid: int, reason: str):
+        """Stop a worker gracefully; its replacement starts right away."""
+        log.info("Retiring worker", extra={"pid": pid, "reason": reason})
+        self.workers.pop(pid, None)
+        self.retiring[pid] = time.monotonic() + self.exit_timeout
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        """Collect exited workers. Returns how many exited right after starting (likely a broken setup)."""
+        failed_at_start = 0
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return failed_at_start
+            if pid == 0:
+                return failed_at_start
+            started = self.workers.pop(pid, None)
+            self.retiring.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            if code not in (0, -signal.SIGTERM, -signal.SIGINT):
+                log.warning("Worker exited", extra={"pid": pid, "exit_code": code})
+                if started is not None and time.monotonic() - started < 5:
+                    failed_at_start += 1
+
+    def check_memory(self):
+        for pid in list(self.workers):
+            used = private_memory_mb(pid)
+            if used > WORKER_MAX_RSS_MB:
+                self.retire(pid, f"{used:.0f} MB private memory")
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                log.warning("Worker did not stop in time, killing it", extra={"pid": pid})
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = float("inf")
+
+    def handle_stop(self, sig, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        next_memory_check = time.monotonic() + WORKER_MEMORY_CHECK_SECONDS
+
+        while not self.stopping:
+            if self.reap():
+                # Do not fork in a tight loop when workers cannot start
+                time.sleep(1)
+            while len(self.workers) < self.size and not self.stopping:
+                self.spawn()
+            if WORKER_MAX_RSS_MB and time.monotonic() >= next_memory_check:
+                self.check_memory()
+                next_memory_check = time.monotonic() + WORKER_MEMORY_CHECK_SECONDS
+            self.kill_overdue()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop every worker gracefully, killing those that outlive the timeout."""
+        log.info("Shutting down workers")
+        for pid in list(self.workers):
+            self.retire(pid, "server shutdown")
+        while self.retiring:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="0 sizes the pool automatically")
+    args = parser.parse_args()
+    configure_logging()
+
+    workers = args.workers or default_worker_count()
+    # Split the CPUs between the workers' conversion process pools, but give
+    # each at least 2 processes: with 1, executor.parallel_map runs inline and
+    # the fan-out of compression, rasterizing and PDF to Word is lost. When
+    # several workers fan out at once the pools oversubscribe the CPUs a
+    # little, which costs less than never fanning out. Must be set before the
+    # app (and executor.py) is imported.
+    os.environ.setdefault("PROCESS_POOL_SIZE", str(max(2, available_cpus() // workers)))
+    # The workspace budgets are counted in each worker's own process, so
+    # give each worker its share of the server-wide total. Also before import.
+    for name, default in (("WORKSPACE_DISK_BUDGET_MB", "4096"), ("WORKSPACE_RAM_BUDGET_MB", "256")):
+        os.environ[name] = str(float(os.getenv(name, default)) / workers)
+
+    started = time.perf_counter()
+    app = preload()
+    log.info("Preloaded, starting workers", extra={"seconds": round(time.perf_counter() - started, 1),
+                                                   "workers": workers})
+    sock = bind_socket(args.host, args.port)
+    Master(app, sock, workers).run()
+
+
+if __name__ == "__main__":
+    main()
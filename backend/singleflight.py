@@ -0,0 +1,124 @@
+"""
+Coalescing of identical conversions that run at the same time.
+
+A shared template can bring dozens of uploads of the same file, with the
+same operation and options, within a second. The result cache only helps
+once the first of them has finished. Until then, requests with the same
+cache key (input SHA-256, operation, parameters) join the conversion that is
+already in flight and each gets a copy of its output.
+
+The shared conversion runs in a task and a workspace of its own, on a link
+to the first request's input, so it does not depend on any single request;
+that request stays until the link is made. When the workspace budget leaves
+no room for such a workspace, the request converts alone, without a flight.
+A request that is cancelled leaves the flight. The conversion itself is
+only cancelled when every request waiting for it is gone.
+"""
+import asyncio
+import os
+
+from cache import link_or_copy
+from executor import run_in_thread
+from logs import get_logger
+from workspace import workspace_manager, WorkspaceBudgetExceeded
+
+log = get_logger("singleflight")
+
+
+class Flight:
+    """A conversion in progress and the output paths of the requests waiting for it."""
+
+    def __init__(self):
+        self.task = None
+        self.outputs = {}  # request token -> output path
+        # Done once the flight has its own link to the input
+        self.linked = asyncio.get_running_loop().create_future()
+
+
+class SingleFlight:
+    """Runs one computation per key for all concurrent callers."""
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    async def run(self, key: str, compute, input_path: str, output_path: str):
+        """
+        Run compute(input_path, output_path), an async function writing its
+        result to output_path, or join the run already in flight for key.
+
+        Every caller gets the result at its own output_path, or the error.
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            try:
+                workspace = workspace_manager.acquire()
+            except WorkspaceBudgetExceeded:
+                # Short on disk: a flight on this request's own files would
+                # fail its followers if this request left, so convert alone
+                await compute(input_path, output_path)
+                return
+            flight = self._flights[key] = Flight()
+            flight.task = asyncio.ensure_future(self._fly(key, flight, workspace, compute, input_path, output_path))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        token = object()
+        flight.outputs[token] = output_path
+        try:
+            await asyncio.shield(flight.task)
+        finally:
+            flight.outputs.pop(token, None)
+            if leader:
+                # The input lives in this request's workspace: keep it until the flight has its link
+                await asyncio.wait([flight.linked, flight.task], return_when=asyncio.FIRST_COMPLETED)
+            if not flight.outputs and not flight.task.done():
+                # Nobody is waiting any more
+                flight.task.cancel()
+                self.abandoned += 1
+
+    async def _fly(self, key: str, flight: Flight, workspace, compute, input_path: str, output_path: str):
+        try:
+            shared_input = workspace.file(os.path.basename(input_path))
+            shared_output = workspace.file(os.path.basename(output_path))
+            try:
+                await run_in_thread("cache", link_or_copy, input_path, shared_input)
+            finally:
+                flight.linked.set_result(None)
+            await compute(shared_input, shared_output)
+
+            # Requests arriving from now on start a new flight (and normally hit the cache)
+            self._flights.pop(key, None)
+            outputs = list(flight.outputs.values())
+            if os.path.exists(shared_output):
+                await run_in_thread("cache", self._distribute, shared_output, outputs)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            workspace.cleanup()
+
+    @staticmethod
+    def _distribute(result_path: str, outputs: list):
+        for output_path in outputs:
+            try:
+                link_or_copy(result_path, output_path)
+            except OSError as e:
+                # The request's workspace is gone, so is the request
+                log.warning("Could not hand a coalesced result over", extra={"output_path": output_path, "error": str(e)})
+
+    def stats(self) -> dict:
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self._flights),
+            "conversions": self.leaders,
+            "coalesced_requests": self.followers,
+            "coalesced_ratio": round(self.followers / requests, 3) if requests else 0.0,
+            "abandoned": self.abandoned,
+        }
+
+
+conversion_flights = SingleFlight()
@@ -0,0 +1,278 @@
+"""
+XLSX to PDF rendering that streams rows instead of loading the workbook.
+
+The workbook is read with openpyxl in read-only mode, one row at a time, and
+every worksheet is rendered as a ruled table. Column widths come from the
+text of the first XLSX_SAMPLE_ROWS rows. Columns that do not fit across one
+page are split into bands, and each page-height block of rows is drawn once
+per band (across, then down) before the next block is read. Only one block
+of rows is held at a time.
+
+A reportlab canvas keeps every finished page until it is saved, so the
+output is written in parts of XLSX_PAGES_PER_PART pages, each saved as soon
+as it is full, and the parts are joined with PyMuPDF at the end. Memory then
+depends on the part size, not on the size of the sheet.
+"""
+import datetime
+import os
+from itertools import islice
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+
+from renderer_resources import unicode_font, FALLBACK_FONT_NAME
+
+XLSX_SAMPLE_ROWS = int(os.getenv("XLSX_SAMPLE_ROWS", "200"))
+# Pages per part file; every part embeds its own subset of the font
+XLSX_PAGES_PER_PART = int(os.getenv("XLSX_PAGES_PER_PART", "200"))
+
+FONT_SIZE = 8
+TITLE_FONT_SIZE = 10
+ROW_HEIGHT = 12
+CELL_PADDING = 3
+MARGIN = 36
+# Column widths in points, whatever the sampled text says
+MIN_COLUMN_WIDTH = 24
+MAX_COLUMN_WIDTH = 180
+
+
+def format_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        return f"{value:.10g}"
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ") if value.time() != datetime.time() else value.date().isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value).replace("\n", " ")
+
+
+def _sanitize(text: str, font: str) -> str:
+    """Keep text within WinAnsi when the standard font is all there is."""
+    if font != FALLBACK_FONT_NAME:
+        return text
+    for old, new in {"−": "-", "–": "-", "—": "-"}.items():
+        text = text.replace(old, new)
+    return text.encode("cp1252", "replace").decode("cp1252")
+
+
+def _fit(text: str, width: float, font: str) -> str:
+    """Cut text to fit width, ending in an ellipsis when it was cut."""
+    if pdfmetrics.stringWidth(text, font, FONT_SIZE) <= width:
+        return text
+    ellipsis = "…"
+    # Cheap first guess from the average glyph width, then trim exactly
+    text = text[:max(1, int(width / (FONT_SIZE * 0.4)))]
+    while text and pdfmetrics.stringWidth(text + ellipsis, font, FONT_SIZE) > width:
+        text = text[:-1]
+    return text + ellipsis if text else ""
+
+
+def _column_width(text: str, font: str) -> float:
+    width = pdfmetrics.stringWidth(text, font, FONT_SIZE) + 2 * CELL_PADDING
+    return min(max(width, MIN_COLUMN_WIDTH), MAX_COLUMN_WIDTH)
+
+
+def column_bands(widths: list, usable_width: float) -> list:
+    """Group columns into (first, end) ranges that each fit across a page."""
+    bands = []
+    first = 0
+    total = 0.0
+    for index, width in enumerate(widths):
+        if index > first and total + width > usable_width:
+            bands.append((first, index))
+            first, total = index, 0.0
+        total += width
+    if first < len(widths):
+        bands.append((first, len(widths)))
+    return bands
+
+
+class PartWriter:
+    """
+    The output, as a series of canvases that are each saved to a part file
+    once they hold pages_per_part pages. join() writes the output file.
+    """
+
+    def __init__(self, output_path: str, pages_per_part: int = XLSX_PAGES_PER_PART):
+        self.output_path = output_path
+        self.pages_per_part = max(1, pages_per_part)
+        self.paths = []
+        self.canvas = None
+        self.pages_in_part = 0
+        self.pages = 0
+
+    def current(self) -> canvas.Canvas:
+        """The canvas to draw the next page on."""
+        if self.canvas is None:
+            path = f"{self.output_path}.part{len(self.paths)}.pdf"
+            self.paths.append(path)
+            self.canvas = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+        return self.canvas
+
+    def show_page(self):
+        self.canvas.showPage()
+        self.pages += 1
+        self.pages_in_part += 1
+        if self.pages_in_part >= self.pages_per_part:
+            self._save_part()
+
+    def _save_part(self):
+        self.canvas.save()
+        self.canvas = None
+        self.pages_in_part = 0
+
+    def join(self):
+        if self.canvas is not None:
+            self._save_part()
+        if len(self.paths) == 1:
+            os.replace(self.paths.pop(), self.output_path)
+            return
+        import fitz  # PyMuPDF
+
+        with fitz.open() as output:
+            for path in self.paths:
+                with fitz.open(path) as part:
+                    output.insert_pdf(part)
+            output.save(self.output_path, deflate=True)
+
+    def cleanup(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SheetRenderer:
+    """Lays out one worksheet's rows as table pages in the parts of the output."""
+
+    def __init__(self, parts: PartWriter, title: str, font: str):
+        self.parts = parts
+        self.title = title
+        self.font = font
+        self.widths = []
+        self.page_size = A4
+        self.pages = 0
+
+    def _cells(self, row) -> list:
+        # (text, right-aligned) per cell
+        cells = [
+            (_sanitize(format_cell(value), self.font), isinstance(value, (int, float)) and not isinstance(value, bool))
+            for value in row
+        ]
+        while cells and not cells[-1][0]:
+            cells.pop()
+        return cells
+
+    def _widen(self, cells: list):
+        for index, (text, _) in enumerate(cells):
+            width = _column_width(text, self.font) if text else MIN_COLUMN_WIDTH
+            if index == len(self.widths):
+                self.widths.append(width)
+            elif width > self.widths[index]:
+                self.widths[index] = width
+
+    def render(self, rows):
+        """Render an iterator of row value tuples."""
+        sample = [self._cells(row) for row in islice(rows, XLSX_SAMPLE_ROWS)]
+        for cells in sample:
+            self._widen(cells)
+        # Wide sheets are printed landscape so fewer bands are needed
+        portrait_width = A4[0] - 2 * MARGIN
+        self.page_size = landscape(A4) if sum(self.widths) > portrait_width else A4
+        per_page = int((self.page_size[1] - 2 * MARGIN - 2 * TITLE_FONT_SIZE) // ROW_HEIGHT)
+
+        block = []
+        first_row = 1
+        empty_run = []
+        for cells in self._stream(sample, rows):
+            # Trailing empty rows are dropped, empty rows between data are kept
+            if not cells:
+                empty_run.append(cells)
+                continue
+            if empty_run:
+                block.extend(empty_run)
+                empty_run = []
+            # Columns first seen below the sample get a width of their own
+            if len(cells) > len(self.widths):
+                self._widen(cells)
+            block.append(cells)
+            while len(block) >= per_page:
+                self._draw_block(block[:per_page], first_row)
+                first_row += per_page
+                block = block[per_page:]
+        if block:
+            self._draw_block(block, first_row)
+        return self.pages
+
+    def _stream(self, sample: list, rows):
+        yield from sample
+        for row in rows:
+            yield self._cells(row)
+
+    def _draw_block(self, block: list, first_row: int):
+        width, height = self.page_size
+        bands = column_bands(self.widths, width - 2 * MARGIN)
+        last_row = first_row + len(block) - 1
+        for first, end in bands:
+            if not any(text for cells in block for text, _ in cells[first:end]):
+                continue
+            pdf = self.parts.current()
+            pdf.setPageSize(self.page_size)
+            top = height - MARGIN
+            pdf.setFont(self.font, TITLE_FONT_SIZE)
+            pdf.drawString(MARGIN, top - TITLE_FONT_SIZE, (
+                f"{self.title}: rows {first_row}-{last_row}, "
+                f"columns {get_column_letter(first + 1)}-{get_column_letter(end)}"
+            ))
+            top -= 2 * TITLE_FONT_SIZE
+
+            xs = [MARGIN]
+            for column_width in self.widths[first:end]:
+                xs.append(xs[-1] + column_width)
+            ys = [top - i * ROW_HEIGHT for i in range(len(block) + 1)]
+            pdf.setLineWidth(0.25)
+            pdf.grid(xs, ys)
+
+            pdf.setFont(self.font, FONT_SIZE)
+            for i, cells in enumerate(block):
+                baseline = ys[i] - ROW_HEIGHT + (ROW_HEIGHT - FONT_SIZE) / 2 + 1
+                for column, (text, numeric) in enumerate(cells[first:end], start=first):
+                    if not text:
+                        continue
+                    x0 = xs[column - first]
+                    text = _fit(text, self.widths[column] - 2 * CELL_PADDING, self.font)
+                    if numeric:
+                        pdf.drawRightString(x0 + self.widths[column] - CELL_PADDING, baseline, text)
+                    else:
+                        pdf.drawString(x0 + CELL_PADDING, baseline, text)
+            self.parts.show_page()
+            self.pages += 1
+
+
+def render_workbook(input_path: str, output_path: str) -> int:
+    """Render every worksheet of an XLSX file to a PDF. Returns the page count."""
+    font = unicode_font()
+    wb = openpyxl.load_workbook(input_path, read_only=True, data_only=True)
+    parts = PartWriter(output_path)
+    try:
+        pages = 0
+        for sheet in wb.worksheets:
+            pages += SheetRenderer(parts, sheet.title, font).render(sheet.iter_rows(values_only=True))
+        if not pages:
+            # A PDF needs at least one page
+            pdf = parts.current()
+            pdf.setFont(font, TITLE_FONT_SIZE)
+            pdf.drawString(MARGIN, A4[1] - MARGIN - TITLE_FONT_SIZE, "Empty workbook")
+            parts.show_page()
+            pages = 1
+        parts.join()
+        return pages
+    finally:
+        parts.cleanup()
+        wb.close()
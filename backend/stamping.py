@@ -0,0 +1,317 @@
+"""
+Stamp the same content onto many PDF pages without repeating it.
+
+A stamp (text, an image or a page of another PDF) is laid out once as a
+one-page PDF and copied into the target document a single time, as a Form
+XObject. Each stamped page then only gets a name for it in its resources
+and a tiny content stream that draws it ("q <matrix> cm /Name Do Q"). The
+placement is worked out once per page geometry, and pages that share a
+geometry share the content stream too, so a 1,000 page document carries one
+copy of a watermark instead of 1,000 laid out text blocks.
+
+Page numbers work the same way with one XObject per digit: each page only
+adds a content stream that places the digits of its own number.
+"""
+import math
+
+import fitz  # PyMuPDF
+
+# Where a stamp goes on the page, as fractions of the free space (x, y)
+POSITIONS = {
+    "center": (0.5, 0.5),
+    "top-left": (0.0, 0.0),
+    "top-center": (0.5, 0.0),
+    "top-right": (1.0, 0.0),
+    "bottom-left": (0.0, 1.0),
+    "bottom-center": (0.5, 1.0),
+    "bottom-right": (1.0, 1.0),
+}
+
+# Resource names used for stamps, unlikely to clash with existing ones
+FORM_PREFIX = "IPStamp"
+OPACITY_STATE = "IPStampAlpha"
+
+
+def _text_page(doc: fitz.Document, text: str, fontsize: float, color: tuple, fontname: str = "helv"):
+    """Add a page that fits text exactly, with its baseline at the font ascender."""
+    font = fitz.Font(fontname)
+    width = max(font.text_length(text, fontsize=fontsize), 1)
+    height = (font.ascender - font.descender) * fontsize
+    page = doc.new_page(width=width, height=height)
+    page.insert_text((0, font.ascender * fontsize), text, fontname=fontname, fontsize=fontsize, color=color)
+    return page
+
+
+def _set_resources(doc: fitz.Document, page_xref: int, category: str, entries: dict) -> bool:
+    """
+    Add {name: value} entries to /category of a page's resources, wherever the dictionary lives.
+
+    Returns False when the page inherits its resources, so they cannot be
+    extended without copying.
+    """
+    kind, resources = doc.xref_get_key(page_xref, "Resources")
+    if kind == "xref":
+        target, prefix = int(resources.split()[0]), ""
+    elif kind == "dict":
+        target, prefix = page_xref, "Resources/"
+    else:
+        return False
+
+    kind, sub = doc.xref_get_key(target, prefix + category)
+    if kind == "null":
+        # No such dictionary yet: write it in one go
+        doc.xref_set_key(target, prefix + category, "<<" + "".join(f"/{n} {v}" for n, v in entries.items()) + ">>")
+    elif kind == "xref":
+        for name, value in entries.items():
+            doc.xref_set_key(int(sub.split()[0]), name, value)
+    else:
+        for name, value in entries.items():
+            doc.xref_set_key(target, f"{prefix}{category}/{name}", value)
+    return True
+
+
+def _set_opacity(doc: fitz.Document, opacity: float):
+    """Draw the first page of doc at the given constant opacity."""
+    if opacity >= 1:
+        return
+    page = doc[0]
+    contents = page.get_contents()
+    data = b"\n".join(doc.xref_stream(xref) for xref in contents)
+    doc.update_stream(contents[0], b"q /%s gs\n" % OPACITY_STATE.encode() + data + b"\nQ")
+    if len(contents) > 1:
+        doc.xref_set_key(page.xref, "Contents", f"{contents[0]} 0 R")
+    alpha = round(max(opacity, 0), 3)
+    _set_resources(doc, page.xref, "ExtGState", {OPACITY_STATE: f"<</Type/ExtGState/CA {alpha}/ca {alpha}>>"})
+
+
+def _placement_matrix(source_rect: fitz.Rect, target_rect: fitz.Rect, rotate: float) -> fitz.Matrix:
+    """Map a source page onto target_rect (PDF coordinates), rotated and keeping proportions."""
+    source_center = (source_rect.tl + source_rect.br) / 2
+    target_center = (target_rect.tl + target_rect.br) / 2
+    matrix = fitz.Matrix(1, 0, 0, 1, -source_center.x, -source_center.y) * fitz.Matrix(rotate)
+    moved = source_rect * matrix
+    factor = min(target_rect.width / moved.width, target_rect.height / moved.height)
+    matrix *= fitz.Matrix(factor, factor)
+    matrix *= fitz.Matrix(1, 0, 0, 1, target_center.x, target_center.y)
+    return matrix
+
+
+class Stamp:
+    """Content to stamp, kept as a one-page PDF."""
+
+    def __init__(self, source: fitz.Document):
+        self.source = source
+        self.width = source[0].rect.width
+        self.height = source[0].rect.height
+
+    @classmethod
+    def text(cls, text: str, fontsize: float = 60, color: tuple = (0.8, 0.8, 0.8), opacity: float = 1.0):
+        source = fitz.open()
+        _text_page(source, text, fontsize, color)
+        _set_opacity(source, opacity)
+        return cls(source)
+
+    @classmethod
+    def image(cls, path: str, opacity: float = 1.0):
+        """An image at one point per pixel."""
+        pixmap = fitz.Pixmap(path)
+        source = fitz.open()
+        page = source.new_page(width=pixmap.width, height=pixmap.height)
+        page.insert_image(page.rect, filename=path)
+        _set_opacity(source, opacity)
+        return cls(source)
+
+    @classmethod
+    def pdf(cls, path: str, page_number: int = 0, opacity: float = 1.0):
+        """A page of another PDF, e.g. a letterhead or a "DRAFT" design."""
+        with fitz.open(path) as other:
+            source = fitz.open()
+            source.insert_pdf(other, from_page=page_number, to_page=page_number)
+        _set_opacity(source, opacity)
+        return cls(source)
+
+    @classmethod
+    def from_file(cls, path: str, opacity: float = 1.0):
+        if path.lower().endswith(".pdf"):
+            return cls.pdf(path, opacity=opacity)
+        return cls.image(path, opacity=opacity)
+
+
+class StampWriter:
+    """
+    Adds shared Form XObjects to a document and draws them on its pages.
+
+    Each source page is copied into the document once. Content streams are
+    cached by their bytes, so pages that draw the same thing share one.
+    """
+
+    def __init__(self, doc: fitz.Document):
+        self.doc = doc
+        self._forms = {}
+        self._xrefs = {}
+        self._streams = {}
+        self._prefix = None
+
+    def form(self, key, source: fitz.Document, page_number: int = 0) -> str:
+        """Copy a source page into the document as a Form XObject, once per key."""
+        if key not in self._forms:
+            scratch = self.doc.new_page()
+            try:
+                xref = scratch.show_pdf_page(scratch.rect, source, page_number)
+            finally:
+                self.doc.delete_page(-1)
+            name = f"{FORM_PREFIX}{len(self._forms)}"
+            self._forms[key] = name
+            self._xrefs[name] = xref
+        return self._forms[key]
+
+    def _stream(self, data: bytes) -> int:
+        if data not in self._streams:
+            xref = self.doc.get_new_xref()
+            self.doc.update_object(xref, "<<>>")
+            self.doc.update_stream(xref, data)
+            self._streams[data] = xref
+        return self._streams[data]
+
+    def draw(self, page: fitz.Page, names: list, ops: str, overlay: bool = True) -> bool:
+        """
+        Run content stream operators ops, which use the forms in names, on a page.
+
+        Returns False if the page's resources could not be extended.
+        """
+        page_xref = page.xref
+        entries = {name: f"{self._xrefs[name]} 0 R" for name in names}
+        if not _set_resources(self.doc, page_xref, "XObject", entries):
+            return False
+
+        contents = page.get_contents()
+        if overlay:
+            # Isolate the page's own graphics state from the stamp
+            if self._prefix is None:
+                self._prefix = self._stream(b"q\n")
+            xrefs = [self._prefix] + contents + [self._stream(("Q\n" + ops).encode())]
+        else:
+            xrefs = [self._stream(ops.encode())] + contents
+        self.doc.xref_set_key(page_xref, "Contents", "[" + " ".join(f"{xref} 0 R" for xref in xrefs) + "]")
+        return True
+
+
+def _cm(matrix: fitz.Matrix) -> str:
+    return f"{matrix.a:g} {matrix.b:g} {matrix.c:g} {matrix.d:g} {matrix.e:.3f} {matrix.f:.3f} cm"
+
+
+def _page_geometry(page: fitz.Page) -> tuple:
+    return tuple(page.mediabox), tuple(page.cropbox), page.rotation
+
+
+def _visible_to_pdf(page: fitz.Page) -> fitz.Matrix:
+    """
+    Matrix from what the viewer sees (page.rect, y down) to PDF coordinates.
+
+    Undo /Rotate, which gives coordinates from the CropBox's top-left corner,
+    move to where the CropBox sits on the MediaBox and flip y. (Not built from
+    page.transformation_matrix: it drops the CropBox origin on rotated pages.)
+    """
+    cropbox = page.cropbox
+    return (page.derotation_matrix * fitz.Matrix(1, 0, 0, 1, cropbox.x0, cropbox.y0)
+            * fitz.Matrix(1, 0, 0, -1, 0, page.mediabox.y1))
+
+
+def stamp_pages(doc: fitz.Document, stamp: Stamp, page_numbers=None, position: str = "center",
+                rotate: float = 0, scale: float = 1.0, margin: float = 30, overlay: bool = True) -> int:
+    """
+    Stamp the given pages (0-based, default all) and return how many were stamped.
+
+    The stamp keeps its natural size times scale, rotated by rotate degrees,
+    and is shrunk to fit inside the page margins when needed.
+    """
+    fx, fy = POSITIONS.get(position, POSITIONS["center"])
+    writer = StampWriter(doc)
+    name = writer.form("stamp", stamp.source)
+    source_rect = stamp.source[0].rect
+
+    # Size of the rotated stamp's bounding box
+    angle = math.radians(rotate)
+    width = stamp.width * scale
+    height = stamp.height * scale
+    box_width = abs(width * math.cos(angle)) + abs(height * math.sin(angle))
+    box_height = abs(width * math.sin(angle)) + abs(height * math.cos(angle))
+
+    matrices = {}
+    stamped = 0
+    for page_number in (range(len(doc)) if page_numbers is None else page_numbers):
+        page = doc[page_number]
+        geometry = _page_geometry(page)
+        if geometry not in matrices:
+            area = page.rect
+            free_width = max(area.width - 2 * margin, 1)
+            free_height = max(area.height - 2 * margin, 1)
+            factor = min(1, free_width / box_width, free_height / box_height)
+            x0 = area.x0 + margin + fx * (free_width - box_width * factor)
+            y0 = area.y0 + margin + fy * (free_height - box_height * factor)
+            target = fitz.Rect(x0, y0, x0 + box_width * factor, y0 + box_height * factor)
+            # Turn with the page's /Rotate so the stamp appears upright to the viewer
+            target = target * _visible_to_pdf(page)
+            matrix = _placement_matrix(source_rect, target, rotate + page.rotation)
+            # show_pdf_page places its rect with page.transformation_matrix, so
+            # that is what the fallback's rect has to be given in
+            matrices[geometry] = (f"q {_cm(matrix)} /{name} Do Q\n", target * page.transformation_matrix)
+        ops, fallback_target = matrices[geometry]
+
+        if not writer.draw(page, [name], ops, overlay):
+            page.show_pdf_page(fallback_target, stamp.source, 0, rotate=rotate + page.rotation, overlay=overlay)
+        stamped += 1
+    return stamped
+
+
+def number_pages(doc: fitz.Document, page_numbers, position: str = "bottom-center", fontsize: float = 12,
+                 color: tuple = (0, 0, 0), margin: float = 30, box_width: float = 100) -> int:
+    """
+    Write each page's 1-based number on it, centered in a box_width wide box.
+
+    The digits 0-9 are laid out once; each page only places the digits of
+    its own number. Returns how many pages were numbered.
+    """
+    fx, fy = POSITIONS.get(position, POSITIONS["bottom-center"])
+    digits = fitz.open()
+    for digit in "0123456789":
+        _text_page(digits, digit, fontsize, color)
+    writer = StampWriter(doc)
+    names = [writer.form(("digit", i), digits, i) for i in range(10)]
+    advances = [digits[i].rect.width for i in range(10)]
+    digit_height = digits[0].rect.height
+
+    boxes = {}
+    numbered = 0
+    for page_number in page_numbers:
+        page = doc[page_number]
+        geometry = _page_geometry(page)
+        if geometry not in boxes:
+            area = page.rect
+            x0 = area.x0 + margin + fx * (area.width - 2 * margin - box_width)
+            # Keep the original layout: bottom boxes start margin above the edge
+            y0 = area.y0 + (area.height - margin if fy == 1 else margin if fy == 0 else (area.height - digit_height) / 2)
+            to_pdf = _visible_to_pdf(page)
+            # Digit space (y up) to the page: flip, then go to PDF coordinates
+            linear = fitz.Matrix(1, 0, 0, -1, 0, 0) * fitz.Matrix(to_pdf.a, to_pdf.b, to_pdf.c, to_pdf.d, 0, 0)
+            boxes[geometry] = (x0, y0, to_pdf, linear)
+        x0, y0, to_pdf, linear = boxes[geometry]
+
+        # Place the first digit, then step along the baseline for the others
+        label = str(page_number + 1)
+        x = x0 + (box_width - sum(advances[int(d)] for d in label)) / 2
+        origin = fitz.Point(x, y0 + digit_height) * to_pdf
+        matrix = fitz.Matrix(linear.a, linear.b, linear.c, linear.d, origin.x, origin.y)
+        ops = [f"q {_cm(matrix)}"]
+        for i, d in enumerate(label):
+            if i:
+                ops.append(f"1 0 0 1 {advances[int(label[i - 1])]:g} 0 cm")
+            ops.append(f"/{names[int(d)]} Do")
+        ops.append("Q\n")
+
+        if not writer.draw(page, [names[int(d)] for d in set(label)], " ".join(ops)):
+            # insert_text takes unrotated coordinates
+            point = fitz.Point(x, y0 + digit_height + fitz.Font("helv").descender * fontsize) * page.derotation_matrix
+            page.insert_text(point, label, fontsize=fontsize, color=color, rotate=page.rotation)
+        numbered += 1
+    return numbered
@@ -0,0 +1,144 @@
+"""
+Supervised runs of external tools (soffice, qpdf, Ghostscript).
+
+Every run gets its own process group, a wall-clock timeout and, on Linux,
+RLIMIT_AS and RLIMIT_CPU caps, so a pathological document cannot pin a
+process forever. Runs started from the thread pool are also tied to the
+request that started them: when the request is cancelled (the client went
+away, or nobody waits for a coalesced conversion any more) the whole
+process group is killed. Outcomes are counted per tool for /stats/subprocesses.
+"""
+import errno
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+from executor import cancellation_event, parse_limits
+from logs import get_logger
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Address space cap for any tool, and per-tool overrides ("soffice=4096,gs=1024")
+SUBPROCESS_MEMORY_LIMIT_MB = int(os.getenv("SUBPROCESS_MEMORY_LIMIT_MB", "2048"))
+SUBPROCESS_MEMORY_LIMITS_MB = parse_limits(os.getenv("SUBPROCESS_MEMORY_LIMITS_MB", "soffice=4096"))
+# CPU time cap (seconds of CPU, not wall clock) and per-tool overrides
+SUBPROCESS_CPU_LIMIT_SECONDS = int(os.getenv("SUBPROCESS_CPU_LIMIT_SECONDS", "300"))
+SUBPROCESS_CPU_LIMITS_SECONDS = parse_limits(os.getenv("SUBPROCESS_CPU_LIMITS_SECONDS", ""))
+POLL_SECONDS = 0.1
+
+log = get_logger("subprocess_runner")
+
+
+class ToolTimeout(RuntimeError):
+    """The tool ran past its wall-clock timeout and was killed."""
+
+
+class ToolCancelled(RuntimeError):
+    """The request that started the tool went away, so the tool was killed."""
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _count(tool: str, outcome: str, seconds: float):
+    with _lock:
+        counters = _stats.setdefault(tool, {
+            "runs": 0, "succeeded": 0, "failed": 0, "timeouts": 0, "cancelled": 0, "limit_exceeded": 0, "seconds": 0.0,
+        })
+        counters["runs"] += 1
+        counters[outcome] += 1
+        counters["seconds"] = round(counters["seconds"] + seconds, 3)
+    metrics.SUBPROCESS_SECONDS.observe(seconds, tool=tool, outcome=outcome)
+
+
+def _limited(tool: str, command: list) -> list:
+    """
+    command behind a shell that caps its address space and CPU time, then
+    execs it (Linux only), so the caps hold from the tool's first instruction
+    and children it forks inherit them. No Python runs in the child: the
+    tools are started from thread pool threads, where preexec_fn may deadlock.
+    """
+    if resource is None:
+        return command
+    # Found here, so a missing tool still raises FileNotFoundError and is not the shell's exit code 127
+    executable = shutil.which(command[0])
+    if executable is None:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), command[0])
+    memory = SUBPROCESS_MEMORY_LIMITS_MB.get(tool, SUBPROCESS_MEMORY_LIMIT_MB) * 1024 * 1024
+    cpu = SUBPROCESS_CPU_LIMITS_SECONDS.get(tool, SUBPROCESS_CPU_LIMIT_SECONDS)
+    # SIGXCPU at the soft CPU limit, SIGKILL a few seconds later. An unprivileged
+    # process cannot raise its hard limits, so keep the stricter ones.
+    memory_hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if memory_hard != resource.RLIM_INFINITY:
+        memory = min(memory, memory_hard)
+    cpu_hard = cpu + 5
+    current_cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    if current_cpu_hard != resource.RLIM_INFINITY:
+        cpu, cpu_hard = min(cpu, current_cpu_hard), min(cpu_hard, current_cpu_hard)
+    script = f'ulimit -v {memory // 1024}; ulimit -S -t {cpu}; ulimit -H -t {cpu_hard}; exec "$@"'
+    return ["/bin/sh", "-c", script, tool, executable, *command[1:]]
+
+
+def _kill(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run_tool(tool: str, command: list, timeout: float, cwd: str = None) -> int:
+    """
+    Run command, named tool in the stats, to completion and return its exit code.
+
+    Raises ToolTimeout when it runs longer than timeout seconds, ToolCancelled
+    when the calling request is cancelled, and OSError when it cannot start.
+    """
+    cancelled = cancellation_event()
+    if cancelled is not None and cancelled.is_set():
+        raise ToolCancelled(f"{tool} was not started: the request was cancelled")
+
+    started = time.monotonic()
+    process = subprocess.Popen(_limited(tool, command), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               cwd=cwd, start_new_session=True)
+    deadline = started + timeout
+    try:
+        while True:
+            try:
+                returncode = process.wait(timeout=POLL_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if cancelled is not None and cancelled.is_set():
+                _kill(process)
+                _count(tool, "cancelled", time.monotonic() - started)
+                raise ToolCancelled(f"{tool} was killed: the request was cancelled")
+            if time.monotonic() > deadline:
+                _kill(process)
+                _count(tool, "timeouts", time.monotonic() - started)
+                raise ToolTimeout(f"{tool} timed out after {timeout:g}s")
+    except BaseException:
+        if process.poll() is None:
+            _kill(process)
+        raise
+
+    if returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        # Killed by the kernel: CPU limit, or out of memory
+        outcome = "limit_exceeded"
+    else:
+        outcome = "succeeded" if returncode == 0 else "failed"
+    _count(tool, outcome, time.monotonic() - started)
+    return returncode
+
+
+def stats() -> dict:
+    with _lock:
+        return {tool: dict(counters) for tool, counters in _stats.items()}
@@ -0,0 +1,240 @@
+"""
+Streaming ingestion of uploaded files.
+
+The multipart request body is parsed as it arrives and file parts are written
+straight to their final location, so every upload touches the disk once. On
+the way the bytes are counted (oversize uploads are rejected with 413 as soon
+as they cross MAX_FILE_SIZE_MB) and hashed, and once a file is complete its
+real type is sniffed from its magic bytes instead of trusting the filename.
+"""
+import hashlib
+import os
+import re
+import zipfile
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_FILE_SIZE_MB = float(os.getenv("MAX_FILE_SIZE_MB", "50"))
+MAX_UPLOAD_BYTES = int(MAX_FILE_SIZE_MB * 1024 * 1024)
+MAX_FIELD_BYTES = 64 * 1024
+# Room for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD = 1024 * 1024
+SNIFF_BYTES = 8192
+
+# OpenAPI description of the multipart body, since handlers read the raw request
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+class IngestedFile:
+    """A file part that has been written to disk."""
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self.size = 0
+        self.sha256 = None
+        self.kind = None
+        self._hash = hashlib.sha256()
+        self._handle = open(path, "wb")
+
+    def write(self, data: bytes):
+        self._handle.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def close(self):
+        if not self._handle.closed:
+            self._handle.close()
+        self.sha256 = self._hash.hexdigest()
+
+
+class IngestedRequest:
+    """All files and plain form fields of one multipart request."""
+
+    def __init__(self):
+        self.files = []
+        self.fields = {}
+
+    @property
+    def file(self) -> IngestedFile:
+        return self.files[0]
+
+
+def safe_filename(filename: str) -> str:
+    """Strip any directory components a client put into the filename."""
+    name = os.path.basename(filename.replace("\\", "/")).strip()
+    return name or "upload"
+
+
+def sniff_kind(path: str) -> Optional[str]:
+    """Detect a file's type from its content: pdf, png, jpeg, docx, xlsx, pptx, ole, zip or html."""
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+
+    if b"%PDF-" in head[:1024]:
+        return "pdf"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        # Legacy Office (OLE2) container: .doc, .xls or .ppt
+        return "ole"
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+        except zipfile.BadZipFile:
+            return None
+        for prefix, kind in (("word/", "docx"), ("xl/", "xlsx"), ("ppt/", "pptx")):
+            if any(name.startswith(prefix) for name in names):
+                return kind
+        return "zip"
+    if b"\x00" not in head and re.search(rb"<[a-zA-Z!]", head):
+        return "html"
+    return None
+
+
+async def ingest_request(request: Request, directory: str, max_files: int = 1,
+                         extensions: Optional[tuple] = None, invalid_type_detail: str = "Invalid file type.",
+                         field_name: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedRequest:
+    """
+    Stream a multipart request body into directory.
+
+    Files sent under field_name are written to disk as they arrive, other
+    fields are collected as strings. Raises HTTPException with 413 for
+    oversize uploads and 400 for malformed bodies or disallowed extensions.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_bytes * max_files + MULTIPART_OVERHEAD:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_FILE_SIZE_MB:g} MB.")
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+
+    result = IngestedRequest()
+    state = {"headers": {}, "header_field": b"", "header_value": b"", "file": None, "field": None, "value": b""}
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+
+        if filename is None:
+            state["field"], state["value"] = name, b""
+            return
+        if name != field_name:
+            raise HTTPException(status_code=400, detail=f"Unexpected file field: {name}")
+        if len(result.files) >= max_files:
+            raise HTTPException(status_code=400, detail=f"Too many files. At most {max_files} allowed.")
+
+        filename = safe_filename(filename.decode("utf-8", "replace"))
+        if extensions and not filename.lower().endswith(extensions):
+            raise HTTPException(status_code=400, detail=invalid_type_detail)
+
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            path = os.path.join(directory, f"{len(result.files)}_{filename}")
+        state["file"] = IngestedFile(filename, path)
+        result.files.append(state["file"])
+
+    def on_part_data(data, start, end):
+        upload = state["file"]
+        if upload is None:
+            state["value"] += data[start:end]
+            if len(state["value"]) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {state['field']} is too large.")
+            return
+        upload.write(data[start:end])
+        if upload.size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_FILE_SIZE_MB:g} MB.")
+
+    def on_part_end():
+        if state["file"] is not None:
+            state["file"].close()
+            state["file"] = None
+        elif state["field"] is not None:
+            result.fields[state["field"]] = state["value"].decode("utf-8", "replace")
+            state["field"] = None
+
+    parser = MultipartParser(boundary, callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except HTTPException:
+        _discard(result)
+        raise
+    except Exception as e:
+        _discard(result)
+        raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+
+    if not result.files:
+        raise HTTPException(status_code=400, detail="No file uploaded.")
+    for upload in result.files:
+        upload.close()
+        upload.kind = sniff_kind(upload.path)
+    return result
+
+
+async def ingest_upload(request: Request, directory: str, extensions: Optional[tuple] = None,
+                        kinds: Optional[tuple] = None, invalid_type_detail: str = "Invalid file type.") -> IngestedRequest:
+    """Ingest a single-file upload and check its sniffed type against kinds."""
+    ingested = await ingest_request(
+        request, directory, max_files=1, extensions=extensions, invalid_type_detail=invalid_type_detail
+    )
+    if kinds and ingested.file.kind not in kinds:
+        _discard(ingested)
+        raise HTTPException(status_code=400, detail=f"{invalid_type_detail} The file content does not match its extension.")
+    return ingested
+
+
+def _discard(result: IngestedRequest):
+    for upload in result.files:
+        upload.close()
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
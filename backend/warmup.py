@@ -0,0 +1,98 @@
+"""
+Preloading of converter backends after the server has started.
+
+Document libraries are imported on first use (see converter.py and
+operations.LazyFunction), which keeps cold starts short but makes the first
+request of each kind pay for the import. Once the server is accepting
+requests, the backends named in WARMUP_BACKENDS are loaded in the
+background, so the hot paths are ready before most requests need them.
+Process pool workers load the same list when they start.
+"""
+import importlib
+import os
+import threading
+import time
+
+from logs import get_logger
+
+# Comma-separated names from BACKENDS, plus "renderers" (fonts and
+# stylesheets) and "process-pool" (start every worker process). Empty
+# disables the warm-up.
+WARMUP_BACKENDS = os.getenv("WARMUP_BACKENDS", "pymupdf,renderers,process-pool")
+
+BACKENDS = {
+    # Editing, compression, rendering and repair of PDFs
+    "pymupdf": ("fitz", "stamping", "pdf_opener", "pdf_editor"),
+    "office": ("docx", "pptx", "openpyxl"),
+    "reportlab": ("reportlab.platypus", "reportlab.pdfgen.canvas"),
+    "images": ("PIL.Image", "img2pdf"),
+    "pdfplumber": ("pdfplumber",),
+    "pdf2docx": ("pdf2docx",),
+    "pypdf": ("pypdf",),
+    "weasyprint": ("weasyprint",),
+}
+
+
+def _start_process_pool():
+    from executor import start_process_pool
+
+    start_process_pool()
+
+
+def _warm_renderers():
+    from renderer_resources import warm_up as warm_up_renderers
+
+    warm_up_renderers()
+
+
+SPECIAL_BACKENDS = {
+    "renderers": _warm_renderers,
+    "process-pool": _start_process_pool,
+}
+
+log = get_logger("warmup")
+_lock = threading.Lock()
+_results = {}
+
+
+def configured_backends() -> list:
+    return [name.strip() for name in WARMUP_BACKENDS.split(",") if name.strip()]
+
+
+def warm_up(names: list = None, in_worker: bool = False) -> dict:
+    """
+    Load the given backends (WARMUP_BACKENDS by default).
+
+    Failures are reported, never raised: a backend that cannot be loaded
+    will fail again, with a proper error, on the request that needs it.
+    Returns {name: {"seconds": ..., "error": ...}}.
+    """
+    results = {}
+    for name in configured_backends() if names is None else names:
+        if in_worker and name == "process-pool":
+            continue
+        started = time.perf_counter()
+        error = None
+        try:
+            if name in SPECIAL_BACKENDS:
+                SPECIAL_BACKENDS[name]()
+            elif name in BACKENDS:
+                for module in BACKENDS[name]:
+                    importlib.import_module(module)
+            else:
+                error = "unknown backend"
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+        results[name] = {"seconds": round(time.perf_counter() - started, 3), "error": error}
+        if error:
+            log.warning("Warm-up failed", extra={"backend": name, "error": error})
+
+    if not in_worker:
+        with _lock:
+            _results.update(results)
+    return results
+
+
+def stats() -> dict:
+    with _lock:
+        return {"configured": configured_backends(), "backends": dict(_results)}
@@ -0,0 +1,234 @@
+"""
+Per-request scratch directories with guaranteed cleanup and a disk budget.
+
+Every request gets its own workspace directory. Everything a conversion
+writes next to its input (outputs, repaired "_repaired.pdf" copies,
+LibreOffice side files) lives inside it and is removed recursively with it.
+Small jobs can be placed on a RAM-backed filesystem. Before a workspace is
+handed out, the expected disk use is reserved against a global budget, and a
+background janitor removes directories left behind by crashed workers.
+Workspace names start with the pid of the process that owns them, so the
+janitor of one prefork worker leaves the workspaces of the others alone.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from logs import get_logger
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "instantpdf-work"))
+WORKSPACE_RAM_ROOT = os.getenv(
+    "WORKSPACE_RAM_ROOT", "/dev/shm/instantpdf-work" if os.path.isdir("/dev/shm") else ""
+)
+WORKSPACE_RAM_MAX_MB = float(os.getenv("WORKSPACE_RAM_MAX_MB", "5"))
+WORKSPACE_RAM_BUDGET_MB = float(os.getenv("WORKSPACE_RAM_BUDGET_MB", "256"))
+WORKSPACE_DISK_BUDGET_MB = float(os.getenv("WORKSPACE_DISK_BUDGET_MB", "4096"))
+# Reserve this many times the upload size: input, output and intermediate files
+WORKSPACE_RESERVE_FACTOR = float(os.getenv("WORKSPACE_RESERVE_FACTOR", "3"))
+WORKSPACE_ORPHAN_MAX_AGE_MINUTES = float(os.getenv("WORKSPACE_ORPHAN_MAX_AGE_MINUTES", "60"))
+WORKSPACE_JANITOR_INTERVAL_SECONDS = float(os.getenv("WORKSPACE_JANITOR_INTERVAL_SECONDS", "300"))
+
+MB = 1024 * 1024
+# Lower bound on a reservation, for requests without a Content-Length
+MIN_RESERVATION = 1 * MB
+
+log = get_logger("workspace")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkspaceBudgetExceeded(Exception):
+    """Raised when admitting another workspace would exceed the disk budget."""
+
+
+class Workspace:
+    """A scratch directory owned by one request."""
+
+    def __init__(self, manager, path: str, reserved_bytes: int, in_ram: bool):
+        self.manager = manager
+        self.path = path
+        self.reserved_bytes = reserved_bytes
+        self.in_ram = in_ram
+        self._released = False
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        """Remove the directory and everything in it, and free the reservation."""
+        if self._released:
+            return
+        self._released = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manager._release(self)
+
+
+class WorkspaceManager:
+    def __init__(self, root: str = WORKSPACE_ROOT, ram_root: str = WORKSPACE_RAM_ROOT,
+                 disk_budget: int = int(WORKSPACE_DISK_BUDGET_MB * MB),
+                 ram_budget: int = int(WORKSPACE_RAM_BUDGET_MB * MB),
+                 ram_max_size: int = int(WORKSPACE_RAM_MAX_MB * MB)):
+        self.root = root
+        self.ram_root = ram_root
+        self.disk_budget = disk_budget
+        self.ram_budget = ram_budget
+        self.ram_max_size = ram_max_size
+        self._lock = threading.Lock()
+        self._active = set()
+        self._disk_reserved = 0
+        self._ram_reserved = 0
+        self._janitor = None
+        self._stop = threading.Event()
+        self.created = 0
+        self.cleaned = 0
+        self.rejected = 0
+        self.orphans_removed = 0
+
+    def acquire(self, size_hint: int = 0) -> Workspace:
+        """
+        Create a workspace for a request whose upload is about size_hint bytes.
+
+        Raises WorkspaceBudgetExceeded if the reservation does not fit.
+        """
+        reservation = max(int(size_hint * WORKSPACE_RESERVE_FACTOR), MIN_RESERVATION)
+        with self._lock:
+            use_ram = (
+                bool(self.ram_root)
+                and 0 < size_hint <= self.ram_max_size
+                and self._ram_reserved + reservation <= self.ram_budget
+            )
+            if not use_ram and self._disk_reserved + reservation > self.disk_budget:
+                self.rejected += 1
+                raise WorkspaceBudgetExceeded(
+                    f"Workspace budget exhausted ({self._disk_reserved // MB} MB of "
+                    f"{self.disk_budget // MB} MB reserved)"
+                )
+            if use_ram:
+                self._ram_reserved += reservation
+            else:
+                self._disk_reserved += reservation
+
+        root = self.ram_root if use_ram else self.root
+        path = os.path.join(root, f"{os.getpid()}-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(path)
+        except OSError:
+            with self._lock:
+                if use_ram:
+                    self._ram_reserved -= reservation
+                else:
+                    self._disk_reserved -= reservation
+            raise
+
+        workspace = Workspace(self, path, reservation, use_ram)
+        with self._lock:
+            self._active.add(path)
+            self.created += 1
+        return workspace
+
+    def _release(self, workspace: Workspace):
+        with self._lock:
+            self._active.discard(workspace.path)
+            if workspace.in_ram:
+                self._ram_reserved -= workspace.reserved_bytes
+            else:
+                self._disk_reserved -= workspace.reserved_bytes
+            self.cleaned += 1
+
+    def sweep_orphans(self, max_age_seconds: float = WORKSPACE_ORPHAN_MAX_AGE_MINUTES * 60) -> int:
+        """
+        Remove workspace directories nobody owns that are older than
+        max_age_seconds. Those of other processes that are still running are
+        theirs, however old.
+        """
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for root in filter(None, (self.root, self.ram_root)):
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                with self._lock:
+                    if entry.path in self._active:
+                        continue
+                owner = entry.name.split("-", 1)[0]
+                if owner.isdigit() and int(owner) != os.getpid() and _pid_alive(int(owner)):
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        continue
+                removed += 1
+        with self._lock:
+            self.orphans_removed += removed
+        return removed
+
+    def _janitor_loop(self):
+        while not self._stop.wait(WORKSPACE_JANITOR_INTERVAL_SECONDS):
+            try:
+                removed = self.sweep_orphans()
+                if removed:
+                    log.info("Workspace janitor removed orphaned entries", extra={"entries": removed})
+            except Exception as e:
+                log.error("Workspace janitor failed", extra={"error": str(e)})
+
+    def start_janitor(self):
+        if self._janitor is None:
+            self._stop.clear()
+            self._janitor = threading.Thread(target=self._janitor_loop, daemon=True)
+            self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+        self._janitor = None
+
+    @staticmethod
+    def _disk_usage(root: str) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "active": len(self._active),
+                "disk_reserved_bytes": self._disk_reserved,
+                "disk_budget_bytes": self.disk_budget,
+                "ram_reserved_bytes": self._ram_reserved,
+                "ram_budget_bytes": self.ram_budget if self.ram_root else 0,
+                "created": self.created,
+                "cleaned": self.cleaned,
+                "rejected": self.rejected,
+                "orphans_removed": self.orphans_removed,
+            }
+        stats["disk_used_bytes"] = self._disk_usage(self.root)
+        stats["ram_used_bytes"] = self._disk_usage(self.ram_root) if self.ram_root else 0
+        return stats
+
+
+workspace_manager = WorkspaceManager()
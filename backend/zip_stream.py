@@ -0,0 +1,61 @@
+"""
+ZIP archives built on the fly for streaming responses.
+
+zipfile can write to a non-seekable stream by putting sizes and CRCs in data
+descriptors after each entry. We give it a sink that just collects bytes, and
+hand those bytes to the response after every entry, so only the entry being
+added is ever held in memory.
+"""
+import io
+import zipfile
+
+
+class _Sink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, *args):
+        raise OSError("ZIP stream is not seekable")
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStream:
+    """Incrementally built ZIP archive: add() and close() return the new bytes."""
+
+    def __init__(self, compression: int = zipfile.ZIP_STORED):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=compression)
+
+    def add(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(name, data)
+        return self._sink.drain()
+
+    def add_file(self, name: str, path: str) -> bytes:
+        self._zip.write(path, arcname=name)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
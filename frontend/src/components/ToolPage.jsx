@@ -7,6 +7,7 @@ export default function ToolPage({ title, description, endpoint, accept, icon: I
     const [file, setFile] = useState(null);
     const [status, setStatus] = useState('idle'); // idle, converting, done, error
     const [downloadUrl, setDownloadUrl] = useState(null);
+    const [downloadType, setDownloadType] = useState('');
     const [error, setError] = useState(null);
     const [isDragging, setIsDragging] = useState(false);
     const [progress, setProgress] = useState(0);
@@ -134,6 +135,7 @@ export default function ToolPage({ title, description, endpoint, accept, icon: I
 
             const url = window.URL.createObjectURL(blob);
             setDownloadUrl(url);
+            setDownloadType(blob.type);
             setStatus('done');
             setShowConfetti(true); // 🎉 Trigger confetti!
 
@@ -276,7 +278,7 @@ export default function ToolPage({ title, description, endpoint, accept, icon: I
                                         endpoint.includes('pdf-to-word') ? `${file.name.split('.')[0]}.docx` :
                                             endpoint.includes('pdf-to-excel') ? `${file.name.split('.')[0]}.xlsx` :
                                                 (endpoint.includes('pdf-to-powerpoint') || endpoint.includes('pdf-to-ppt')) ? `${file.name.split('.')[0]}.pptx` :
-                                                    endpoint.includes('pdf-to-jpg') ? `${file.name.split('.')[0]}.jpg` :
+                                                    endpoint.includes('pdf-to-jpg') ? `${file.name.split('.')[0]}${downloadType === 'application/zip' ? '_pages.zip' : '.jpg'}` :
                                                         endpoint.includes('compress/pdf') ? `${file.name.split('.')[0]}_compressed.pdf` :
                                                             `${file.name.split('.')[0]}.pdf`
                                     }